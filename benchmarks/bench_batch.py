@@ -0,0 +1,66 @@
+"""Files per second of ``lint`` / ``format --check`` over a synthetic tree.
+
+The tree is generated in a temporary directory and checked without the
+result cache for each worker count, then once more warm from the cache.
+
+Usage: python benchmarks/bench_batch.py [--files N] [--lines L] [--workers 0,1,2,4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.batch import run_checks  # noqa: E402
+
+BLOCK = """\
+use "data/raw.dta", clear
+local controls age educ income
+foreach v of varlist `controls' {
+    replace `v'=. if `v'<0
+    gen log_`v'=log(`v') // natural log
+}
+reg y x1 x2 `controls' if sample==1 , robust cluster(id)
+keep if !missing(y)&x>0
+"""
+
+
+def timed(paths, **kwargs):
+    start = time.perf_counter()
+    reports = sum(1 for _ in run_checks(paths, **kwargs))
+    return reports, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--lines", type=int, default=200)
+    parser.add_argument("--workers", default="0,1,2,4")
+    parser.add_argument("--format", action="store_true", help="Also check formatting")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "project")
+        text = BLOCK * (args.lines // BLOCK.count("\n"))
+        for i in range(args.files):
+            path = os.path.join(root, f"dir{i % 20}", f"file{i}.do")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+
+        print(f"{args.files} files of {args.lines} lines, {os.cpu_count()} cores")
+        for workers in map(int, args.workers.split(",")):
+            count, elapsed = timed(
+                [root], check_format=args.format, workers=workers, use_cache=False
+            )
+            print(f"{workers:3d} workers: {count / elapsed:8.1f} files/s")
+        cache_dir = os.path.join(directory, "cache")
+        timed([root], check_format=args.format, cache_dir=cache_dir)
+        count, elapsed = timed([root], check_format=args.format, cache_dir=cache_dir)
+        print(f"{'warm cache':>11}: {count / elapsed:8.1f} files/s")
+
+
+if __name__ == "__main__":
+    main()
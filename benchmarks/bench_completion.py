@@ -0,0 +1,57 @@
+"""Completion payloads: the full command list against ranked top-N results.
+
+Usage: python benchmarks/bench_completion.py [--requests N] [--limit N]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pygls.protocol import default_converter  # noqa: E402
+
+from server import utils  # noqa: E402
+from server.completion import CompletionIndex  # noqa: E402
+
+
+def payload_size(converter, result):
+    return len(json.dumps(converter.unstructure(result)).encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    converter = default_converter()
+    commands = utils.getCommands()
+    full = utils.getComList()
+    index = CompletionIndex(commands)
+
+    rng = random.Random(0)
+    prefixes = []
+    for _ in range(args.requests):
+        word = rng.choice(commands)
+        prefixes.append(word[: rng.randint(0, min(len(word), 4))])
+
+    start = time.perf_counter()
+    results = [index.complete(prefix, args.limit) for prefix in prefixes]
+    elapsed = time.perf_counter() - start
+
+    sample = results[:500]
+    ranked_bytes = sum(payload_size(converter, r) for r in sample) / len(sample)
+    full_bytes = payload_size(converter, full)
+    print(f"{len(commands)} commands, limit {args.limit}")
+    print(f"{'full list':>12}: {full_bytes:10.0f} bytes/response")
+    print(
+        f"{'ranked':>12}: {ranked_bytes:10.0f} bytes/response, "
+        f"{elapsed / args.requests * 1e6:6.1f} us/request"
+    )
+
+
+if __name__ == "__main__":
+    main()
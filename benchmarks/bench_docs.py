@@ -0,0 +1,78 @@
+"""Hover documentation lookups: loose md_syntax files against the packed archive.
+
+Usage: python benchmarks/bench_docs.py [--lookups N]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.docpack import DocPack, build_pack_from_dir  # noqa: E402
+
+MD_SYNTAX = os.path.join(os.path.dirname(__file__), "..", "server", "md_syntax")
+
+
+def loose_lookup(word):
+    try:
+        with open(os.path.join(MD_SYNTAX, word + ".md"), "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+
+def bench(label, lookup, words):
+    start = time.perf_counter()
+    for word in words:
+        lookup(word)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    for word in words[:200]:
+        lookup(word)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:>22}: {elapsed / len(words) * 1e6:8.1f} us/hover, "
+        f"peak {peak / 1024:8.1f} KiB over 200 hovers"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    names = sorted(f[:-3] for f in os.listdir(MD_SYNTAX) if f.endswith(".md"))
+    loose_size = sum(os.path.getsize(os.path.join(MD_SYNTAX, n + ".md")) for n in names)
+    rng = random.Random(0)
+    hits = [rng.choice(names) for _ in range(args.lookups)]
+    misses = [f"var{i}" for i in range(args.lookups)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "md_syntax.pack")
+        start = time.perf_counter()
+        build_pack_from_dir(MD_SYNTAX, path)
+        print(f"pack built in {time.perf_counter() - start:.2f}s")
+        print(f"install size: {len(names)} files {loose_size / 1e6:.1f} MB, "
+              f"pack {os.path.getsize(path) / 1e6:.1f} MB")
+
+        start = time.perf_counter()
+        pack = DocPack(path)
+        print(f"pack opened in {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+        def pack_lookup(word):
+            return pack.get(word) or ""
+
+        bench("loose files, hits", loose_lookup, hits)
+        bench("pack, hits", pack_lookup, hits)
+        bench("loose files, misses", loose_lookup, misses)
+        bench("pack, misses", pack_lookup, misses)
+        pack.close()
+
+
+if __name__ == "__main__":
+    main()
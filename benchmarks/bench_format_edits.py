@@ -0,0 +1,94 @@
+"""Formatting responses: whole-document replacement against minimal line hunks.
+
+A formatted file is perturbed on a few lines, then formatted again.  Reports
+the diff time, the JSON size of the response and how long applying the
+edits to a document takes.
+
+Usage: python benchmarks/bench_format_edits.py [--lines N] [--changed K]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lsprotocol.types import (  # noqa: E402
+    Position,
+    Range,
+    TextDocumentContentChangeEvent_Type1,
+    TextEdit,
+)
+from pygls.protocol import default_converter  # noqa: E402
+
+from server.document import StataDocument  # noqa: E402
+from server.formatter import format_stata_code  # noqa: E402
+from server.textdiff import text_edits  # noqa: E402
+
+BLOCK = """\
+use "data/raw.dta", clear
+local controls age educ income
+foreach v of varlist `controls' {
+    replace `v' = . if `v' < 0
+    gen log_`v' = log(`v') // natural log
+}
+reg y x1 x2 `controls' if sample == 1, robust cluster(id)
+keep if !missing(y) & x > 0
+"""
+
+
+def whole_document_edit(lines, text):
+    end = Position(line=len(lines) - 1, character=len(lines[-1]))
+    return [TextEdit(range=Range(start=Position(line=0, character=0), end=end), new_text=text)]
+
+
+def apply(text, edits):
+    document = StataDocument("file:///bench.do", text)
+    start = time.perf_counter()
+    for edit in reversed(edits):
+        document.apply_change(
+            TextDocumentContentChangeEvent_Type1(range=edit.range, text=edit.new_text)
+        )
+    _ = document.lines
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--changed", type=int, default=3)
+    args = parser.parse_args()
+
+    source = BLOCK * (args.lines // BLOCK.count("\n"))
+    formatted = format_stata_code(source, max_line_length=120)
+    lines = formatted.splitlines(keepends=True)
+    rng = random.Random(0)
+    candidates = [lineno for lineno, line in enumerate(lines) if " = " in line]
+    for lineno in rng.sample(candidates, args.changed):
+        lines[lineno] = lines[lineno].replace(" = ", "=")
+    text = "".join(lines)
+
+    start = time.perf_counter()
+    new_text = format_stata_code(text, max_line_length=120)
+    format_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hunks = text_edits(lines, new_text.splitlines(keepends=True))
+    diff_time = time.perf_counter() - start
+    whole = whole_document_edit(lines, new_text)
+
+    converter = default_converter()
+    print(f"{len(lines)} lines, {args.changed} changed, format {format_time * 1e3:.1f} ms")
+    for label, edits in (("whole document", whole), ("line hunks", hunks)):
+        size = len(json.dumps(converter.unstructure(edits)).encode("utf-8"))
+        print(
+            f"{label:>15}: {len(edits):5d} edits, {size:10d} bytes, "
+            f"apply {apply(text, edits) * 1e3:7.2f} ms"
+        )
+    print(f"{'diff':>15}: {diff_time * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
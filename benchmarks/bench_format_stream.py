@@ -0,0 +1,79 @@
+"""Peak memory of formatting a large do-file in memory against streaming it.
+
+The file is written to a temporary directory, then formatted once by
+reading it whole with ``format_stata_code`` and once with ``format_stream``
+from the open file to another file.  Peak Python allocations come from
+``tracemalloc``; the streamed peak should not grow with ``--lines``.
+
+Usage: python benchmarks/bench_format_stream.py [--lines N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.formatter import format_stata_code, format_stream  # noqa: E402
+
+BLOCK = """\
+use "data/raw.dta", clear
+local controls age educ income
+foreach v of varlist `controls' {
+    replace `v'=. if `v'<0
+    gen log_`v'=log(`v') // natural log
+}
+reg y x1 x2 `controls' if sample==1 , robust cluster(id)
+keep if !missing(y)&x>0
+"""
+
+
+def in_memory(source, target):
+    with open(source, encoding="utf-8") as infile:
+        text = format_stata_code(infile.read(), max_line_length=120)
+    with open(target, "w", encoding="utf-8") as outfile:
+        outfile.write(text)
+
+
+def streamed(source, target):
+    with open(source, encoding="utf-8") as infile, open(target, "w", encoding="utf-8") as outfile:
+        format_stream(infile, outfile, max_line_length=120)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "big.do")
+        with open(source, "w", encoding="utf-8") as outfile:
+            outfile.write(BLOCK * (args.lines // BLOCK.count("\n")))
+        size = os.path.getsize(source)
+        outputs = []
+        for label, function in (("in memory", in_memory), ("streamed", streamed)):
+            target = os.path.join(directory, label.replace(" ", "_") + ".do")
+            elapsed, peak = measure(function, source, target)
+            with open(target, encoding="utf-8") as infile:
+                outputs.append(infile.read())
+            print(
+                f"{label:>10}: {size / 1e6:7.1f} MB input, peak {peak / 1e6:8.2f} MB, "
+                f"{elapsed:6.2f} s"
+            )
+        assert outputs[0] == outputs[1]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Throughput of the token based linter against the former regex pipeline.
+
+Usage: python benchmarks/bench_lexer.py [--lines N] [--repeat R] [file.do]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import server.constants as constants  # noqa: E402
+from server.lexer import tokenize  # noqa: E402
+from server.linter import lint_lines  # noqa: E402
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "server", "tests", "example.do")
+
+SAMPLE = """\
+* Clean the data
+use "data/raw.dta", clear
+/* Block comment
+   spanning lines */
+local controls age educ income
+foreach v of varlist `controls' {
+    replace `v' = . if `v' < 0
+    gen log_`v' = log(`v') // natural log
+}
+reg y x1 x2 `controls' if sample==1, robust cluster(id)
+reg y x1 x2 ///
+    x3 x4, ///
+    robust
+keep if !missing(y) & x>0
+label define yes 1 "Yes" 0 "No"
+display `"compound "quoted" string"' + "$outdir"
+"""
+
+
+def _in_skip_tokens(start, end, skip_tokens):
+    for token in skip_tokens:
+        if start >= token[0] and end <= token[1]:
+            return True
+    return False
+
+
+def regex_lint(lines):
+    """The per-line regex pipeline refresh_diagnostics used before the lexer."""
+    findings = 0
+    is_in_comm, loop_level, prev_comm = False, 0, 0
+    for line in lines:
+        remaining = line.split("//")[0]
+        if (
+            len(remaining) > constants.MAX_LINE_LENGTH
+            and not re.findall(r"^\s*\*\s", remaining)
+            and not remaining.startswith(("// ", "/* ", "*/ "))
+        ):
+            findings += 1
+        skip_tokens = []
+        if not is_in_comm:
+            match = re.match(constants.BLOCK_COMMENTS_BG, line)
+            if match is not None:
+                is_in_comm = True
+                skip_tokens.append([match.start(1), match.end(1)])
+        else:
+            match = re.match(constants.BLOCK_COMMENTS_END, line)
+            if match is None:
+                continue
+            is_in_comm = False
+            skip_tokens.append([match.start(1), match.end(1)])
+        if re.match(constants.STAR_COMMENTS, line):
+            continue
+        match = re.match(constants.INLINE_COMM_RE, line)
+        if match and match.group(1) != "":
+            skip_tokens.append([match.start(1), match.end(1)])
+        for match in constants.STRING.finditer(line):
+            start, end = match.span()
+            if not _in_skip_tokens(start, end, skip_tokens):
+                skip_tokens.append([start, end])
+        for match in constants.OPERATOR_REGEX.finditer(line):
+            for sindex in range(1, 3):
+                start, end = match.start(sindex), match.end(sindex)
+                if not _in_skip_tokens(start, end, skip_tokens) and end - start != 1:
+                    findings += 1
+        for match in constants.WHITESPACE_AFTER_COMMA_REGEX.finditer(line):
+            start, end = match.start(1), match.end(1)
+            if not _in_skip_tokens(start, end, skip_tokens) and end - start != 1:
+                findings += 1
+        if re.match(constants.LOOP_END, line) and loop_level > 0:
+            loop_level -= 1
+        match = re.match(constants.INDENT_REGEX, line)
+        if match:
+            actual = match.end(1) - match.start(1)
+            if actual != (loop_level + prev_comm) * constants.INDENT_SPACE:
+                findings += 1
+        if re.match(constants.LOOP_START, line):
+            loop_level += 1
+        has_long_comment = re.search(constants.INLINE_COMM_LONG, line) is not None
+        if prev_comm > 0 and not has_long_comment:
+            prev_comm -= 1
+        if has_long_comment:
+            prev_comm = 1
+    return findings
+
+
+def token_lint(lines):
+    return sum(map(len, lint_lines(lines).line_diagnostics))
+
+
+def tokenize_only(lines):
+    return sum(len(tokens) for tokens, _ in tokenize(lines))
+
+
+def bench(func, lines, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(lines)
+        best = min(best, time.perf_counter() - start)
+    return len(lines) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", nargs="?", help="do-file to use instead of the sample")
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as f:
+            text = f.read()
+    else:
+        text = SAMPLE
+    base = text.splitlines(True)
+    lines = (base * (args.lines // len(base) + 1))[: args.lines]
+
+    print(f"{len(lines)} lines, best of {args.repeat}")
+    for name, func in (
+        ("regex pipeline", regex_lint),
+        ("token linter", token_lint),
+        ("tokenize only", tokenize_only),
+    ):
+        print(f"{name:>16}: {bench(func, lines, args.repeat):>12,.0f} lines/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Breaking very long lines: single scan engine against the former rescanning one.
+
+Usage: python benchmarks/bench_line_breaking.py [--chars N] [--max-line-length L] [--repeat R]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.formatter import StataFormatter  # noqa: E402
+
+
+class LegacyFormatter(StataFormatter):
+    """The breaking engine before the single scan rewrite."""
+
+    def _break_long_line(self, line, comment):
+        parts = line.split("//", 1)
+        remaining = parts[0]
+        remaining_comment = (
+            " //" + comment + parts[1] if len(parts) > 1 else " // " + comment if comment else ""
+        )
+        if len(remaining) <= self.max_line_length or re.search(r"^\*\s", remaining):
+            return [remaining + remaining_comment]
+        result_lines = []
+        while len(remaining) > self.max_line_length + 4:
+            break_result = self._try_break(remaining, self._find_break_points)
+            if break_result is None:
+                break_result = self._try_break(remaining, self._find_space_break_points)
+            if break_result:
+                segment, remaining = break_result
+                result_lines.append(segment)
+                continue
+            result_lines.append(remaining.strip() + remaining_comment)
+            remaining = ""
+        if remaining:
+            result_lines.append(remaining.strip() + remaining_comment)
+        return result_lines
+
+    def _find_break_points(self, text, max_length):
+        points = [m.end() for m in re.finditer(r"[)\]][,|\s]", text[:max_length])]
+        points += [m.end() for m in re.finditer(r",", text[:max_length])]
+        points += [m.end() for m in re.finditer(r"\s(&|\||/|:)\s", text[:max_length])]
+        return sorted(points, reverse=True)
+
+    def _find_space_break_points(self, text, max_length):
+        return sorted((m.end() for m in re.finditer(r"\s", text[: max_length - 3])), reverse=True)
+
+    def _is_valid_break_point(self, segment):
+        return (
+            segment.count("{") - segment.count("}") <= 0
+            and segment.count('"') % 2 == 0
+            and segment.count("`") <= segment.count("'")
+        )
+
+    def _try_break(self, text, find_points):
+        for break_pos in find_points(text, self.max_line_length):
+            segment = text[:break_pos]
+            if self._is_valid_break_point(segment):
+                return segment.strip() + " ///", text[break_pos:]
+        return None
+
+
+def long_lines(chars):
+    variables = " ".join(f"var{i}" for i in range(chars // 6))
+    conditions = " | ".join(f"(x{i} == {i} & y{i} != `k')" for i in range(chars // 26))
+    return {
+        "reg with variables": f"reg y {variables}, robust cluster(id)"[:chars],
+        "keep if conditions": f"keep if {conditions}"[:chars],
+        "open string": 'display "' + ", ".join(f"item{i}" for i in range(chars // 7)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chars", type=int, default=10000)
+    parser.add_argument("--max-line-length", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    new = StataFormatter(max_line_length=args.max_line_length)
+    old = LegacyFormatter(max_line_length=args.max_line_length)
+    for label, line in long_lines(args.chars).items():
+        timings = []
+        for formatter in (old, new):
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = formatter._break_long_line(line, "")
+                best = min(best, time.perf_counter() - start)
+            timings.append(best)
+        assert result == old._break_long_line(line, "")
+        print(
+            f"{label:>20}: {len(line):6d} chars, {len(result):4d} lines, "
+            f"before {timings[0] * 1e3:8.2f} ms, after {timings[1] * 1e3:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Many concurrent clients of one multi-session server against one process each.
+
+Starts ``python -m server --tcp --sessions`` and opens ``--clients``
+connections at once; each initializes, opens a generated do-file, asks for
+a completion and a hover, and stays connected.  Reports:
+
+- setup: connect until the ``initialize`` response, median and 95th percentile,
+  and of one client connecting alone before the others
+- first completion: from sending it after ``didOpen`` until the response
+- memory: server RSS after loading the shared data, and per session once
+  every client is connected
+
+and, for comparison, the RSS and initialize time of a stdio server process
+serving one such client, the cost per user of a process per user.  RSS is
+read from /proc, so Linux only.
+
+Usage: python benchmarks/bench_sessions.py [--clients 200] [--lines 500]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_startup import receive, send  # noqa: E402
+from corpus import generate  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("no VmRSS")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def document(uri: str, text: str) -> dict:
+    return {"textDocument": {"uri": uri, "languageId": "stata", "version": 1, "text": text}}
+
+
+def position(uri: str, line: int, character: int) -> dict:
+    return {"textDocument": {"uri": uri}, "position": {"line": line, "character": character}}
+
+
+class Client:
+    """A JSON-RPC client over one TCP connection."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+
+    def notify(self, method: str, params) -> None:
+        self._write({"jsonrpc": "2.0", "method": method, "params": params})
+
+    async def request(self, method: str, params):
+        self.next_id += 1
+        message_id = self.next_id
+        self._write({"jsonrpc": "2.0", "id": message_id, "method": method, "params": params})
+        while True:
+            headers = await self.reader.readuntil(b"\r\n\r\n")
+            length = int(headers.split(b"Content-Length:")[1].split(b"\r\n")[0])
+            message = json.loads(await self.reader.readexactly(length))
+            if message.get("id") == message_id and "method" not in message:
+                return message
+
+    def _write(self, message: dict) -> None:
+        body = json.dumps(message).encode("utf-8")
+        self.writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+
+
+async def session(port: int, number: int, text: str, connected, ready: asyncio.Event):
+    """One client; returns (setup, first completion) seconds once ``ready`` is set.
+
+    It appends to ``connected`` when it has its answers and waits for ``ready``.
+    """
+    uri = f"file:///home/user{number}/analysis.do"
+    start = time.perf_counter()
+    client = Client(*await asyncio.open_connection("127.0.0.1", port))
+    response = await client.request(
+        "initialize",
+        {"processId": None, "rootUri": None, "capabilities": {}},
+    )
+    assert "result" in response, response
+    setup = time.perf_counter() - start
+    client.notify("initialized", {})
+    client.notify("textDocument/didOpen", document(uri, text))
+    start = time.perf_counter()
+    items = (await client.request("textDocument/completion", position(uri, 0, 2)))["result"]
+    completion = time.perf_counter() - start
+    assert items, "no completion items"
+    await client.request("textDocument/hover", position(uri, 0, 1))
+    connected.append(number)
+    await ready.wait()
+    await client.request("shutdown", None)
+    client.notify("exit", None)
+    client.writer.close()
+    return setup, completion
+
+
+async def connect_all(port: int, clients: int, text: str, pid: int):
+    """Run the clients; return their results and the server RSS with all connected."""
+    connected, ready = [], asyncio.Event()
+    alone = asyncio.Event()
+    alone.set()
+    (idle_setup, _), = await asyncio.gather(session(port, clients, text, [], alone))
+    tasks = [
+        asyncio.ensure_future(session(port, i, text, connected, ready)) for i in range(clients)
+    ]
+    while len(connected) < clients:
+        failed = [task for task in tasks if task.done() and task.exception()]
+        if failed:
+            raise failed[0].exception()
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+    rss = rss_mb(pid)
+    ready.set()
+    return await asyncio.gather(*tasks), rss, idle_setup
+
+
+def multi_session(clients: int, text: str):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "server", "--tcp", "--sessions", "--port", str(port)],
+        cwd=ROOT,
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+        time.sleep(0.2)
+        loaded = rss_mb(process.pid)
+        results, connected, idle_setup = asyncio.run(
+            connect_all(port, clients, text, process.pid)
+        )
+    finally:
+        process.terminate()
+        process.wait(10)
+    return loaded, connected, results, idle_setup
+
+
+def single_process(text: str):
+    """RSS and initialize time of a stdio server serving one client."""
+    uri = "file:///home/user/analysis.do"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "server"], cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    send(process, 1, "initialize", {"processId": None, "rootUri": None, "capabilities": {}})
+    receive(process, 1)
+    initialized = time.perf_counter() - start
+    send(process, None, "initialized", {})
+    send(process, None, "textDocument/didOpen", document(uri, text))
+    send(process, 2, "textDocument/completion", position(uri, 0, 2))
+    receive(process, 2)
+    send(process, 3, "textDocument/hover", position(uri, 0, 1))
+    receive(process, 3)
+    time.sleep(0.5)
+    rss = rss_mb(process.pid)
+    send(process, 4, "shutdown", None)
+    receive(process, 4)
+    send(process, None, "exit", None)
+    process.wait(10)
+    return rss, initialized
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=500)
+    args = parser.parse_args()
+    text = "su" + generate(args.lines)[2:]
+
+    loaded, connected, results, idle_setup = multi_session(args.clients, text)
+    setups = [setup for setup, _ in results]
+    completions = [completion for _, completion in results]
+    single_rss, single_init = single_process(text)
+
+    print(f"{args.clients} sessions in one process")
+    print(f"  {'setup alone':>18}: {idle_setup * 1e3:8.1f} ms")
+    print(
+        f"  {'setup':>18}: {statistics.median(setups) * 1e3:8.1f} ms"
+        f" (p95 {percentile(setups, 0.95) * 1e3:.1f})"
+    )
+    print(
+        f"  {'first completion':>18}: {statistics.median(completions) * 1e3:8.1f} ms"
+        f" (p95 {percentile(completions, 0.95) * 1e3:.1f})"
+    )
+    print(f"  {'rss loaded':>18}: {loaded:8.1f} MB")
+    print(f"  {'rss connected':>18}: {connected:8.1f} MB")
+    print(f"  {'per session':>18}: {(connected - loaded) / args.clients * 1024:8.1f} KB")
+    print("one process per client")
+    print(f"  {'initialize':>18}: {single_init * 1e3:8.1f} ms")
+    print(f"  {'rss':>18}: {single_rss:8.1f} MB")
+    print(f"  {'x clients':>18}: {single_rss * args.clients:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
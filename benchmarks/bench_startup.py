@@ -0,0 +1,111 @@
+"""Cold start of the server and the command line, each in a new process.
+
+Times, as the median over ``--repeat`` fresh interpreters:
+
+- initialize: process start until the ``initialize`` response
+- completion: process start until the first completion list, sent right
+  after ``initialized`` (so it may race the background warm-up)
+- format: ``python -m server format -`` on a one line file, start to exit
+
+Usage: python benchmarks/bench_startup.py [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+URI = "file:///bench/startup.do"
+
+
+def send(process, message_id, method, params):
+    message = {"jsonrpc": "2.0", "method": method, "params": params}
+    if message_id is not None:
+        message["id"] = message_id
+    body = json.dumps(message).encode("utf-8")
+    process.stdin.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    process.stdin.flush()
+
+
+def receive(process, message_id):
+    """Read messages until the response to ``message_id``."""
+    while True:
+        length = 0
+        while True:
+            header = process.stdout.readline().strip()
+            if not header:
+                break
+            name, _, value = header.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+        message = json.loads(process.stdout.read(length))
+        if message.get("id") == message_id and "method" not in message:
+            return message
+
+
+def server_start():
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "server"],
+        cwd=ROOT,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    send(process, 1, "initialize", {"processId": None, "rootUri": None, "capabilities": {}})
+    receive(process, 1)
+    initialized = time.perf_counter() - start
+    send(process, None, "initialized", {})
+    send(
+        process,
+        None,
+        "textDocument/didOpen",
+        {"textDocument": {"uri": URI, "languageId": "stata", "version": 1, "text": "su"}},
+    )
+    send(
+        process,
+        2,
+        "textDocument/completion",
+        {"textDocument": {"uri": URI}, "position": {"line": 0, "character": 2}},
+    )
+    items = receive(process, 2)["result"]["items"]
+    completed = time.perf_counter() - start
+    assert items, "no completion items"
+    send(process, 3, "shutdown", None)
+    receive(process, 3)
+    send(process, None, "exit", None)
+    process.wait(10)
+    return initialized, completed
+
+
+def format_start():
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "server", "format", "-"],
+        cwd=ROOT,
+        input=b"gen x=1\n",
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    timings = {"initialize": [], "completion": [], "format": []}
+    for _ in range(args.repeat):
+        initialized, completed = server_start()
+        timings["initialize"].append(initialized)
+        timings["completion"].append(completed)
+        timings["format"].append(format_start())
+    for name, values in timings.items():
+        print(f"{name:>10}: {statistics.median(values) * 1e3:8.1f} ms (min {min(values) * 1e3:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""Latency suite over synthetic do-files, with JSON baselines and a regression gate.
+
+For each corpus size (see ``corpus.py``) the suite times, through the
+in-process LSP client of ``lsp_client.py``:
+
+- lint_open: didOpen until its diagnostics are published (full lint)
+- lint_edit: a one character didChange until diagnostics (incremental lint,
+  with the debounce delay set to 0)
+- definition, hover, completion: request round trips near the end of the file
+- semantic_full: the first semanticTokens/full of a document (cold index)
+- semantic_delta: semanticTokens/full/delta after the one character edit
+- hover_busy: hover round trips while a textDocument/formatting request
+  of the whole document is in flight
+
+and ``format_stata_code`` on the whole text as a direct call.  The best
+run of each is compared against a baseline, since it is far less sensitive
+to other load on the machine than the median; a run fails (exit status 1)
+when it exceeds its baseline by more than ``--threshold`` and
+``--min-delta-ms``.
+
+Usage:
+    python benchmarks/bench_suite.py --save benchmarks/baseline.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json [--threshold 0.5]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lsprotocol.types import (  # noqa: E402
+    CompletionParams,
+    DefinitionParams,
+    DidCloseTextDocumentParams,
+    DocumentFormattingParams,
+    FormattingOptions,
+    HoverParams,
+    Position,
+    SemanticTokensDeltaParams,
+    SemanticTokensParams,
+    TextDocumentIdentifier,
+)
+
+from corpus import generate  # noqa: E402
+from lsp_client import TIMEOUT, InProcessClient  # noqa: E402
+from server.formatter import format_stata_code  # noqa: E402
+
+BASELINE_FORMAT_VERSION = 1
+# Above this many lines, slow whole-file operations run at most twice
+LARGE_CORPUS = 50000
+
+
+def _last_line(lines, predicate):
+    return next(i for i in range(len(lines) - 1, -1, -1) if predicate(lines[i]))
+
+
+def targets(lines):
+    """Positions for the requests, near the end of the file."""
+    replace = _last_line(lines, lambda line: line.lstrip().startswith("replace v"))
+    column = lines[replace].index("replace ") + len("replace ")
+    command = _last_line(lines, lambda line: line.lstrip().startswith("summarize "))
+    indent = len(lines[command]) - len(lines[command].lstrip())
+    return {
+        "definition": Position(line=replace, character=column + 1),
+        "hover": Position(line=command, character=indent + 1),
+        "completion": Position(line=command, character=indent + 2),
+    }
+
+
+def run_size(client, size, repeat, seed):
+    text = generate(size, seed)
+    lines = text.splitlines()
+    timings = {
+        name: []
+        for name in (
+            "lint_open",
+            "lint_edit",
+            "format",
+            "definition",
+            "hover",
+            "completion",
+            "semantic_full",
+            "semantic_delta",
+            "hover_busy",
+        )
+    }
+    slow_repeat = min(repeat, 2) if size >= LARGE_CORPUS else repeat
+
+    for run in range(slow_repeat):
+        uri = f"file:///bench/corpus-{size}-{run}.do"
+        start = time.perf_counter()
+        client.open(uri, text)
+        _, arrived = client.wait_diagnostics(uri, start)
+        timings["lint_open"].append(arrived - start)
+        tokens, elapsed = client.timed_request(
+            "textDocument/semanticTokens/full",
+            SemanticTokensParams(text_document=client.document(uri)),
+        )
+        timings["semantic_full"].append(elapsed)
+        if not run:
+            result_id = tokens.result_id
+        else:
+            client.notify(
+                "textDocument/didClose",
+                DidCloseTextDocumentParams(text_document=TextDocumentIdentifier(uri=uri)),
+            )
+
+        start = time.perf_counter()
+        format_stata_code(text, max_line_length=120)
+        timings["format"].append(time.perf_counter() - start)
+
+    uri = f"file:///bench/corpus-{size}-0.do"
+    document = TextDocumentIdentifier(uri=uri)
+    positions = targets(lines)
+    middle = len(lines) // 2
+    # Untimed warm-up, e.g. for the first completion of the session
+    client.request(
+        "textDocument/completion",
+        CompletionParams(text_document=document, position=positions["completion"]),
+    )
+    for run in range(repeat):
+        start = time.perf_counter()
+        client.change(uri, middle, 0, " " if run % 2 == 0 else "")
+        _, arrived = client.wait_diagnostics(uri, start)
+        timings["lint_edit"].append(arrived - start)
+        delta, elapsed = client.timed_request(
+            "textDocument/semanticTokens/full/delta",
+            SemanticTokensDeltaParams(text_document=document, previous_result_id=result_id),
+        )
+        result_id = delta.result_id
+        timings["semantic_delta"].append(elapsed)
+
+        _, elapsed = client.timed_request(
+            "textDocument/definition",
+            DefinitionParams(text_document=document, position=positions["definition"]),
+        )
+        timings["definition"].append(elapsed)
+        _, elapsed = client.timed_request(
+            "textDocument/hover", HoverParams(text_document=document, position=positions["hover"])
+        )
+        timings["hover"].append(elapsed)
+        _, elapsed = client.timed_request(
+            "textDocument/completion",
+            CompletionParams(text_document=document, position=positions["completion"]),
+        )
+        timings["completion"].append(elapsed)
+
+    hover = HoverParams(text_document=document, position=positions["hover"])
+    for run in range(slow_repeat):
+        pending = client.send(
+            "textDocument/formatting",
+            DocumentFormattingParams(
+                text_document=document, options=FormattingOptions(tab_size=4, insert_spaces=True)
+            ),
+        )
+        done = False
+        while not done:
+            done = pending.done()
+            _, elapsed = client.timed_request("textDocument/hover", hover)
+            timings["hover_busy"].append(elapsed)
+        pending.result(TIMEOUT)
+
+    client.notify("textDocument/didClose", DidCloseTextDocumentParams(text_document=document))
+    return {
+        f"{name}/{size}": {
+            "median_ms": statistics.median(values) * 1e3,
+            "min_ms": min(values) * 1e3,
+            "max_ms": max(values) * 1e3,
+            "runs": len(values),
+        }
+        for name, values in timings.items()
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Print the change against ``baseline``; return the regressed keys."""
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        now, then = result["min_ms"], before["min_ms"]
+        ratio = now / then if then else float("inf")
+        regressed = ratio > 1 + threshold and now - then > min_delta_ms
+        if regressed:
+            regressions.append(key)
+        print(
+            f"{key:>24}: {then:10.2f} -> {now:10.2f} ms ({ratio - 1:+7.1%})"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results as a JSON baseline")
+    parser.add_argument("--baseline", help="Fail on regressions against this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore smaller slowdowns")
+    args = parser.parse_args()
+
+    # Client, server and their readers share one interpreter: hand the GIL
+    # over sooner than the default 5 ms, closer to two separate processes
+    sys.setswitchinterval(0.0002)
+    results = {}
+    with InProcessClient() as client:
+        client.server.diagnostics_scheduler.delay = 0
+        for size in map(int, args.sizes.split(",")):
+            measured = run_size(client, size, args.repeat, args.seed)
+            for key, result in measured.items():
+                print(f"{key:>24}: {result['min_ms']:10.2f} ms (median {result['median_ms']:.2f})")
+            results.update(measured)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": BASELINE_FORMAT_VERSION,
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("version") != BASELINE_FORMAT_VERSION:
+            sys.exit(f"{args.baseline}: unsupported baseline format")
+        print(f"\nAgainst {args.baseline}:")
+        regressions = compare(results, baseline["results"], args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Synthetic do-files for the benchmarks.
+
+``generate(lines)`` strings together randomized blocks modelled on real
+analysis scripts: header block comments, programs, nested
+``foreach``/``forvalues`` loops with ``if`` blocks, ``///`` continued
+estimation commands, long macro-heavy lines, ``*`` and ``//`` comments and
+some deliberately badly spaced code so the linter has something to report.
+The same seed always gives the same file.
+
+Usage: python benchmarks/corpus.py LINES [--seed S] > file.do
+"""
+import argparse
+import random
+
+COMMANDS = ["summarize", "tabulate", "describe", "list", "count", "codebook"]
+ESTIMATORS = ["regress", "logit", "probit", "poisson", "xtreg", "ivregress 2sls"]
+FUNCTIONS = ["log", "exp", "sqrt", "abs", "round", "floor"]
+
+
+class _Writer:
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.lines = []
+        self.variables = ["id", "year", "wage", "age", "educ", "income"]
+        self.locals = ["controls"]
+        self.programs = []
+
+    def name(self, prefix: str) -> str:
+        return f"{prefix}{self.rng.randrange(1000)}"
+
+    def emit(self, depth: int, text: str) -> None:
+        self.lines.append("    " * depth + text)
+
+    def variable(self) -> str:
+        return self.rng.choice(self.variables)
+
+    def macro(self) -> str:
+        return f"`{self.rng.choice(self.locals)}'"
+
+    # Blocks
+
+    def block_comment(self, depth: int) -> None:
+        self.emit(depth, "/*")
+        for _ in range(self.rng.randint(1, 4)):
+            self.emit(depth, f"   {self.name('Section ')}: {self.rng.choice(COMMANDS)} of {self.variable()}")
+        self.emit(depth, "*/")
+
+    def generate(self, depth: int) -> None:
+        variable = self.name("v")
+        self.variables.append(variable)
+        function = self.rng.choice(FUNCTIONS)
+        if self.rng.random() < 0.3:
+            # Badly spaced, for the linter
+            self.emit(depth, f"gen {variable}={function}({self.variable()})+1")
+        else:
+            self.emit(depth, f"gen double {variable} = {function}({self.variable()}) + 1")
+        if self.rng.random() < 0.5:
+            self.emit(depth, f"replace {variable} = . if {self.variable()} < 0 // missing")
+
+    def local(self, depth: int) -> None:
+        name = self.name("list")
+        self.locals.append(name)
+        values = " ".join(self.variable() for _ in range(self.rng.randint(2, 6)))
+        self.emit(depth, f"local {name} {values}")
+
+    def long_macro_line(self, depth: int) -> None:
+        parts = [f"{self.macro()}_{self.variable()}" for _ in range(self.rng.randint(15, 40))]
+        self.emit(depth, f"local wide {' '.join(parts)} `\"{self.name('label ')}\"'")
+
+    def estimation(self, depth: int) -> None:
+        regressors = [self.variable() for _ in range(self.rng.randint(3, 12))]
+        self.emit(depth, f"{self.rng.choice(ESTIMATORS)} {self.variable()} ///")
+        for start in range(0, len(regressors), 4):
+            self.emit(depth + 1, " ".join(regressors[start : start + 4]) + " ///")
+        self.emit(depth + 1, f"{self.macro()} if year > 2000, vce(cluster id)")
+
+    def display(self, depth: int) -> None:
+        if self.rng.random() < 0.5:
+            self.emit(depth, f"* {self.rng.choice(COMMANDS)} the {self.variable()} variable")
+        self.emit(depth, f"{self.rng.choice(COMMANDS)} {self.variable()} {self.variable()}")
+
+    def loop(self, depth: int) -> None:
+        local = self.name("i")
+        self.locals.append(local)
+        if self.rng.random() < 0.5:
+            self.emit(depth, f"foreach {local} of varlist {self.variable()} {self.variable()} {{")
+        else:
+            self.emit(depth, f"forvalues {local} = 1/{self.rng.randint(2, 20)} {{")
+        for _ in range(self.rng.randint(1, 3)):
+            self.statement(depth + 1)
+        if self.rng.random() < 0.4:
+            self.emit(depth + 1, f"if `{local}' == 1 {{")
+            self.statement(depth + 2)
+            self.emit(depth + 1, "}")
+        self.emit(depth, "}")
+
+    def program(self, depth: int) -> None:
+        name = self.name("prog_")
+        self.programs.append(name)
+        self.emit(depth, f"capture program drop {name}")
+        self.emit(depth, f"program define {name}")
+        self.emit(depth + 1, "syntax varlist [if] [in]")
+        for _ in range(self.rng.randint(1, 3)):
+            self.statement(depth + 1)
+        self.emit(depth, "end")
+        self.emit(depth, f"{name} {self.variable()}")
+
+    def statement(self, depth: int) -> None:
+        kinds = [self.generate, self.local, self.display, self.estimation]
+        weights = [4, 2, 3, 1]
+        if depth < 3:
+            kinds.append(self.loop)
+            weights.append(2)
+        if self.rng.random() < 0.05:
+            kinds.append(self.long_macro_line)
+            weights.append(1)
+        self.rng.choices(kinds, weights)[0](depth)
+
+    def top_level(self) -> None:
+        roll = self.rng.random()
+        if roll < 0.05:
+            self.block_comment(0)
+        elif roll < 0.1:
+            self.program(0)
+        else:
+            self.statement(0)
+
+
+def generate(lines: int, seed: int = 0) -> str:
+    """A do-file of exactly ``lines`` lines (plus a final newline)."""
+    writer = _Writer(seed)
+    writer.emit(0, "version 17")
+    writer.emit(0, 'use "data/panel.dta", clear')
+    writer.emit(0, "local controls age educ income")
+    while len(writer.lines) < lines:
+        writer.top_level()
+    return "\n".join(writer.lines[:lines]) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("lines", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(generate(args.lines, args.seed), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""An LSP client talking to the Stata server in the same process.
+
+The server and a pygls client run their IO loops in two threads connected
+by OS pipes, so every request goes through the full JSON-RPC path
+(serialization, dispatch, handler, response) without a subprocess.  Only
+one session per process: the server is the module-level ``stata_server``.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lsprotocol.types import (  # noqa: E402
+    ClientCapabilities,
+    DidChangeTextDocumentParams,
+    DidOpenTextDocumentParams,
+    InitializedParams,
+    InitializeParams,
+    Position,
+    PublishDiagnosticsParams,
+    Range,
+    TextDocumentContentChangeEvent_Type1,
+    TextDocumentIdentifier,
+    TextDocumentItem,
+    VersionedTextDocumentIdentifier,
+)
+from pygls.server import LanguageServer  # noqa: E402
+
+from server.server import stata_server  # noqa: E402
+
+TIMEOUT = 60
+
+
+class InProcessClient:
+    """Drive ``stata_server`` over pipes; use as a context manager."""
+
+    def __init__(self, root_uri: str = "file:///bench"):
+        self.root_uri = root_uri
+        self.server = stata_server
+        self.client = LanguageServer("bench-client", "v1", loop=asyncio.new_event_loop())
+        # uri -> (version, diagnostics, arrival time) of the last publication
+        self.diagnostics: Dict[str, Tuple[Optional[int], List[Any], float]] = {}
+        self._published = threading.Condition()
+        self._versions: Dict[str, int] = {}
+
+        @self.client.feature("textDocument/publishDiagnostics")
+        def publish(ls, params: PublishDiagnosticsParams):
+            with self._published:
+                self.diagnostics[params.uri] = (
+                    params.version,
+                    params.diagnostics,
+                    time.perf_counter(),
+                )
+                self._published.notify_all()
+
+        @self.client.feature("window/logMessage")
+        def log_message(ls, params):
+            pass
+
+    def __enter__(self):
+        to_server_r, to_server_w = os.pipe()
+        to_client_r, to_client_w = os.pipe()
+        self._threads = [
+            threading.Thread(
+                target=self.server.start_io,
+                args=(os.fdopen(to_server_r, "rb"), os.fdopen(to_client_w, "wb")),
+                daemon=True,
+            ),
+            threading.Thread(
+                target=self.client.start_io,
+                args=(os.fdopen(to_client_r, "rb"), os.fdopen(to_server_w, "wb")),
+                daemon=True,
+            ),
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.request(
+            "initialize",
+            InitializeParams(
+                process_id=os.getpid(),
+                root_uri=self.root_uri,
+                capabilities=ClientCapabilities(),
+            ),
+        )
+        self.notify("initialized", InitializedParams())
+        return self
+
+    def __exit__(self, *exc_info):
+        self.request("shutdown")
+        self.notify("exit")
+        # The server closes its end of the pipes on exit, which ends the client loop
+        for thread in self._threads:
+            thread.join(TIMEOUT)
+
+    # Messages
+
+    def send(self, method: str, params: Any = None) -> "Future[Any]":
+        """Send a request without waiting; the future resolves to its result."""
+        return self.client.lsp.send_request(method, params)
+
+    def request(self, method: str, params: Any = None) -> Any:
+        return self.send(method, params).result(TIMEOUT)
+
+    def notify(self, method: str, params: Any = None) -> None:
+        self.client.lsp.notify(method, params)
+
+    def timed_request(self, method: str, params: Any = None) -> Tuple[Any, float]:
+        start = time.perf_counter()
+        result = self.request(method, params)
+        return result, time.perf_counter() - start
+
+    # Documents
+
+    def open(self, uri: str, text: str) -> None:
+        self._versions[uri] = 1
+        self.notify(
+            "textDocument/didOpen",
+            DidOpenTextDocumentParams(
+                text_document=TextDocumentItem(uri=uri, language_id="stata", version=1, text=text)
+            ),
+        )
+
+    def change(self, uri: str, line: int, character: int, text: str) -> int:
+        """Insert ``text`` at a position; return the new version."""
+        version = self._versions[uri] + 1
+        self._versions[uri] = version
+        position = Position(line=line, character=character)
+        self.notify(
+            "textDocument/didChange",
+            DidChangeTextDocumentParams(
+                text_document=VersionedTextDocumentIdentifier(uri=uri, version=version),
+                content_changes=[
+                    TextDocumentContentChangeEvent_Type1(
+                        range=Range(start=position, end=position), text=text
+                    )
+                ],
+            ),
+        )
+        return version
+
+    def wait_diagnostics(self, uri: str, after: float) -> Tuple[List[Any], float]:
+        """Diagnostics of ``uri`` published after time ``after``, and when they arrived."""
+        with self._published:
+            arrived = self._published.wait_for(
+                lambda: uri in self.diagnostics and self.diagnostics[uri][2] > after, TIMEOUT
+            )
+            if not arrived:
+                raise TimeoutError(f"no diagnostics for {uri}")
+            _, diagnostics, when = self.diagnostics[uri]
+        return diagnostics, when
+
+    @staticmethod
+    def document(uri: str) -> TextDocumentIdentifier:
+        return TextDocumentIdentifier(uri=uri)
@@ -1,9 +1,10 @@
 import argparse
 import logging
+import sys
 
-from .server import stata_server
-
-logging.basicConfig(filename="pygls.log", level=logging.DEBUG, filemode="w")
+from . import constants
+from .batch import configure, run_checks, write_jsonl, write_sarif
+from .formatter import format_stream
 
 
 def add_arguments(parser):
@@ -17,6 +18,11 @@ def add_arguments(parser):
         "--ws", action="store_true",
         help="Use WebSocket server"
     )
+    parser.add_argument(
+        "--sessions", action="store_true",
+        help="With --tcp or --ws, serve each connection in its own session "
+        "sharing the loaded data, until interrupted"
+    )
     parser.add_argument(
         "--host", default="127.0.0.1",
         help="Bind to this address"
@@ -25,6 +31,90 @@ def add_arguments(parser):
         "--port", type=int, default=2087,
         help="Bind to this port"
     )
+    parser.add_argument(
+        "--log-level", default="WARNING",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Log level; DEBUG traces every JSON-RPC message and slows the server"
+    )
+    parser.add_argument(
+        "--log-file",
+        help="Write the log to this file instead of stderr"
+    )
+    parser.add_argument(
+        "--stats-interval", type=float, default=constants.STATS_LOG_INTERVAL,
+        help="Log a latency summary every this many seconds, 0 for never"
+    )
+
+    commands = parser.add_subparsers(dest="command")
+    style = argparse.ArgumentParser(add_help=False)
+    style.add_argument(
+        "--max-line-length", type=int, default=constants.MAX_LINE_LENGTH,
+        help="Break lines longer than this"
+    )
+    style.add_argument(
+        "--indent", type=int, default=constants.INDENT_SPACE,
+        help="Spaces per indentation level"
+    )
+    batch = argparse.ArgumentParser(add_help=False)
+    batch.add_argument(
+        "--jobs", "-j", type=int, default=None,
+        help="Worker processes (default: one per core, 0 for none)"
+    )
+    batch.add_argument(
+        "--output-format", choices=["jsonl", "sarif"], default="jsonl",
+        help="Report findings as JSON Lines or as a SARIF log"
+    )
+    batch.add_argument(
+        "--no-cache", action="store_true",
+        help="Check every file, ignoring and not updating the result cache"
+    )
+
+    format_parser = commands.add_parser(
+        "format", parents=[style, batch],
+        help="Format a do-file, or stdin, to stdout; or check files with --check"
+    )
+    format_parser.add_argument(
+        "paths", nargs="*",
+        help="File to format (- or none for stdin), or files and directories to check"
+    )
+    format_parser.add_argument(
+        "--check", action="store_true",
+        help="Report files the formatter would change instead of formatting"
+    )
+
+    lint_parser = commands.add_parser(
+        "lint", parents=[style, batch],
+        help="Check the codestyle of do-files below the given paths"
+    )
+    lint_parser.add_argument(
+        "paths", nargs="*", default=["."],
+        help="Files and directories to check (default: the current directory)"
+    )
+
+
+def format_file(path):
+    """Stream the formatted file to stdout without loading it whole."""
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with source:
+        format_stream(
+            source,
+            sys.stdout,
+            max_line_length=constants.MAX_LINE_LENGTH,
+            indent_size=constants.INDENT_SPACE,
+        )
+
+
+def check_files(args, lint, check_format):
+    """Check files in a process pool and report; exit status 1 on findings."""
+    reports = run_checks(
+        args.paths or ["."],
+        lint=lint,
+        check_format=check_format,
+        workers=args.jobs,
+        use_cache=not args.no_cache,
+    )
+    write = write_sarif if args.output_format == "sarif" else write_jsonl
+    return 1 if write(reports, sys.stdout) else 0
 
 
 def main():
@@ -32,7 +122,36 @@ def main():
     add_arguments(parser)
     args = parser.parse_args()
 
-    if args.tcp:
+    if args.command in ("format", "lint"):
+        configure(args.max_line_length, args.indent)
+        if args.command == "lint":
+            return check_files(args, lint=True, check_format=False)
+        if args.check:
+            return check_files(args, lint=False, check_format=True)
+        if len(args.paths) > 1:
+            parser.error("format writes to stdout and takes one file; use --check for more")
+        format_file(args.paths[0] if args.paths else "-")
+        return 0
+
+    # The LSP server and its protocol types take most of the start up time,
+    # load them only when serving
+    from .server import stata_server
+
+    logging.basicConfig(
+        filename=args.log_file,
+        level=getattr(logging, args.log_level),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    constants.STATS_LOG_INTERVAL = args.stats_interval
+    if args.stats_interval > 0:
+        logging.getLogger("server.server").setLevel(logging.INFO)
+        logging.getLogger("server.sessions").setLevel(logging.INFO)
+    if args.sessions and (args.tcp or args.ws):
+        from .sessions import SessionHost
+
+        host = SessionHost(stata_server)
+        host.serve(host.listen_tcp if args.tcp else host.listen_ws, args.host, args.port)
+    elif args.tcp:
         stata_server.start_tcp(args.host, args.port)
     elif args.ws:
         stata_server.start_ws(args.host, args.port)
@@ -41,4 +160,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
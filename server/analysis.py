@@ -0,0 +1,244 @@
+"""Everything derived from an open document, computed once per version and shared.
+
+A ``DocumentAnalysis`` holds, for one document:
+
+- ``TokenStream``: the lexer tokens and states of every line
+- the ``DefinitionIndex``, ``OccurrenceIndex`` and ``SemanticTokensIndex``,
+  which read their tokens from the stream instead of lexing again
+- the ``LintResult``, whose line states are the block structure (brace
+  depth, block comments, ``///`` continuations) range formatting works on
+- the result id of its pulled diagnostics, from its content hash and the
+  lint settings
+
+Each part is created on first use and brought up to date with the
+document lazily, when a handler asks for it, so an edit costs one lexer
+pass over the changed lines however many features look at the document.
+
+``AnalysisCache`` keeps one analysis per URI, drops it when the document is
+closed and evicts the least recently used analyses once their estimated
+size exceeds ``constants.ANALYSIS_CACHE_MB``.  Lint results and result ids
+follow the settings returned by its ``lint_config`` callable, given the URI
+(its workspace folder may have settings of its own), by default
+``linter.lint_config``.  ``recent`` lists the URIs most recently used first,
+the order to re-lint documents in after a settings change.
+"""
+from array import array
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import server.constants as constants
+
+from .definitions import DefinitionIndex
+from .document import StataDocument
+from .indexer import file_digest
+from .lineindex import LineIndex
+from .linter import LintResult, LintRun, diagnostics_result_id, lint_config
+from .occurrences import OccurrenceIndex
+from .semantic import SemanticTokensIndex
+from .stats import ServerStats
+
+# Approximate memory per document line of each part, measured with
+# tracemalloc on the synthetic corpus of ``benchmarks/corpus.py``
+PART_BYTES_PER_LINE = {
+    "tokens": 180,
+    "definitions": 140,
+    "occurrences": 500,
+    "semanticTokens": 270,
+    "lint": 130,
+}
+
+
+class TokenSnapshot(NamedTuple):
+    """The lists of a ``TokenStream`` at one version, safe to read from a worker."""
+
+    values: List[array]
+    states: List[int]
+
+
+class TokenStream(LineIndex[array]):
+    """The lexer tokens of every line of a document."""
+
+    def index_line(self, line: str, tokens, state: int) -> array:
+        return tokens
+
+    def snapshot(self) -> TokenSnapshot:
+        # Updates replace items of ``values`` in place
+        return TokenSnapshot(list(self.values), list(self.states))
+
+
+class DocumentAnalysis:
+    """The parts derived from one document, see the module docstring."""
+
+    def __init__(
+        self,
+        document,
+        server_stats: Optional[ServerStats] = None,
+        lint_config: Callable[[], Tuple[int, int]] = lint_config,
+    ):
+        self.document = document
+        self.server_stats = server_stats
+        self.lint_config = lint_config
+        self.tokens = TokenStream()
+        self.definition_index: Optional[DefinitionIndex] = None
+        self.occurrence_index: Optional[OccurrenceIndex] = None
+        self.semantic_tokens_index: Optional[SemanticTokensIndex] = None
+        self.lint_result: Optional[LintResult] = None
+        self._result_id: Optional[tuple] = None  # (version, config, id)
+        self.lines = 0  # of the document, when a part was last updated
+        # Line of the last edit or cursor position, whose diagnostics come first
+        self.focus_line = 0
+        # Settings the pushed diagnostics were computed with, see
+        # ``Settings.diagnostics_config``
+        self.published_config: Optional[tuple] = None
+
+    def _record(self, name: str, hit: bool) -> None:
+        if self.server_stats is not None:
+            self.server_stats.cache(name, hit)
+
+    def token_stream(self) -> TokenStream:
+        """The tokens of the current version of the document."""
+        if not self.tokens.is_current(self.document):
+            self.tokens.update(self.document)
+            self.lines = len(self.tokens.values)
+        return self.tokens
+
+    def _index(self, index: LineIndex) -> LineIndex:
+        current = index.is_current(self.document)
+        self._record(type(index).__name__, current)
+        if not current:
+            index.update(self.document, self.token_stream())
+        return index
+
+    def definitions(self) -> DefinitionIndex:
+        if self.definition_index is None:
+            self.definition_index = DefinitionIndex()
+        return self._index(self.definition_index)
+
+    def occurrences(self) -> OccurrenceIndex:
+        if self.occurrence_index is None:
+            self.occurrence_index = OccurrenceIndex()
+        return self._index(self.occurrence_index)
+
+    def semantic_tokens(self, encoding: Optional[str] = None) -> SemanticTokensIndex:
+        if self.semantic_tokens_index is None:
+            self.semantic_tokens_index = SemanticTokensIndex(encoding)
+        return self._index(self.semantic_tokens_index)
+
+    def lint_run(self) -> Optional[LintRun]:
+        """A pass bringing the lint result up to date, None when it is current.
+
+        The pass re-checks only edited lines; it can be advanced in chunks,
+        also from a worker thread, and is stored with ``finish_lint``.
+        """
+        document = self.document
+        previous = self.lint_result
+        config = self.lint_config()
+        if (
+            previous is not None
+            and document.version is not None
+            and previous.version == document.version
+            and previous.config == config
+        ):
+            self._record("LintResult", True)
+            return None
+        self._record("LintResult", False)
+
+        first_changed = None
+        if previous is not None and isinstance(document, StataDocument):
+            change = document.changes_since(previous.version)
+            if change is not None:
+                first_changed = change.start
+        # A cold stream would be built whole before the first chunk is linted
+        tokens = self.token_stream().snapshot() if self.tokens.values else None
+        return LintRun(document.lines, document.version, previous, first_changed, tokens, config)
+
+    def finish_lint(self, run: LintRun) -> LintResult:
+        """Complete ``run`` and keep its result."""
+        run.advance()
+        self.lint_result = run.result()
+        self.lines = len(run.lines)
+        return self.lint_result
+
+    def lint(self) -> LintResult:
+        """The lint result of the current version, re-checking only edited lines."""
+        run = self.lint_run()
+        return self.lint_result if run is None else self.finish_lint(run)
+
+    def result_id(self) -> str:
+        """Id of the diagnostics of the current version, hashed once per version."""
+        version, config = self.document.version, self.lint_config()
+        if (
+            self._result_id is None
+            or version is None
+            or self._result_id[:2] != (version, config)
+        ):
+            digest = file_digest(self.document.source.encode("utf-8"))
+            self._result_id = (version, config, diagnostics_result_id(digest, config))
+        return self._result_id[2]
+
+    def parts(self):
+        """Names of the parts built so far."""
+        built = {
+            "tokens": self.tokens.values,
+            "definitions": self.definition_index,
+            "occurrences": self.occurrence_index,
+            "semanticTokens": self.semantic_tokens_index,
+            "lint": self.lint_result,
+        }
+        return [name for name, part in built.items() if part]
+
+    def estimated_bytes(self) -> int:
+        return self.lines * sum(PART_BYTES_PER_LINE[part] for part in self.parts())
+
+
+class AnalysisCache:
+    """The analyses of the open documents, bounded by their estimated size."""
+
+    def __init__(
+        self,
+        server_stats: Optional[ServerStats] = None,
+        max_mb: Optional[float] = None,
+        lint_config: Optional[Callable[[str], Tuple[int, int]]] = None,
+    ):
+        self.server_stats = server_stats
+        self.max_mb = max_mb
+        self.lint_config = lint_config
+        self.analyses: "OrderedDict[str, DocumentAnalysis]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, uri: str, document) -> DocumentAnalysis:
+        """The analysis of ``document``, making it the most recently used."""
+        analysis = self.analyses.get(uri)
+        if analysis is None or analysis.document is not document:
+            config = lint_config if self.lint_config is None else partial(self.lint_config, uri)
+            analysis = self.analyses[uri] = DocumentAnalysis(document, self.server_stats, config)
+        self.analyses.move_to_end(uri)
+        self.trim()
+        return analysis
+
+    def recent(self) -> List[str]:
+        """The URIs of the analyses, most recently used first."""
+        return list(reversed(self.analyses))
+
+    def pop(self, uri: str) -> None:
+        self.analyses.pop(uri, None)
+
+    def trim(self) -> None:
+        """Evict least recently used analyses, never the most recent one, to fit."""
+        max_mb = constants.ANALYSIS_CACHE_MB if self.max_mb is None else self.max_mb
+        budget = max_mb * 1e6
+        total = sum(analysis.estimated_bytes() for analysis in self.analyses.values())
+        while total > budget and len(self.analyses) > 1:
+            _, evicted = self.analyses.popitem(last=False)
+            total -= evicted.estimated_bytes()
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self.analyses),
+            "estimatedMb": round(
+                sum(analysis.estimated_bytes() for analysis in self.analyses.values()) / 1e6, 1
+            ),
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,358 @@
+"""Lint and format checks over whole directory trees, for CI.
+
+Files are checked in a process pool with the same rules the server
+publishes as diagnostics (``server.linter``) and the same formatter.
+Results are cached as JSON under ``constants.INDEX_CACHE_DIR``, keyed by
+content hash like the workspace index: a file whose mtime and size are
+unchanged is not read again, and one that was only touched is not checked
+again.  Reports are streamed as JSON Lines, or collected into one SARIF log.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import server.constants as constants
+
+from .formatter import format_stata_code
+from .indexer import POOL_THRESHOLD, ProcessPool, cache_file_for, discover, file_digest
+from .linter import lint_config, lint_lines
+from .textdiff import diff_lines
+
+BATCH_CACHE_VERSION = 1
+
+# Rule ids of the linter messages, for machine-readable output
+RULE_IDS = {
+    constants.MAX_LINE_LENGTH_MESSAGE: "line-too-long",
+    constants.OP_WHITESPACE_MESSAGE: "operator-whitespace",
+    constants.COMMA_WHITESPACE_MESSAGE: "comma-whitespace",
+    constants.INAP_INDENT_MESSAGE: "indentation",
+}
+FORMAT_RULE_ID = "unformatted"
+FORMAT_MESSAGE = "file would be reformatted"
+
+SARIF_LEVELS = {
+    constants.SEVERITY_ERROR: "error",
+    constants.SEVERITY_WARNING: "warning",
+    constants.SEVERITY_INFORMATION: "note",
+    constants.SEVERITY_HINT: "note",
+}
+
+
+class Finding(NamedTuple):
+    """A finding on line ``line`` (0-based) between columns ``start`` and ``end``."""
+
+    line: int
+    start: int
+    end: int
+    message: str
+    severity: int
+
+
+class FileReport(NamedTuple):
+    path: str
+    findings: Optional[Tuple[Finding, ...]]  # None when not linted
+    unformatted_line: Optional[int]  # first line the formatter changes, -1 if none
+    digest: Optional[str] = None  # of the content checked
+
+
+# (path, mtime_ns, size, digest, findings, unformatted line); the last two
+# are None when the content still hashed to the cached digest
+CheckedFile = Tuple[str, int, int, str, Optional[List[Finding]], Optional[int]]
+
+
+def configure(max_line_length: int, indent_space: int) -> None:
+    """Set the rule settings of this process."""
+    constants.MAX_LINE_LENGTH = max_line_length
+    constants.INDENT_SPACE = indent_space
+
+
+def check_file(
+    path: str,
+    digest: Optional[str],
+    lint: bool,
+    check_format: bool,
+    config: Optional[Tuple[int, int]] = None,
+) -> Optional[CheckedFile]:
+    """Read and check one file; runs in the worker processes.
+
+    The checks are skipped when the content still hashes to ``digest``.
+    ``config`` is (max line length, indent), by default from ``constants``.
+    Returns None when the file cannot be read.
+    """
+    try:
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            data = f.read()
+    except OSError:
+        return None
+    new_digest = file_digest(data)
+    if new_digest == digest:
+        return path, stat.st_mtime_ns, stat.st_size, new_digest, None, None
+
+    text = data.decode("utf-8", errors="replace")
+    lines = text.splitlines(keepends=True)
+    findings = None
+    unformatted_line = None
+    max_line_length, indent_space = lint_config() if config is None else config
+    if lint:
+        result = lint_lines(lines, config=(max_line_length, indent_space))
+        findings = [
+            Finding(lineno, start, end, message, severity)
+            for lineno, line_diagnostics in enumerate(result.line_diagnostics)
+            for start, end, message, severity in line_diagnostics
+        ]
+    if check_format:
+        formatted = format_stata_code(
+            text,
+            max_line_length=max_line_length,
+            indent_size=indent_space,
+        )
+        hunks = diff_lines(lines, formatted.splitlines(keepends=True))
+        unformatted_line = hunks[0].start if hunks else -1
+    return path, stat.st_mtime_ns, stat.st_size, new_digest, findings, unformatted_line
+
+
+def expand_paths(paths: Iterable[str]) -> List[str]:
+    """The .do/.ado files given directly or found below the given directories."""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(os.path.abspath(found) for found in discover([path]))
+        elif os.path.isfile(path):
+            files.add(os.path.abspath(path))
+    return sorted(files)
+
+
+class ResultCache:
+    """Check results of each file by content hash, persisted as JSON."""
+
+    def __init__(self, path: Optional[str], config: Tuple[int, int]):
+        self.path = path
+        self.config = list(config)
+        # path -> [mtime_ns, size, digest, findings or None, unformatted line or None]
+        self.files: Dict[str, list] = {}
+
+    def load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == BATCH_CACHE_VERSION and data.get("config") == self.config:
+            self.files = data["files"]
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        data = {"version": BATCH_CACHE_VERSION, "config": self.config, "files": self.files}
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(data))  # dumps uses the C encoder, dump does not
+        os.replace(tmp_path, self.path)
+
+
+def run_checks(
+    paths: Iterable[str],
+    lint: bool = True,
+    check_format: bool = False,
+    workers: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    use_cache: bool = True,
+    config: Optional[Tuple[int, int]] = None,
+    pool: Optional[ProcessPool] = None,
+) -> Iterator[FileReport]:
+    """Check every file below ``paths``, yielding reports as they complete.
+
+    ``workers`` is the pool size (default: one per core, 0 checks in this
+    process).  A ``pool`` given is used instead of starting one, as the
+    server does.  Rule settings are ``config``, (max line length, indent),
+    by default from ``constants``; ``configure`` changes those.
+    """
+    paths = list(paths)
+    files = expand_paths(paths)
+    config = lint_config() if config is None else config
+    cache_dir = constants.INDEX_CACHE_DIR if cache_dir is None else cache_dir
+    cache_path = None
+    if use_cache:
+        roots = [os.path.abspath(path) for path in paths]
+        cache_path = cache_file_for(roots, cache_dir, prefix="batch")
+    cache = ResultCache(cache_path, config)
+    cache.load()
+    # Forget files that are gone
+    known = len(cache.files)
+    cache.files = {path: cache.files[path] for path in files if path in cache.files}
+    changed = len(cache.files) != known
+
+    # Cached fields this run needs: findings and/or the unformatted line
+    needed = [field for field, wanted in ((3, lint), (4, check_format)) if wanted]
+    jobs = []
+    for path in files:
+        entry = cache.files.get(path)
+        if entry is not None and all(entry[field] is not None for field in needed):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (entry[0], entry[1]) == (stat.st_mtime_ns, stat.st_size):
+                yield _report(path, entry, lint, check_format)
+                continue
+            jobs.append((path, entry[2]))
+        else:
+            jobs.append((path, None))
+
+    executor = None
+    if workers == 0 or len(jobs) < POOL_THRESHOLD:
+        results = (
+            check_file(path, digest, lint, check_format, config) for path, digest in jobs
+        )
+    else:
+        if pool is None:
+            workers = workers or os.cpu_count() or 1
+            executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            workers = pool.workers
+        chunksize = max(1, len(jobs) // (4 * workers))
+        results = (executor or pool.executor).map(
+            check_file,
+            [path for path, _ in jobs],
+            [digest for _, digest in jobs],
+            [lint] * len(jobs),
+            [check_format] * len(jobs),
+            [config] * len(jobs),
+            chunksize=chunksize,
+        )
+
+    try:
+        for result in results:
+            if result is None:
+                continue
+            path, mtime_ns, size, digest, findings, unformatted_line = result
+            entry = cache.files.get(path)
+            changed = True
+            if findings is None and unformatted_line is None:
+                entry[0:3] = [mtime_ns, size, digest]  # only touched
+            else:
+                if entry is None or entry[2] != digest:
+                    entry = [mtime_ns, size, digest, None, None]
+                    cache.files[path] = entry
+                entry[0:2] = [mtime_ns, size]
+                if lint:
+                    entry[3] = [list(finding) for finding in findings]
+                if check_format:
+                    entry[4] = unformatted_line
+            yield _report(path, entry, lint, check_format)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if changed:
+            cache.save()
+
+
+def _report(path: str, entry: list, lint: bool, check_format: bool) -> FileReport:
+    return FileReport(
+        path,
+        tuple(Finding(*finding) for finding in entry[3]) if lint else None,
+        entry[4] if check_format else None,
+        entry[2],
+    )
+
+
+# Output
+
+
+def rule_id(message: str) -> str:
+    """The rule of a linter message, which may carry details after the base text."""
+    for base, rule in RULE_IDS.items():
+        if message.startswith(base):
+            return rule
+    return "style"
+
+
+def _display_path(path: str) -> str:
+    relative = os.path.relpath(path)
+    return path if relative.startswith("..") else relative
+
+
+def report_records(report: FileReport) -> Iterator[dict]:
+    """One record per finding, with 1-based lines and columns."""
+    path = _display_path(report.path)
+    for finding in report.findings or ():
+        yield {
+            "path": path,
+            "line": finding.line + 1,
+            "column": finding.start + 1,
+            "endColumn": finding.end + 1,
+            "rule": rule_id(finding.message),
+            "severity": SARIF_LEVELS.get(finding.severity, "warning"),
+            "message": finding.message,
+        }
+    if report.unformatted_line is not None and report.unformatted_line >= 0:
+        yield {
+            "path": path,
+            "line": report.unformatted_line + 1,
+            "rule": FORMAT_RULE_ID,
+            "severity": "warning",
+            "message": FORMAT_MESSAGE,
+        }
+
+
+def write_jsonl(reports: Iterable[FileReport], out: IO[str]) -> int:
+    """Stream the records of ``reports`` as JSON Lines; return how many were written."""
+    count = 0
+    for report in reports:
+        for record in report_records(report):
+            out.write(json.dumps(record) + "\n")
+            count += 1
+        out.flush()
+    return count
+
+
+def write_sarif(reports: Iterable[FileReport], out: IO[str]) -> int:
+    """Write the records of ``reports`` as one SARIF 2.1.0 log; return how many."""
+    results = []
+    for report in reports:
+        for record in report_records(report):
+            region = {"startLine": record["line"]}
+            if "column" in record:
+                region.update(startColumn=record["column"], endColumn=record["endColumn"])
+            results.append(
+                {
+                    "ruleId": record["rule"],
+                    "level": record["severity"],
+                    "message": {"text": record["message"]},
+                    "locations": [
+                        {
+                            "physicalLocation": {
+                                "artifactLocation": {
+                                    "uri": record["path"].replace(os.sep, "/")
+                                },
+                                "region": region,
+                            }
+                        }
+                    ],
+                }
+            )
+    rules = [
+        {"id": rule, "shortDescription": {"text": message}}
+        for message, rule in [*RULE_IDS.items(), (FORMAT_MESSAGE, FORMAT_RULE_ID)]
+    ]
+    json.dump(
+        {
+            "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+            "version": "2.1.0",
+            "runs": [
+                {
+                    "tool": {"driver": {"name": "stata-language-server", "rules": rules}},
+                    "results": results,
+                }
+            ],
+        },
+        out,
+        indent=2,
+    )
+    out.write("\n")
+    return len(results)
@@ -0,0 +1,268 @@
+"""Prefix indexed, ranked command completion."""
+import heapq
+import re
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from lsprotocol.types import (
+    CompletionItem,
+    CompletionItemKind,
+    CompletionList,
+    MarkupContent,
+)
+
+import server.utils as utils
+
+from .document import StataDocument
+from .lexer import WORD, tokenize_line
+
+# Minimal abbreviations of common commands, as in the Stata manuals
+COMMAND_ABBREVIATIONS = {
+    "bysort": "bys",
+    "capture": "cap",
+    "confirm": "conf",
+    "correlate": "cor",
+    "count": "cou",
+    "describe": "d",
+    "display": "di",
+    "ereturn": "eret",
+    "estimates": "est",
+    "format": "form",
+    "forvalues": "forv",
+    "generate": "g",
+    "global": "gl",
+    "graph": "gr",
+    "help": "h",
+    "histogram": "hist",
+    "inspect": "ins",
+    "label": "la",
+    "list": "l",
+    "local": "loc",
+    "macro": "ma",
+    "matrix": "mat",
+    "noisily": "n",
+    "program": "pr",
+    "quietly": "qui",
+    "regress": "reg",
+    "rename": "ren",
+    "return": "ret",
+    "save": "sa",
+    "scalar": "sca",
+    "scatter": "sc",
+    "sreturn": "sret",
+    "summarize": "su",
+    "tabulate": "ta",
+    "twoway": "tw",
+    "version": "vers",
+}
+
+
+# Resolved documentation kept for the most recently focused items
+RESOLVE_CACHE_SIZE = 256
+# Longer diagrams are usually mangled help markup, not worth a detail line
+SYNOPSIS_MAX_LENGTH = 120
+
+_MD_LINK_RE = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_MD_ESCAPE_RE = re.compile(r"\\(.)")
+_MD_EMPHASIS_RE = re.compile(r"(?<![\w`])_|_(?![\w`])|`")
+
+
+class CompletionIndex:
+    """Sorted command names answering prefix queries with a bisect."""
+
+    def __init__(
+        self,
+        commands: Iterable[str],
+        abbreviations: Optional[Dict[str, str]] = None,
+    ):
+        self.abbreviations = (
+            COMMAND_ABBREVIATIONS if abbreviations is None else abbreviations
+        )
+        self.commands = frozenset(commands) | frozenset(self.abbreviations)
+        self.expansions = {short: name for name, short in self.abbreviations.items()}
+        self.names = sorted(self.commands)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def matches(self, prefix: str) -> List[str]:
+        """All names starting with ``prefix``."""
+        start = bisect_left(self.names, prefix)
+        end = bisect_left(self.names, prefix + "\uffff", start)
+        return self.names[start:end]
+
+    def canonical(self, word: str) -> str:
+        """The command ``word`` abbreviates, or ``word`` itself.
+
+        A word is an abbreviation of a command when it is its minimal
+        abbreviation, extends it (``regr`` for ``regress``), or is the
+        prefix of that command only.
+        """
+        if word in self.expansions:
+            return self.expansions[word]
+        if word in self.commands:
+            return word
+        candidates = [name for name in self.matches(word) if name in self.commands]
+        for name in candidates:
+            short = self.abbreviations.get(name)
+            if short is not None and word.startswith(short):
+                return name
+        return candidates[0] if len(candidates) == 1 else word
+
+    def _rank(self, name: str, prefix: str, frequencies: Counter) -> Tuple:
+        abbreviation = self.abbreviations.get(name)
+        return (
+            name != prefix,  # exact match first
+            abbreviation is None or len(prefix) < len(abbreviation),
+            -frequencies.get(name, 0),
+            len(name),
+            name,
+        )
+
+    def complete(
+        self,
+        prefix: str,
+        limit: int,
+        frequencies: Optional[Counter] = None,
+        data: Any = None,
+    ) -> CompletionList:
+        """Return the ``limit`` best ranked names starting with ``prefix``.
+
+        Ranking is exact match, then commands ``prefix`` is a valid
+        abbreviation of, then how often a command is used in the workspace.
+        The list is incomplete when matches were cut off, so that the client
+        asks again as the prefix grows.  Every item carries ``data``, which
+        the client sends back to resolve it.
+        """
+        prefix = prefix.lower()
+        frequencies = frequencies or Counter()
+        candidates = self.matches(prefix)
+        ranked = heapq.nsmallest(
+            limit, candidates, key=lambda name: self._rank(name, prefix, frequencies)
+        )
+        items = [
+            CompletionItem(
+                label=name,
+                kind=CompletionItemKind.Function,
+                sort_text=f"{rank:04d}",
+                data=data,
+            )
+            for rank, name in enumerate(ranked)
+        ]
+        return CompletionList(is_incomplete=len(candidates) > limit, items=items)
+
+
+@lru_cache(maxsize=None)
+def command_index() -> CompletionIndex:
+    """The index of all commands in ``commands.json``, built on first use."""
+    return CompletionIndex(utils.getCommands())
+
+
+def command_of_line(line: str) -> Optional[str]:
+    """The command word a line starts with, if any."""
+    tokens, _ = tokenize_line(line)
+    if len(tokens) and tokens[0] == WORD:
+        return line[tokens[1] : tokens[2]]
+    return None
+
+
+class CommandFrequencies:
+    """How often each command is used across the open documents.
+
+    Counts are kept per line so that an edit only recounts the lines that
+    changed since the version last counted.  Commands are counted under
+    their full name (``reg`` as ``regress``), as ``index`` (by default
+    ``command_index()``, loaded on the first update) spells them.
+    """
+
+    def __init__(self, index: Optional[CompletionIndex] = None):
+        self.index = index
+        self._documents: Dict[str, Tuple[Optional[int], List[Optional[str]]]] = {}
+        self.counts: Counter = Counter()
+
+    def update(self, uri: str, document) -> Counter:
+        version = getattr(document, "version", None)
+        known = self._documents.get(uri)
+        if known is not None and known[0] == version and version is not None:
+            return self.counts
+
+        change = None
+        if known is not None and isinstance(document, StataDocument):
+            change = document.changes_since(known[0])
+        lines = document.lines
+        commands = known[1] if known else []
+        if change is None:
+            start, old_end, new_end = 0, len(commands), len(lines)
+        else:
+            start, old_end, new_end = change
+
+        if self.index is None:
+            self.index = command_index()
+        canonical = self.index.canonical
+        added = [command_of_line(line) for line in lines[start:new_end]]
+        added = [command and canonical(command) for command in added]
+        self.counts.subtract(command for command in commands[start:old_end] if command)
+        self.counts.update(command for command in added if command)
+        commands[start:old_end] = added
+        self._documents[uri] = (version, commands)
+        return self.counts
+
+    def remove(self, uri: str) -> None:
+        known = self._documents.pop(uri, None)
+        if known is not None:
+            self.counts.subtract(command for command in known[1] if command)
+
+
+def synopsis(markdown: str) -> Optional[str]:
+    """The first syntax diagram of a help page, as one line of plain text."""
+    lines = iter(markdown.splitlines())
+    for line in lines:
+        if line.startswith("## Syntax"):
+            break
+    else:
+        return None
+
+    paragraph: List[str] = []
+    for line in lines:
+        if line.startswith("#"):
+            break
+        if line.strip():
+            paragraph.append(line.strip())
+        elif paragraph:
+            if paragraph[0].startswith("`"):
+                break
+            paragraph = []  # a description above the diagram
+    if not paragraph or not paragraph[0].startswith("`"):
+        return None
+
+    text = _MD_LINK_RE.sub(r"\1", " ".join(paragraph))
+    text = _MD_EMPHASIS_RE.sub("", _MD_ESCAPE_RE.sub(r"\1", text))
+    text = " ".join(text.split())
+    if "<" in text or len(text) > SYNOPSIS_MAX_LENGTH:
+        return None
+    return text
+
+
+@lru_cache(maxsize=RESOLVE_CACHE_SIZE)
+def _documentation(name: str) -> Tuple[Optional[str], Optional[MarkupContent]]:
+    docstring = utils.getDocstringFromWord(name)
+    if not docstring.value:
+        return None, None
+    return synopsis(docstring.value), docstring
+
+
+def documentation_cache_info():
+    """Hits and misses of the help pages cached for ``resolve_item``."""
+    return _documentation.cache_info()
+
+
+def resolve_item(item: CompletionItem) -> CompletionItem:
+    """Fill in the detail and documentation of a completion item on demand."""
+    detail, documentation = _documentation(item.label)
+    if detail is not None:
+        item.detail = detail
+    if documentation is not None:
+        item.documentation = documentation
+    return item
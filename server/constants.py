@@ -1,6 +1,6 @@
 """Define Regex for codestyle checking."""
+import os
 import re
-from lsprotocol.types import DiagnosticSeverity
 
 # Configures
 MAX_LINE_LENGTH = 120
@@ -9,6 +9,21 @@ ENABLECOMPLETION = True
 ENABLEDOCSTRING = True
 ENABLESTYLECHECKING = True
 ENABLEFORMATTING = True
+DIAGNOSTICS_DELAY = 300  # milliseconds without edits before linting
+DIAGNOSTICS_RULE_LIMIT = 1000  # findings of each rule published per document, 0 for all
+DIAGNOSTICS_FOCUS_LINES = 500  # lines past the cursor or last edit linted before a first publish
+WORKER_THREADS = 2  # threads formatting and linting documents off the event loop
+PROCESS_WORKERS = 2  # processes indexing and checking workspace files for the server
+WORKER_CHUNK_LINES = 500  # lines processed between checks for cancellation
+COMPLETION_LIMIT = 50  # completion items returned per request
+WORKSPACE_SYMBOL_LIMIT = 200  # workspace symbols returned per query
+STATS_LOG_INTERVAL = 0  # seconds between server stats log lines, 0 for none
+ANALYSIS_CACHE_MB = 512  # estimated size of the open documents' analyses kept
+WORKSPACE_DIAGNOSTICS_BATCH_MS = 100  # milliseconds between partial workspace diagnostics
+INDEX_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "stata-language-server",
+)
 
 # Diagnostic Regex
 STAR_COMMENTS = re.compile(r'^s*(\*)')
@@ -27,16 +42,33 @@ LOOP_START = re.compile(r'(^\s*).*\{[^}]*$')
 # LOOP_START = re.compile(r'(^\s*)(?:foreach|forvalue).*\{')
 LOOP_END = re.compile(r'(^\s*)\}\s*')
 INDENT_REGEX = re.compile(r'([ \t]*)\S+')
+SPACED_OPERATORS = frozenset(
+    ['==', '!=', '~=', '>=', '<=', '<', '>', '=', '&', '|', '||', '^']
+)
 EXTRANEOUS_WHITESPACE_REGEX = re.compile(r'[\[({] | [\]}),;]| :(?!=)')
 
+# Completion
+WORD_BEFORE_CURSOR = re.compile(r'\w*$')
+
+# Definition lookup
+GENERATE_COMMANDS = frozenset(
+    ['g', 'ge', 'gen', 'gene', 'gener', 'genera', 'generat', 'generate', 'egen']
+)
+STORAGE_TYPE_REGEX = re.compile(r'(byte|int|long|float|double|str[1-9]?[0-9]?[0-9]?[0-9]?|strL)$')
+
 # Diagnostic Messages
 MAX_LINE_LENGTH_MESSAGE = "line too long"
 OP_WHITESPACE_MESSAGE = "whitespace around operator should be 1"
 COMMA_WHITESPACE_MESSAGE = "1 whitespace after ','"
 INAP_INDENT_MESSAGE = "inappropriate indented line"
 
-# Diagnostic Severity
-MAX_LINE_LENGTH_SEVERITY = DiagnosticSeverity.Warning
-OP_WHITESPACE_SEVERITY = DiagnosticSeverity.Warning
-COMMA_WHITESPACE_SEVERITY = DiagnosticSeverity.Warning
-INAP_INDENT_SEVERITY = DiagnosticSeverity.Warning
+# Diagnostic Severity, as LSP DiagnosticSeverity values (1 error, 2 warning,
+# 3 information, 4 hint); plain ints so the command line need not load lsprotocol
+SEVERITY_ERROR = 1
+SEVERITY_WARNING = 2
+SEVERITY_INFORMATION = 3
+SEVERITY_HINT = 4
+MAX_LINE_LENGTH_SEVERITY = SEVERITY_WARNING
+OP_WHITESPACE_SEVERITY = SEVERITY_WARNING
+COMMA_WHITESPACE_SEVERITY = SEVERITY_WARNING
+INAP_INDENT_SEVERITY = SEVERITY_WARNING
@@ -0,0 +1,144 @@
+"""Per-document definition index for goto definition.
+
+Symbols are extracted per line (see ``server.symbols``) and updated
+incrementally as a ``LineIndex``.  Lookups bisect the sorted lines a name
+is defined on, in its namespace: a local ``n`` and a variable ``n`` are
+different names.
+"""
+import os
+from bisect import bisect_left
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .lineindex import LineIndex
+from .symbols import NAME, PROGRAM, Edge, FileSymbols, Key, Symbol, line_symbols, namespace_of
+
+# How many do/include hops goto definition follows from the current file
+MAX_INCLUDE_DEPTH = 4
+
+
+LineDefinitions = Tuple[Tuple[Symbol, ...], Optional[Edge]]
+
+
+class DefinitionIndex(LineIndex[LineDefinitions]):
+    """Where each name is defined in one version of a document."""
+
+    def __init__(self):
+        super().__init__()
+        self._names: Optional[Dict[Key, List[int]]] = None
+
+    def index_line(self, line: str, tokens, state: int) -> LineDefinitions:
+        found, edge = line_symbols(line, tokens, 0)
+        return tuple(found), edge
+
+    def invalidate(self) -> None:
+        self._names = None
+
+    @property
+    def names(self) -> Dict[Key, List[int]]:
+        """(namespace, name) -> sorted lines defining it."""
+        if self._names is None:
+            names: Dict[Key, List[int]] = {}
+            for lineno, (found, _) in enumerate(self.values):
+                for symbol in found:
+                    lines = names.setdefault((namespace_of(symbol.kind), symbol.name), [])
+                    if not lines or lines[-1] != lineno:
+                        lines.append(lineno)
+            self._names = names
+        return self._names
+
+    def lookup(self, key: Key, line: int) -> Optional[Symbol]:
+        """The nearest definition of ``key`` above ``line``.
+
+        Only a program may be defined below the code calling it; anything
+        else with no definition above is left to the included files.
+        """
+        lines = self.names.get(key, [])
+        index = bisect_left(lines, line)
+        candidates = lines[index - 1 : index] if index else lines[index:]
+        for lineno in candidates:
+            for symbol in self.values[lineno][0]:
+                if (namespace_of(symbol.kind), symbol.name) != key:
+                    continue
+                if index or symbol.kind == PROGRAM:
+                    return symbol._replace(line=lineno)
+        return None
+
+    def is_program(self, name: str) -> bool:
+        """Whether the document defines a program ``name``."""
+        return any(
+            symbol.kind == PROGRAM and symbol.name == name
+            for lineno in self.names.get((NAME, name), ())
+            for symbol in self.values[lineno][0]
+        )
+
+    def file_symbols(self) -> FileSymbols:
+        """Everything the document defines, as stored by the workspace index."""
+        symbols = tuple(
+            symbol._replace(line=lineno)
+            for lineno, (found, _) in enumerate(self.values)
+            for symbol in found
+        )
+        return FileSymbols(symbols, tuple(self.edges()))
+
+    def edges(self, before: Optional[int] = None) -> List[Edge]:
+        """do/run/include edges, optionally only those above line ``before``."""
+        return [
+            edge._replace(line=lineno)
+            for lineno, (_, edge) in enumerate(self.values[:before])
+            if edge is not None
+        ]
+
+
+def resolve_edge(target: str, base_dir: str, roots: Iterable[str] = ()) -> Optional[str]:
+    """The file a ``do``/``include`` target refers to, if it can be found.
+
+    Stata resolves relative names against the working directory, which is
+    usually the including file's folder or the project root; both are tried.
+    Targets built from macros cannot be resolved statically.
+    """
+    if "$" in target or "`" in target:
+        return None
+    candidates = [target]
+    if not os.path.splitext(target)[1]:
+        candidates.append(target + ".do")
+    for directory in (base_dir, *roots):
+        for candidate in candidates:
+            path = os.path.normpath(os.path.join(directory, candidate))
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def find_in_included_files(
+    key: Key,
+    path: str,
+    edges: Iterable[Edge],
+    symbols_of: Callable[[str], Optional[FileSymbols]],
+    roots: Iterable[str] = (),
+) -> Optional[Tuple[str, Symbol]]:
+    """Follow do/include edges breadth first for the last definition of ``key``."""
+    roots = list(roots)
+    visited = {os.path.normpath(path)}
+    queue = deque((os.path.dirname(path), edge, 1) for edge in edges)
+    while queue:
+        base_dir, edge, depth = queue.popleft()
+        target = resolve_edge(edge.target, base_dir, roots)
+        if target is None or target in visited:
+            continue
+        visited.add(target)
+        file_symbols = symbols_of(target)
+        if file_symbols is None:
+            continue
+        found = [
+            symbol
+            for symbol in file_symbols.symbols
+            if (namespace_of(symbol.kind), symbol.name) == key
+        ]
+        if found:
+            return target, found[-1]
+        if depth < MAX_INCLUDE_DEPTH:
+            queue.extend(
+                (os.path.dirname(target), e, depth + 1) for e in file_symbols.edges
+            )
+    return None
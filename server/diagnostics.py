@@ -0,0 +1,153 @@
+"""What is published of a document's findings: capped per rule, nearest the focus.
+
+Machine generated do-files can have tens of thousands of operator and comma
+findings, too many to build an lsprotocol object for each, send and show.
+Findings stay compact ``batch.Finding`` tuples, whose message strings are
+shared, until they are written as plain JSON for the client.  At most
+``constants.DIAGNOSTICS_RULE_LIMIT`` findings of each rule are published,
+those around the focus line (the last edit or cursor position), and an
+information finding at the top of the document tells how many of each
+capped rule were left out.
+"""
+from collections import Counter
+from itertools import chain, islice
+from operator import itemgetter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import server.constants as constants
+
+from .batch import Finding, rule_id
+from .linter import LineDiagnostic
+
+CAP_MESSAGE = "{hidden} more {rule} findings not shown, {limit} per rule (setDiagnosticsRuleLimit)"
+
+
+class _Rules(dict):
+    """Rule of each message, looked up once per distinct (shared) message."""
+
+    def __missing__(self, message: str) -> str:
+        rule = self[message] = rule_id(message)
+        return rule
+
+
+def _windows(
+    totals: Dict[str, int], before: Dict[str, int], limit: int
+) -> Dict[str, Tuple[int, int]]:
+    """For each rule over ``limit``, the indices of its findings to keep.
+
+    That is ``limit`` consecutive findings centred on the first one at or
+    past the focus line, of which ``before[rule]`` come before it.
+    """
+    windows = {}
+    for rule, total in totals.items():
+        if total > limit:
+            start = max(0, min(before[rule] - limit // 2, total - limit))
+            windows[rule] = (start, start + limit)
+    return windows
+
+
+def _notes(totals: Dict[str, int], windows: Dict[str, Tuple[int, int]], limit: int):
+    return [
+        Finding(
+            0,
+            0,
+            0,
+            CAP_MESSAGE.format(hidden=totals[rule] - limit, rule=rule, limit=limit),
+            constants.SEVERITY_INFORMATION,
+        )
+        for rule in windows
+    ]
+
+
+def _limit(limit: Optional[int]) -> int:
+    return constants.DIAGNOSTICS_RULE_LIMIT if limit is None else limit
+
+
+def line_findings(
+    line_diagnostics: Sequence[Tuple[LineDiagnostic, ...]],
+    focus: int = 0,
+    stop: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> List[Finding]:
+    """The findings to publish of the lines before ``stop`` (all lines by default).
+
+    At most ``limit`` per rule, around line ``focus``, after a note for each
+    capped rule.  Only the kept findings are built.
+    """
+    limit = _limit(limit)
+    lines = list(islice(line_diagnostics, stop)) if stop is not None else line_diagnostics
+    windows: Dict[str, Tuple[int, int]] = {}
+    if limit > 0:
+        # Count by message, then by rule: only a few distinct messages exist
+        rules = _Rules()
+        totals: Dict[str, int] = Counter()
+        before: Dict[str, int] = Counter()
+        for counts, part in ((totals, lines), (before, islice(lines, focus))):
+            for message, count in Counter(
+                map(itemgetter(2), chain.from_iterable(part))
+            ).items():
+                counts[rules[message]] += count
+        windows = _windows(totals, before, limit)
+    if not windows:
+        return [
+            Finding(lineno, *diagnostic)
+            for lineno, diagnostics in enumerate(lines)
+            if diagnostics
+            for diagnostic in diagnostics
+        ]
+
+    kept = _notes(totals, windows, limit)
+    seen: Dict[str, int] = Counter()
+    for lineno, diagnostics in enumerate(lines):
+        for diagnostic in diagnostics:
+            rule = rules[diagnostic[2]]
+            window = windows.get(rule)
+            if window is not None:
+                index = seen[rule]
+                seen[rule] = index + 1
+                if not window[0] <= index < window[1]:
+                    continue
+            kept.append(Finding(lineno, *diagnostic))
+    return kept
+
+
+def cap_findings(
+    findings: List[Finding], focus: int = 0, limit: Optional[int] = None
+) -> List[Finding]:
+    """``findings``, in line order, capped like ``line_findings``."""
+    limit = _limit(limit)
+    if limit <= 0 or len(findings) <= limit:
+        return findings
+    rules = _Rules()
+    totals = Counter(rules[finding.message] for finding in findings)
+    before = Counter(rules[finding.message] for finding in findings if finding.line < focus)
+    windows = _windows(totals, before, limit)
+    if not windows:
+        return findings
+    kept = _notes(totals, windows, limit)
+    seen: Dict[str, int] = Counter()
+    for finding in findings:
+        rule = rules[finding.message]
+        window = windows.get(rule)
+        if window is not None:
+            index = seen[rule]
+            seen[rule] = index + 1
+            if not window[0] <= index < window[1]:
+                continue
+        kept.append(finding)
+    return kept
+
+
+def diagnostics_json(findings: Sequence[Finding]) -> List[dict]:
+    """The LSP ``Diagnostic`` objects of ``findings`` as JSON data."""
+    return [
+        {
+            "range": {
+                "start": {"line": line, "character": start},
+                "end": {"line": line, "character": end},
+            },
+            "message": message,
+            "severity": severity,
+        }
+        for line, start, end, message, severity in findings
+    ]
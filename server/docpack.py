@@ -0,0 +1,130 @@
+"""Packed hover documentation: all ``md_syntax/*.md`` files in one indexed archive.
+
+Layout (little endian)::
+
+    header  magic b"STDP", format version (u16), flags (u16), entry count (u32)
+    index   per entry: name length (u16), name (utf-8), offset (u64),
+            stored length (u32), raw length (u32)
+    bodies  the markdown of every entry, zlib compressed when FLAG_COMPRESSED
+
+The index is read once into a dict, bodies are sliced out of an ``mmap`` on
+demand.  Build the archive with ``python -m server.docpack``.
+"""
+import argparse
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+MAGIC = b"STDP"
+FORMAT_VERSION = 1
+FLAG_COMPRESSED = 1
+
+_HEADER = struct.Struct("<4sHHI")
+_NAME_LEN = struct.Struct("<H")
+_ENTRY = struct.Struct("<QII")
+
+
+def _iter_markdown(src_dir: str) -> Iterator[Tuple[str, bytes]]:
+    for filename in sorted(os.listdir(src_dir)):
+        if filename.endswith(".md"):
+            with open(os.path.join(src_dir, filename), "rb") as f:
+                yield filename[: -len(".md")], f.read()
+
+
+def build_pack(
+    entries: Iterable[Tuple[str, bytes]], out_path: str, compress: bool = True
+) -> int:
+    """Write ``(name, markdown)`` entries to ``out_path``; return the entry count."""
+    names, bodies = [], []
+    for name, body in entries:
+        names.append(name.encode("utf-8"))
+        bodies.append((zlib.compress(body, 9) if compress else body, len(body)))
+
+    index_size = sum(_NAME_LEN.size + len(name) + _ENTRY.size for name in names)
+    offset = _HEADER.size + index_size
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        flags = FLAG_COMPRESSED if compress else 0
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(names)))
+        for name, (stored, raw_length) in zip(names, bodies):
+            f.write(_NAME_LEN.pack(len(name)))
+            f.write(name)
+            f.write(_ENTRY.pack(offset, len(stored), raw_length))
+            offset += len(stored)
+        for stored, _ in bodies:
+            f.write(stored)
+    os.replace(tmp_path, out_path)
+    return len(names)
+
+
+def build_pack_from_dir(src_dir: str, out_path: str, compress: bool = True) -> int:
+    """Pack every ``<name>.md`` file of ``src_dir``."""
+    return build_pack(_iter_markdown(src_dir), out_path, compress)
+
+
+class DocPack:
+    """Read only view of a packed documentation archive."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a documentation pack")
+        self.compressed = bool(flags & FLAG_COMPRESSED)
+
+        index: Dict[str, Tuple[int, int, int]] = {}
+        pos = _HEADER.size
+        buf = self._mmap
+        for _ in range(count):
+            (name_len,) = _NAME_LEN.unpack_from(buf, pos)
+            pos += _NAME_LEN.size
+            name = buf[pos : pos + name_len].decode("utf-8")
+            pos += name_len
+            index[name] = _ENTRY.unpack_from(buf, pos)
+            pos += _ENTRY.size
+        self._index = index
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def names(self) -> Iterable[str]:
+        return self._index.keys()
+
+    def get(self, name: str) -> Optional[str]:
+        """Return the markdown of ``name``, or None when it is not documented."""
+        entry = self._index.get(name)
+        if entry is None:
+            return None
+        offset, length, raw_length = entry
+        with memoryview(self._mmap) as view, view[offset : offset + length] as body:
+            if self.compressed:
+                return zlib.decompress(body, bufsize=raw_length).decode("utf-8")
+            return str(body, "utf-8")
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Pack md_syntax into one archive")
+    parser.add_argument("--src", default=os.path.join(here, "md_syntax"))
+    parser.add_argument("--out", default=os.path.join(here, "md_syntax.pack"))
+    parser.add_argument(
+        "--no-compress", action="store_true", help="Store the markdown uncompressed"
+    )
+    args = parser.parse_args()
+    count = build_pack_from_dir(args.src, args.out, compress=not args.no_compress)
+    print(f"Packed {count} documents into {args.out} ({os.path.getsize(args.out)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""Text documents backed by a chunked line store for incremental sync."""
+import asyncio
+import time
+from bisect import bisect_right
+from collections import deque
+from collections.abc import Sequence
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from lsprotocol import types
+from pygls.exceptions import JsonRpcException
+from pygls.protocol import LanguageServerProtocol, lsp_method
+from pygls.workspace import TextDocument, Workspace
+
+from .stats import ServerStats
+
+
+def _has_line_break(line: str) -> bool:
+    return line.splitlines()[0] != line
+
+
+class LineStore(Sequence):
+    """Lines of a text (line endings included) kept in fixed-size chunks.
+
+    A ranged edit only rebuilds the chunks it touches, so unchanged lines keep
+    their string objects and the rest of the buffer is never copied.  Chunks
+    are never changed in place: ``snapshot`` is a read-only view of the
+    current lines that later edits leave alone, and two versions share the
+    chunks an edit did not touch (``shared_prefix``, ``shared_suffix``).
+    """
+
+    CHUNK_SIZE = 512
+
+    def __init__(self, text: str = ""):
+        lines = text.splitlines(True)
+        self._chunks: List[List[str]] = [
+            lines[i : i + self.CHUNK_SIZE] for i in range(0, len(lines), self.CHUNK_SIZE)
+        ]
+        self._starts: Optional[List[int]] = None
+        self._len = len(lines)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return [self.line(i) for i in range(start, stop, step)]
+            return self.slice(start, stop)
+        return self.line(index)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def line(self, lineno: int) -> str:
+        if lineno < 0:
+            lineno += self._len
+        if not 0 <= lineno < self._len:
+            raise IndexError("line index out of range")
+        chunk_index = self._chunk_index(lineno)
+        return self._chunks[chunk_index][lineno - self._chunk_starts()[chunk_index]]
+
+    def slice(self, start: int, stop: int) -> List[str]:
+        """Lines ``start`` to ``stop`` (not included), copying only those."""
+        return list(self.iter_from(start, stop))
+
+    def iter_from(self, start: int, stop: Optional[int] = None) -> Iterator[str]:
+        """The lines from ``start`` on, up to ``stop`` if given."""
+        stop = self._len if stop is None else min(stop, self._len)
+        start = max(start, 0)
+        if start >= stop:
+            return
+        chunk_index = self._chunk_index(start)
+        offset = start - self._chunk_starts()[chunk_index]
+        remaining = stop - start
+        for chunk in self._chunks[chunk_index:]:
+            part = chunk[offset : offset + remaining]
+            yield from part
+            remaining -= len(part)
+            if not remaining:
+                return
+            offset = 0
+
+    def lines(self) -> List[str]:
+        return list(self)
+
+    def snapshot(self) -> "LineStore":
+        """A view of the current lines, unaffected by later edits."""
+        view = LineStore.__new__(LineStore)
+        view._chunks, view._starts, view._len = self._chunks, self._starts, self._len
+        return view
+
+    def shared_prefix(self, other: "LineStore") -> int:
+        """Number of leading lines in chunks this store shares with ``other``."""
+        count = 0
+        for mine, theirs in zip(self._chunks, other._chunks):
+            if mine is not theirs:
+                break
+            count += len(mine)
+        return count
+
+    def shared_suffix(self, other: "LineStore") -> int:
+        """Number of trailing lines in chunks this store shares with ``other``."""
+        count = 0
+        for mine, theirs in zip(reversed(self._chunks), reversed(other._chunks)):
+            if mine is not theirs:
+                break
+            count += len(mine)
+        return count
+
+    def text(self) -> str:
+        return "".join(self)
+
+    def _chunk_starts(self) -> List[int]:
+        if self._starts is None:
+            starts, total = [], 0
+            for chunk in self._chunks:
+                starts.append(total)
+                total += len(chunk)
+            self._starts = starts
+        return self._starts
+
+    def _chunk_index(self, lineno: int) -> int:
+        return max(bisect_right(self._chunk_starts(), lineno) - 1, 0)
+
+    def replace(
+        self, start_line: int, start_col: int, end_line: int, end_col: int, text: str
+    ) -> "LineChange":
+        """Replace the text between two (line, column) positions with ``text``."""
+        if start_line >= self._len and self._len:
+            # Edit past the end of the document appends to the last line
+            start_line = end_line = self._len - 1
+            start_col = end_col = len(self[start_line])
+        head = self[start_line][:start_col] if start_line < self._len else ""
+        tail = self[end_line][end_col:] if end_line < self._len else ""
+        joined = head + text + tail
+        if (
+            0 < start_line < self._len
+            and joined[:1] == "\n"
+            and self[start_line - 1][-1:] == "\r"
+        ):
+            # A lone \r before the edit and the \n it starts with make one line break
+            start_line -= 1
+            joined = self[start_line] + joined
+        new_lines = joined.splitlines(True)
+        last_line = min(end_line, self._len - 1)
+        if new_lines and last_line + 1 < self._len:
+            next_line = self[last_line + 1]
+            if not _has_line_break(new_lines[-1]) or (
+                new_lines[-1][-1:] == "\r" and next_line[:1] == "\n"
+            ):
+                # The edit removed a line break or left a lone \r before a \n,
+                # the next line is joined to it
+                last_line += 1
+                new_lines[-1:] = (new_lines[-1] + next_line).splitlines(True)
+
+        if not self._chunks:
+            self._chunks = [[]]
+        first_chunk = self._chunk_index(start_line)
+        last_chunk = self._chunk_index(max(last_line, start_line))
+        base = self._chunk_starts()[first_chunk]
+        if (
+            last_chunk + 1 < len(self._chunks)
+            and len(self._chunks[last_chunk]) < self.CHUNK_SIZE // 2
+        ):
+            # Let small chunks left behind by deletions merge with their neighbour
+            last_chunk += 1
+        affected = [
+            line for chunk in self._chunks[first_chunk : last_chunk + 1] for line in chunk
+        ]
+        removed = max(last_line - start_line + 1, 0)
+        offset = start_line - base
+        affected[offset : offset + removed] = new_lines
+
+        rebuilt = [
+            affected[i : i + self.CHUNK_SIZE]
+            for i in range(0, len(affected), self.CHUNK_SIZE)
+        ]
+        # A new list of chunks, snapshots keep the old one
+        self._chunks = self._chunks[:first_chunk] + rebuilt + self._chunks[last_chunk + 1 :]
+        self._starts = None
+        self._len += len(new_lines) - removed
+        return LineChange(start_line, start_line + removed, start_line + len(new_lines))
+
+
+class LineChange(NamedTuple):
+    """Lines ``[start, old_end)`` of a document were replaced by ``[start, new_end)``."""
+
+    start: int
+    old_end: int
+    new_end: int
+
+    @property
+    def delta(self) -> int:
+        return self.new_end - self.old_end
+
+    def then(self, other: "LineChange") -> "LineChange":
+        """Combine with a change applied afterwards into one covering both."""
+        start = min(self.start, other.start)
+
+        # Where the end of our new lines ends up after ``other``
+        if self.new_end <= other.start:
+            moved_end = self.new_end
+        elif self.new_end >= other.old_end:
+            moved_end = self.new_end + other.delta
+        else:
+            moved_end = other.new_end
+        new_end = max(moved_end, other.new_end)
+
+        # Where the end of the lines replaced by ``other`` was before us
+        if other.old_end <= self.start:
+            original_end = other.old_end
+        elif other.old_end >= self.new_end:
+            original_end = other.old_end - self.delta
+        else:
+            original_end = self.old_end
+        old_end = max(self.old_end, original_end)
+
+        return LineChange(start, old_end, new_end)
+
+
+class StataDocument(TextDocument):
+    """A text document whose content lives in a :class:`LineStore`.
+
+    Every applied change is recorded with the version it produced so that
+    features can ask which lines changed since the version they last saw.
+    """
+
+    MAX_CHANGE_LOG = 64
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._store: Optional[LineStore] = None
+        self._source_cache: Optional[str] = None
+        self._lines_cache: Optional[LineStore] = None
+        self._base_version = self.version
+        self._change_log: deque = deque()
+
+    @property
+    def line_store(self) -> LineStore:
+        if self._store is None:
+            self._store = LineStore(TextDocument.source.fget(self))
+        return self._store
+
+    @property
+    def source(self) -> str:
+        if self._source_cache is None:
+            self._source_cache = self.line_store.text()
+        return self._source_cache
+
+    @property
+    def lines(self) -> LineStore:
+        """The lines of this version, a read-only view sharing the store's chunks."""
+        if self._lines_cache is None:
+            self._lines_cache = self.line_store.snapshot()
+        return self._lines_cache
+
+    def _record(self, change: LineChange) -> None:
+        self._source_cache = None
+        self._lines_cache = None
+        if len(self._change_log) >= self.MAX_CHANGE_LOG:
+            self._base_version = self._change_log.popleft()[0]
+        self._change_log.append([None, change])
+
+    def _apply_incremental_change(
+        self, change: types.TextDocumentContentChangeEvent_Type1
+    ) -> None:
+        """Apply an ``Incremental`` text change to the line store."""
+        store = self.line_store
+        change_range = self._position_codec.range_from_client_units(store, change.range)
+        self._record(
+            store.replace(
+                change_range.start.line,
+                change_range.start.character,
+                change_range.end.line,
+                change_range.end.character,
+                change.text,
+            )
+        )
+
+    def _apply_full_change(self, change: types.TextDocumentContentChangeEvent) -> None:
+        """Apply a ``Full`` text change to the document."""
+        old_len = len(self.line_store)
+        self._store = LineStore(change.text)
+        self._record(LineChange(0, old_len, len(self._store)))
+
+    def set_version(self, version: Optional[int]) -> None:
+        """Stamp the changes applied since the last call with ``version``."""
+        self.version = version
+        for entry in reversed(self._change_log):
+            if entry[0] is not None:
+                break
+            entry[0] = version
+
+    def changes_since(self, version: Optional[int]) -> Optional[LineChange]:
+        """Return the lines changed after ``version``.
+
+        ``None`` means the change log does not reach back to ``version`` and
+        callers have to assume the whole document changed.
+        """
+        if version is None:
+            return None
+        if version == self.version:
+            return LineChange(0, 0, 0)
+        combined = None
+        found = version == self._base_version
+        for entry_version, change in self._change_log:
+            if entry_version == version:
+                found = True
+            elif found:
+                combined = change if combined is None else combined.then(change)
+        if not found:
+            return None
+        return combined if combined is not None else LineChange(0, 0, 0)
+
+
+class StataWorkspace(Workspace):
+    """Workspace creating :class:`StataDocument` instances."""
+
+    def _create_text_document(
+        self,
+        doc_uri: str,
+        source: Optional[str] = None,
+        version: Optional[int] = None,
+        language_id: Optional[str] = None,
+    ) -> TextDocument:
+        return StataDocument(
+            doc_uri,
+            source=source,
+            version=version,
+            language_id=language_id,
+            sync_kind=self._sync_kind,
+            position_codec=self._position_codec,
+        )
+
+    def update_text_document(
+        self,
+        text_doc: types.VersionedTextDocumentIdentifier,
+        change: types.TextDocumentContentChangeEvent,
+    ):
+        document = self._text_documents[text_doc.uri]
+        document.apply_change(change)
+        if isinstance(document, StataDocument):
+            document.set_version(text_doc.version)
+        else:
+            document.version = text_doc.version
+
+
+class StataLanguageServerProtocol(LanguageServerProtocol):
+    """Protocol setting up a :class:`StataWorkspace` on initialize.
+
+    It also times every message into ``stats``: a request from its arrival
+    to its response being sent, a notification until its handlers,
+    including coroutines they started, are done.  For a session of a
+    multi-session server (see ``server.sessions``), ``exit`` and a lost
+    connection close the session instead of ending the process.
+    """
+
+    def __init__(self, server, converter):
+        super().__init__(server, converter)
+        self.stats = ServerStats()
+        self._request_started: Dict[Any, Tuple[str, float]] = {}
+        self._notification: Optional[list] = None  # [method, start, pending coroutines]
+
+    def _handle_request(self, msg_id, method_name, params):
+        self._request_started[msg_id] = (method_name, time.perf_counter())
+        super()._handle_request(msg_id, method_name, params)
+
+    def _send_response(self, msg_id, result=None, error=None):
+        super()._send_response(msg_id, result, error)
+        started = self._request_started.pop(msg_id, None)
+        if started is not None:
+            method_name, start = started
+            self.stats.record(method_name, time.perf_counter() - start, error is not None)
+
+    def _handle_notification(self, method_name, params):
+        notification = [method_name, time.perf_counter(), 0]
+        self._notification = notification
+        try:
+            super()._handle_notification(method_name, params)
+        finally:
+            self._notification = None
+        if not notification[2]:
+            self._finish_notification(notification)
+
+    def _execute_notification(self, handler, *params):
+        notification = self._notification
+        if notification is None or not asyncio.iscoroutinefunction(handler):
+            super()._execute_notification(handler, *params)
+            return
+        future = asyncio.ensure_future(handler(*params))
+        future.add_done_callback(self._execute_notification_callback)
+        notification[2] += 1
+
+        def done(future):
+            notification[2] -= 1
+            if not notification[2]:
+                self._finish_notification(notification, future.cancelled() or future.exception())
+
+        future.add_done_callback(done)
+
+    def notify_json(self, method: str, params: dict) -> None:
+        """Send a notification whose ``params`` are already plain JSON data.
+
+        Unlike ``notify`` nothing goes through the converter, which is slow
+        for large payloads such as thousands of diagnostics.
+        """
+        self._send_data({"jsonrpc": self.VERSION, "method": method, "params": params})
+
+    def _execute_request_callback(self, msg_id, future):
+        # Answer with the error a handler raised, e.g. ContentModified,
+        # where pygls would report an internal error
+        if not future.cancelled() and isinstance(future.exception(), JsonRpcException):
+            self._request_futures.pop(msg_id, None)
+            self._send_response(msg_id, error=future.exception().to_response_error())
+            return
+        super()._execute_request_callback(msg_id, future)
+
+    def _finish_notification(self, notification: list, error=None) -> None:
+        method_name, start, _ = notification
+        self.stats.record(method_name, time.perf_counter() - start, error is not None)
+
+    def connection_lost(self, exc):
+        # Only the session ends when one of many clients goes away
+        host = getattr(self._server, "host", None)
+        if host is None:
+            super().connection_lost(exc)
+        else:
+            host.close_session(self._server)
+
+    @lsp_method(types.EXIT)
+    def lsp_exit(self, *args) -> None:
+        if getattr(self._server, "host", None) is None:
+            LanguageServerProtocol.lsp_exit.__wrapped__(self, *args)
+        elif self.transport is not None:
+            self.transport.close()
+
+    @lsp_method(types.INITIALIZE)
+    def lsp_initialize(self, params: types.InitializeParams) -> types.InitializeResult:
+        # Call the unwrapped base method, the wrapper of this override
+        # already dispatches to a user registered ``initialize`` feature.
+        result = LanguageServerProtocol.lsp_initialize.__wrapped__(self, params)
+        workspace = self._workspace
+        self._workspace = StataWorkspace(
+            workspace.root_uri,
+            self._server._text_document_sync_kind,
+            list(workspace.folders.values()),
+            workspace.position_encoding,
+        )
+        return result
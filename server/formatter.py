@@ -1,104 +1,150 @@
 import re
+from bisect import bisect_left
+from typing import IO, Iterable, Iterator
+
+from .lexer import (
+    COMMA,
+    CONTINUATION,
+    LBRACE,
+    OPERATOR,
+    RBRACE,
+    iter_tokens,
+    tokenize_line,
+)
+
+# Operators formatted with a single space on both sides
+FORMAT_OPERATORS = frozenset(["==", "!=", "~=", ">=", "<=", "||", ">", "<", "=", "&", "|"])
+
+
+def _continuation_start(tokens) -> int | None:
+    """Return the start of the /// continuation of a tokenized line, if any."""
+    if len(tokens) and tokens[-3] == CONTINUATION:
+        return tokens[-2]
+    return None
+
 
 class StataFormatter:
     def __init__(self, max_line_length=72, indent_size=4):
         self.max_line_length = max_line_length
         self.indent_size = indent_size
 
-    def format_code(self, code: str) -> str:
-        """Format Stata code according to style rules."""
-        lines = code.split("\n")
-        lines_reordered, comments_reordered = self._reorder_lines(lines)
-        formatted_lines = self._process_lines(lines_reordered, comments_reordered)
-        formatted_lines_indented = self._apply_indentation(formatted_lines)
-        return "\n".join(formatted_lines_indented)
+    def format_code(self, code: str, depth: int = 0) -> str:
+        """Format Stata code according to style rules.
 
-    def _reorder_lines(self, lines: list[str]) -> tuple[list[str], list[str]]:
-        """Reorder lines to handle `///` continuations and comments."""
-        lines_reordered = []
-        comments_reordered = []
+        ``depth`` is the number of braces open before the code, for formatting
+        a slice of a file.
+        """
+        return "\n".join(self.format_lines(code.split("\n"), depth))
+
+    def format_lines(self, lines: Iterable[str], depth: int = 0) -> Iterator[str]:
+        """Format lines (without line endings) lazily, one output line at a time.
+
+        Each stage only carries the lexer state, the pending continued line and
+        the brace depth to the next line, so memory does not grow with the input.
+        """
+        reordered = self._reorder_lines(lines)
+        formatted = self._process_lines(reordered)
+        return self._apply_indentation(formatted, depth)
+
+    def _reorder_lines(self, lines: Iterable[str]) -> Iterator[tuple[str, str]]:
+        """Join `///` continuations, yielding each statement with its comments."""
+        pending = None  # the statement being joined and its comments
+        continuation = None  # offset of /// in the pending statement
+        state = 0
 
         for line in lines:
-            if lines_reordered:
-                if "///" in lines_reordered[-1] and not re.match(
-                    r"^\*\s", lines_reordered[-1]
-                ):
-                    comments_reordered[-1] += (
-                        lines_reordered[-1].split("///", 1)[1].strip()
-                    )
-                    lines_reordered[-1] = (
-                        lines_reordered[-1].split("///", 1)[0].strip()
-                        + " "
-                        + line.strip()
-                    )
-                else:
-                    lines_reordered.append(line)
-                    comments_reordered.append("")
+            tokens, state = tokenize_line(line, state)
+            line_continuation = _continuation_start(tokens)
+            if pending is not None and continuation is not None:
+                joined, comment = pending
+                comment += joined[continuation + 3 :].strip()
+                head = joined[:continuation].strip() + " "
+                pending = head + line.strip(), comment
+                if line_continuation is not None:
+                    indent = len(line) - len(line.lstrip())
+                    line_continuation += len(head) - indent
             else:
-                lines_reordered.append(line)
-                comments_reordered.append("")
+                if pending is not None:
+                    yield pending
+                pending = line, ""
+            continuation = line_continuation
 
-        return lines_reordered, comments_reordered
+        if pending is not None:
+            yield pending
 
-    def _process_lines(self, lines: list[str], comments: list[str]) -> list[str]:
-        """Process and format lines, handling long lines and comments."""
-        formatted_lines = []
+    def _process_lines(self, statements: Iterable[tuple[str, str]]) -> Iterator[str]:
+        """Format statements, breaking long lines and placing comments."""
+        state = 0
 
-        for line, comment in zip(lines, comments):
+        for line, comment in statements:
             stripped = line.strip()
+            tokens, state = tokenize_line(stripped, state)
             if not stripped:
-                formatted_lines.append(comment)
+                yield comment
                 continue
 
-            formatted = self._format_line(stripped)
-            broken_lines = self._break_long_line(formatted, comment)
-            formatted_lines.extend(broken_lines)
-
-        return formatted_lines
+            formatted = self._format_tokens(stripped, tokens)
+            yield from self._break_long_line(formatted, comment)
 
-    def _apply_indentation(self, lines: list[str]) -> list[str]:
+    def _apply_indentation(self, lines: Iterable[str], depth: int = 0) -> Iterator[str]:
         """Apply indentation rules to formatted lines."""
-        formatted_lines_indented = []
-        open_parenthesis = 0
+        open_parenthesis = depth
+        prev_opens = prev_closes = prev_continues = False
+        state = 0
 
         for i, line in enumerate(lines):
-            if (i > 0) and (
-                "{" in formatted_lines_indented[i - 1]
-                and "}" not in formatted_lines_indented[i - 1]
-            ):
+            tokens, state = tokenize_line(line, state)
+            kinds = tokens[::3]
+            opens, closes = LBRACE in kinds, RBRACE in kinds
+            continues = _continuation_start(tokens) is not None
+            # The first line of a file is never indented, that of a slice may be
+            indented = i > 0 or depth > 0
+
+            if indented and (prev_opens and not prev_closes):
                 open_parenthesis += 1
                 line = " " * open_parenthesis * self.indent_size + line
-            elif (i > 0) and (open_parenthesis > 0) and ("}" not in line):
+            elif indented and (open_parenthesis > 0) and not closes:
                 line = " " * open_parenthesis * self.indent_size + line
-            elif (i > 0) and ("}" in line) and ("{" not in line):
+            elif indented and closes and not opens:
                 open_parenthesis -= 1
                 line = " " * open_parenthesis * self.indent_size + line
 
-            if (
-                (i > 0)
-                and ("///" in formatted_lines_indented[i - 1])
-                and not re.match(r"^\*\s", line)
-            ):
+            if (i > 0) and prev_continues:
                 line = " " * self.indent_size + line
 
-            formatted_lines_indented.append(line)
-
-        return formatted_lines_indented
+            yield line
+            prev_opens, prev_closes, prev_continues = opens, closes, continues
 
     def _format_line(self, line: str) -> str:
         """Format a single line of Stata code."""
-
-        # Format commas (space after, not before)
-        line = re.sub(r"\s*,\s*", ", ", line)
-
-        # Format operators with spaces around them
-        line = re.sub(r"\s*(==|!=|~=|>=|<=|\|\||>|<|=|&|\|)\s*", r" \1 ", line)
-        # line = re.sub(r"(?<![=!])\s*([=|&])(?![=!])\s*", r" \1 ", line)
-
-        # Fix double spaces
-        line = re.sub(r"\s{2,}", " ", line)
-
-        return line.strip()
+        tokens, _ = tokenize_line(line)
+        return self._format_tokens(line, tokens)
+
+    def _format_tokens(self, line: str, tokens) -> str:
+        """Format a line from its tokens, leaving strings, macros and comments as is."""
+        parts = []
+        prev_end = None
+        space_after = False
+
+        for kind, start, end in iter_tokens(tokens):
+            text = line[start:end]
+            spaced = kind == OPERATOR and text in FORMAT_OPERATORS
+            if prev_end is not None:
+                if kind == COMMA:
+                    # No space before commas
+                    pass
+                elif spaced or space_after:
+                    # One space after commas and around operators
+                    parts.append(" ")
+                elif start > prev_end:
+                    # Fix double spaces
+                    gap = line[prev_end:start]
+                    parts.append(gap if len(gap) == 1 else " ")
+            parts.append(text)
+            prev_end = end
+            space_after = spaced or kind == COMMA
+
+        return "".join(parts).strip()
 
     def _break_long_line(self, line: str, comment: str) -> list[str]:
         """Break long lines at logical points, adding /// for continuation."""
@@ -115,109 +161,161 @@ class StataFormatter:
         if len(remaining) <= self.max_line_length or re.search(r"^\*\s", remaining):
             return [remaining + remaining_comment]
 
-        result_lines = []
+        return _LineBreaker(remaining, self.max_line_length).split(remaining_comment)
 
-        while len(remaining) > self.max_line_length + 4:
-            # Try breaking at logical points first (brackets, commas, operators)
-            break_result = self._try_logical_break(remaining)
-            if break_result:
-                segment, remaining = break_result
-                result_lines.append(segment)
-                continue
 
-            # If no logical break works, try breaking at spaces
-            break_result = self._try_space_break(remaining)
-            if break_result:
-                segment, remaining = break_result
-                result_lines.append(segment)
-                continue
+def _window_end(start: int, length: int, size: int) -> int:
+    """End of ``text[start:][:length]`` in ``text`` of ``size`` characters."""
+    if length >= 0:
+        return min(start + length, size)
+    return max(start, size + length)
 
-            # If no valid break point is found, add the entire line
-            result_lines.append(remaining.strip() + remaining_comment)
-            remaining = ""
 
-        if remaining:
-            result_lines.append(remaining.strip() + remaining_comment)
+class _LineBreaker:
+    """Break points of one long line, found in a single left to right scan.
 
-        return result_lines
-
-    def _find_break_points(self, text: str, max_length: int) -> list[int]:
-        """Find potential break points in text within max_length."""
-        break_points = []
-
-        # After closing brackets or parentheses
-        for match in re.finditer(r"[)\]][,|\s]", text[:max_length]):
-            break_points.append(match.end())
-
-        # After commas
-        for match in re.finditer(r",", text[:max_length]):
-            break_points.append(match.end())
-
-        # After logical operators
-        for match in re.finditer(r"\s(&|\||/|:)\s", text[:max_length]):
-            break_points.append(match.end())
-
-        # Sort break points from furthest to nearest
-        break_points.sort(reverse=True)
-        return break_points
-
-    def _find_space_break_points(self, text: str, max_length: int) -> list[int]:
-        """Find space-based break points in text within max_length."""
-        space_break_points = []
-        for match in re.finditer(r"\s", text[: max_length - 3]):
-            space_break_points.append(match.end())
-
-        # Sort break points from furthest to nearest
-        space_break_points.sort(reverse=True)
-        return space_break_points
+    Running balances of braces, double quotes and macro quotes are kept at
+    each delimiter and extended window by window as the scan advances, so
+    whether a segment leaves a delimiter open is answered from two balances
+    instead of recounting the segment, and no character is counted twice.
+    Candidates are matched in place with ``pos``/``endpos`` rather than on
+    copies of the remainder:
 
-    def _is_valid_break_point(self, segment: str) -> bool:
-        """Check if a segment can be safely broken at this point."""
-        open_curly_count = segment.count("{") - segment.count("}")
-        open_quote_count = segment.count('"') % 2
-        open_backtick_count = segment.count("`")
-        close_quote_count = segment.count("'")
+    - after a ``)`` or ``]`` followed by ``,``, ``|`` or a blank
+    - after a comma
+    - after `` & ``, `` | ``, `` / `` and `` : ``
+    - after any blank, when none of the above is usable
+    """
 
-        # Valid break only if all delimiters are properly closed
+    def __init__(self, text: str, max_line_length: int):
+        self.text = text
+        self.max_line_length = max_line_length
+        self.scanned = 0
+        self.delimiters: list[int] = []  # positions of the delimiters seen so far
+        # Balances before each delimiter, plus the one after the last
+        self.braces = [0]
+        self.quotes = [0]
+        self.macros = [0]
+
+    def _scan(self, end: int) -> None:
+        """Extend the running balances up to position ``end``."""
+        if end <= self.scanned:
+            return
+        braces, quotes, macros = self.braces[-1], self.quotes[-1], self.macros[-1]
+        for match in _DELIMITER_RE.finditer(self.text, self.scanned, end):
+            char = match.group()
+            if char == "{":
+                braces += 1
+            elif char == "}":
+                braces -= 1
+            elif char == '"':
+                quotes += 1
+            elif char == "`":
+                macros += 1
+            else:
+                macros -= 1
+            self.delimiters.append(match.start())
+            self.braces.append(braces)
+            self.quotes.append(quotes)
+            self.macros.append(macros)
+        self.scanned = end
+
+    def _is_valid(self, start: int, end: int) -> bool:
+        """Whether ``text[start:end]`` closes every delimiter it opens."""
+        first = bisect_left(self.delimiters, start)
+        last = bisect_left(self.delimiters, end, first)
+        if first == last:
+            return True
         return (
-            open_curly_count <= 0
-            and open_quote_count == 0
-            and open_backtick_count <= close_quote_count
+            self.braces[last] - self.braces[first] <= 0
+            and (self.quotes[last] - self.quotes[first]) % 2 == 0
+            and self.macros[last] - self.macros[first] <= 0
         )
 
-    def _try_logical_break(
-        self,
-        text: str,
-    ) -> tuple[str, str] | None:
-        """Try to break text at logical break points."""
-        break_points = self._find_break_points(text, self.max_line_length)
+    def _last_valid(self, start: int, ends: list[int]) -> int | None:
+        for end in sorted(ends, reverse=True):
+            if self._is_valid(start, end):
+                return end
+        return None
 
-        for break_pos in break_points:
-            segment = text[:break_pos]
-            if self._is_valid_break_point(segment):
-                # Valid break point found
-                return segment.strip() + " ///", text[break_pos:]
+    def _logical_break(self, start: int) -> int | None:
+        text = self.text
+        window = _window_end(start, self.max_line_length, len(text))
+        ends = [m.end() for m in _BRACKET_BREAK_RE.finditer(text, start, window)]
+        ends += [m.end() for m in _COMMA_BREAK_RE.finditer(text, start, window)]
+        ends += [m.end() for m in _OPERATOR_BREAK_RE.finditer(text, start, window)]
+        return self._last_valid(start, ends)
+
+    def _space_break(self, start: int) -> int | None:
+        text = self.text
+        window = _window_end(start, self.max_line_length - 3, len(text))
+        ends = [m.end() for m in _SPACE_BREAK_RE.finditer(text, start, window)]
+        return self._last_valid(start, ends)
+
+    def split(self, comment: str) -> list[str]:
+        """Break the line into ``///`` continued segments, the last one with ``comment``."""
+        text = self.text
+        result_lines = []
+        start = 0
+
+        while len(text) - start > self.max_line_length + 4:
+            self._scan(_window_end(start, self.max_line_length, len(text)))
+            # Try breaking at logical points first (brackets, commas, operators),
+            # then at spaces
+            end = self._logical_break(start)
+            if end is None:
+                end = self._space_break(start)
+            if end is None:
+                # If no valid break point is found, add the entire line
+                break
+            result_lines.append(text[start:end].strip() + " ///")
+            start = end
+
+        if start < len(text):
+            result_lines.append(text[start:].strip() + comment)
 
-        return None
+        return result_lines
 
-    def _try_space_break(
-        self,
-        text: str,
-    ) -> tuple[str, str] | None:
-        """Try to break text at spaces."""
-        space_break_points = self._find_space_break_points(text, self.max_line_length)
 
-        for break_pos in space_break_points:
-            segment = text[:break_pos]
-            if self._is_valid_break_point(segment):
-                # Valid break point found
-                return segment.strip() + " ///", text[break_pos:]
+_DELIMITER_RE = re.compile(r"[{}\"`']")
+_BRACKET_BREAK_RE = re.compile(r"[)\]][,|\s]")
+_COMMA_BREAK_RE = re.compile(r",")
+_OPERATOR_BREAK_RE = re.compile(r"\s(&|\||/|:)\s")
+_SPACE_BREAK_RE = re.compile(r"\s")
 
-        return None
 
 def format_stata_code(
-    code: str, max_line_length: int = 72, indent_size: int = 4
+    code: str, max_line_length: int = 72, indent_size: int = 4, depth: int = 0
 ) -> str:
     """Format Stata code according to style rules."""
     formatter = StataFormatter(max_line_length=max_line_length, indent_size=indent_size)
-    return formatter.format_code(code)
+    return formatter.format_code(code, depth)
+
+
+def split_lines(source: Iterable[str]) -> Iterator[str]:
+    """Lines of a file object or line iterable as ``str.split("\\n")`` gives them."""
+    ended = True  # an empty source is one empty line
+    for line in source:
+        ended = line.endswith("\n")
+        yield line[:-1] if ended else line
+    if ended:
+        yield ""
+
+
+def format_stream(
+    source: Iterable[str],
+    out: IO[str],
+    max_line_length: int = 72,
+    indent_size: int = 4,
+    depth: int = 0,
+) -> None:
+    """Format the lines of ``source`` (e.g. an open file) into ``out`` as they are read.
+
+    The result is the same as ``format_stata_code`` on the whole text, in
+    memory bounded by the longest statement rather than the file size.
+    """
+    formatter = StataFormatter(max_line_length=max_line_length, indent_size=indent_size)
+    separator = ""
+    for line in formatter.format_lines(split_lines(source), depth):
+        out.write(separator + line)
+        separator = "\n"
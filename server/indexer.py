@@ -0,0 +1,262 @@
+"""Background index of the .do/.ado files in the workspace folders.
+
+Files are parsed into symbols (see ``server.symbols``) in a process pool.
+The server passes its ``ProcessPool``, whose processes are spawned rather
+than forked: forking a process running several threads can deadlock the
+child on a lock another thread held.
+The index is persisted as JSON under ``constants.INDEX_CACHE_DIR``; an
+entry is reused when the file's mtime and size are unchanged, or when its
+content hash still matches after a touch, so restarts only parse what
+actually changed.
+"""
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import server.constants as constants
+
+from .symbols import Edge, FileSymbols, Symbol, extract_symbols
+
+INDEX_FORMAT_VERSION = 2
+INDEX_SUFFIXES = (".do", ".ado")
+# Fewer stale files than this are parsed in the calling thread
+POOL_THRESHOLD = 8
+
+
+class ProcessPool:
+    """A fixed number of spawned processes, started when first needed and reused."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+class FileEntry(NamedTuple):
+    mtime_ns: int
+    size: int
+    digest: str
+    symbols: FileSymbols
+
+
+# (path, mtime_ns, size, digest, symbols or None when the digest was unchanged)
+IndexedFile = Tuple[str, int, int, str, Optional[FileSymbols]]
+
+
+def file_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def index_file(path: str, digest: Optional[str] = None) -> Optional[IndexedFile]:
+    """Read and parse one file; runs in the worker processes.
+
+    The parse is skipped when the content still hashes to ``digest``.
+    Returns None when the file cannot be read.
+    """
+    try:
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            data = f.read()
+    except OSError:
+        return None
+    new_digest = file_digest(data)
+    if new_digest == digest:
+        return path, stat.st_mtime_ns, stat.st_size, new_digest, None
+    lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+    return path, stat.st_mtime_ns, stat.st_size, new_digest, extract_symbols(lines)
+
+
+def is_indexed_path(path: str) -> bool:
+    return path.lower().endswith(INDEX_SUFFIXES)
+
+
+def discover(roots: Iterable[str]) -> Iterator[str]:
+    """All .do/.ado files below ``roots``, skipping hidden directories."""
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for filename in filenames:
+                if is_indexed_path(filename):
+                    yield os.path.join(dirpath, filename)
+
+
+def cache_file_for(roots: Iterable[str], cache_dir: str, prefix: str = "index") -> str:
+    key = hashlib.sha1("\0".join(sorted(roots)).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{prefix}-{key}.json")
+
+
+class WorkspaceIndex:
+    """Symbols of every workspace file, kept up to date from disk.
+
+    ``refresh`` and ``update`` block while files are parsed and are meant to
+    run in a background thread; queries may run concurrently from the event
+    loop.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        workers: Optional[int] = None,
+        pool: Optional[ProcessPool] = None,
+    ):
+        self.cache_dir = constants.INDEX_CACHE_DIR if cache_dir is None else cache_dir
+        self.workers = workers  # 0 parses in the calling thread
+        self.pool = pool  # shared processes to parse in, instead of a pool of its own
+        self.roots: List[str] = []
+        self.files: Dict[str, FileEntry] = {}
+        self.parsed = 0  # files actually parsed, for tests and stats
+        self._cache_path: Optional[str] = None
+        self._lock = threading.Lock()
+        self._own_pool: Optional[ProcessPool] = None
+
+    # Persistence
+
+    def load(self) -> None:
+        """Read the on-disk index for the current roots, if there is one."""
+        try:
+            with open(self._cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != INDEX_FORMAT_VERSION:
+            return
+        files = {}
+        for path, (mtime_ns, size, digest, symbols, edges) in data["files"].items():
+            file_symbols = FileSymbols(
+                tuple(Symbol(*symbol) for symbol in symbols),
+                tuple(Edge(*edge) for edge in edges),
+            )
+            files[path] = FileEntry(mtime_ns, size, digest, file_symbols)
+        with self._lock:
+            self.files = files
+
+    def save(self) -> None:
+        if self._cache_path is None:
+            return
+        with self._lock:
+            files = {
+                path: [entry.mtime_ns, entry.size, entry.digest, *entry.symbols]
+                for path, entry in self.files.items()
+            }
+        os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+        tmp_path = self._cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_FORMAT_VERSION, "files": files}, f)
+        os.replace(tmp_path, self._cache_path)
+
+    # Indexing
+
+    def _parse(self, jobs: List[Tuple[str, Optional[str]]]) -> List[IndexedFile]:
+        paths = [path for path, _ in jobs]
+        digests = [digest for _, digest in jobs]
+        if self.workers == 0 or len(jobs) < POOL_THRESHOLD:
+            results = map(index_file, paths, digests)
+        else:
+            if self.pool is None:
+                self.pool = self._own_pool = ProcessPool(self.workers or os.cpu_count() or 1)
+            chunksize = max(1, len(jobs) // (4 * self.pool.workers))
+            results = self.pool.executor.map(index_file, paths, digests, chunksize=chunksize)
+        return [result for result in results if result is not None]
+
+    def _reindex(self, paths: Iterable[str]) -> bool:
+        """Parse the files among ``paths`` whose stat changed; True if any entry did."""
+        jobs = []
+        removed = []
+        with self._lock:
+            for path in paths:
+                entry = self.files.get(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    if entry is not None:
+                        removed.append(path)
+                    continue
+                if entry is None:
+                    jobs.append((path, None))
+                elif (entry.mtime_ns, entry.size) != (stat.st_mtime_ns, stat.st_size):
+                    jobs.append((path, entry.digest))
+            for path in removed:
+                del self.files[path]
+
+        results = self._parse(jobs)
+        with self._lock:
+            for path, mtime_ns, size, digest, symbols in results:
+                if symbols is None:
+                    entry = self.files.get(path)
+                    if entry is None:  # removed meanwhile
+                        continue
+                    symbols = entry.symbols
+                else:
+                    self.parsed += 1
+                self.files[path] = FileEntry(mtime_ns, size, digest, symbols)
+        return bool(removed or results)
+
+    def refresh(self, roots: Iterable[str]) -> None:
+        """(Re)build the index for ``roots``, starting from the on-disk cache."""
+        roots = sorted(os.path.abspath(root) for root in roots)
+        if roots != self.roots or self._cache_path is None:
+            self.roots = roots
+            self._cache_path = cache_file_for(roots, self.cache_dir)
+            self.load()
+        paths = set(discover(roots))
+        with self._lock:
+            gone = [path for path in self.files if path not in paths]
+            for path in gone:
+                del self.files[path]
+        if self._reindex(sorted(paths)) or gone:
+            self.save()
+
+    def update(self, paths: Iterable[str]) -> None:
+        """Re-check files reported as created, changed or deleted."""
+        paths = [os.path.abspath(path) for path in paths if is_indexed_path(path)]
+        if paths and self._reindex(paths):
+            self.save()
+
+    def close(self) -> None:
+        if self._own_pool is not None:
+            self._own_pool.close()
+            self.pool = self._own_pool = None
+
+    # Queries
+
+    def get(self, path: str) -> Optional[FileSymbols]:
+        entry = self.files.get(path)
+        return None if entry is None else entry.symbols
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, Symbol]]:
+        """The ``limit`` symbols whose name contains ``query``, prefix matches first."""
+        query = query.lower()
+        with self._lock:
+            entries = list(self.files.items())
+        found = (
+            (path, symbol)
+            for path, entry in entries
+            for symbol in entry.symbols.symbols
+            if query in symbol.name.lower()
+        )
+        return heapq.nsmallest(
+            limit,
+            found,
+            key=lambda item: (
+                not item[1].name.lower().startswith(query),
+                len(item[1].name),
+                item[1].name,
+            ),
+        )
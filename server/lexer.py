@@ -0,0 +1,186 @@
+"""Single pass tokenizer for Stata source.
+
+Every line is turned into a compact token stream: an ``array`` of unsigned
+ints holding ``kind, start, end`` triples (python indices into the line).
+Whitespace and line endings are not emitted.  Block comments and ``///``
+continuations span lines, so the tokenizer carries a small integer state
+from one line to the next.
+"""
+import re
+from array import array
+from typing import Iterable, Iterator, Optional, Tuple
+
+# Token kinds
+WORD = 1
+NUMBER = 2
+STRING = 3  # "..."
+COMPOUND_STRING = 4  # `"..."'
+LOCAL_MACRO = 5  # `name'
+GLOBAL_MACRO = 6  # $name, ${name}
+OPERATOR = 7
+COMMA = 8
+LBRACE = 9
+RBRACE = 10
+PUNCT = 11
+FORMAT = 12  # %9.2f, %td, ...
+LINE_COMMENT = 13  # // ...
+CONTINUATION = 14  # /// ...
+STAR_COMMENT = 15  # * ...
+BLOCK_COMMENT = 16  # /* ... */
+
+COMMENTS = frozenset({LINE_COMMENT, CONTINUATION, STAR_COMMENT, BLOCK_COMMENT})
+
+# State carried from one line to the next
+IN_BLOCK_COMMENT = 1
+CONTINUED = 2  # the previous line ended with ///
+
+Token = Tuple[int, int, int]
+
+_TOKEN_RE = re.compile(
+    r"""
+    \s*(?:
+    (?P<block>/\*)
+    |(?P<cont>///)
+    |(?P<line>//)
+    |(?P<cstring>`")
+    |(?P<local>`)
+    |(?P<string>"[^"\r\n]*"?)
+    |(?P<glob>\$(?:\{[^}\r\n]*\}|[^\W\d]\w*))
+    |(?P<format>%-?~?\d*(?:\.\d+)?,?[a-zA-Z]\w*)
+    |(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    |(?P<word>[^\W\d]\w*)
+    |(?P<op>==|!=|~=|>=|<=|\|\||[<>=!~&|^+\-*/])
+    |(?P<comma>,)
+    |(?P<lbrace>\{)
+    |(?P<rbrace>\})
+    |(?P<punct>\S)
+    )""",
+    re.VERBOSE,
+)
+_COMPOUND_RE = re.compile(r'`"|"\'')
+_MACRO_QUOTES_RE = re.compile(r"[`']")
+
+_SIMPLE_KINDS = {
+    "string": STRING,
+    "glob": GLOBAL_MACRO,
+    "format": FORMAT,
+    "number": NUMBER,
+    "word": WORD,
+    "op": OPERATOR,
+    "comma": COMMA,
+    "lbrace": LBRACE,
+    "rbrace": RBRACE,
+    "punct": PUNCT,
+}
+
+
+def _content_end(line: str) -> int:
+    """Index of the line ending (or the length of the line)."""
+    return len(line.rstrip("\r\n"))
+
+
+def _scan_compound_string(line: str, pos: int, limit: int) -> int:
+    """Return the end of a compound string whose opening `" ends at pos."""
+    depth = 1
+    for match in _COMPOUND_RE.finditer(line, pos, limit):
+        depth += 1 if match.group() == '`"' else -1
+        if depth == 0:
+            return match.end()
+    return limit
+
+
+def _scan_local_macro(line: str, pos: int, limit: int) -> Optional[int]:
+    """Return the end of a local macro whose backtick ends at pos, if closed."""
+    depth = 1
+    for match in _MACRO_QUOTES_RE.finditer(line, pos, limit):
+        depth += 1 if match.group() == "`" else -1
+        if depth == 0:
+            return match.end()
+    return None
+
+
+def tokenize_line(line: str, state: int = 0) -> Tuple[array, int]:
+    """Tokenize one line; return its tokens and the state for the next line."""
+    tokens = array("I")
+    limit = _content_end(line)
+    pos = 0
+
+    if state & IN_BLOCK_COMMENT:
+        close = line.find("*/", 0, limit)
+        if close < 0:
+            if limit:
+                tokens.extend((BLOCK_COMMENT, 0, limit))
+            return tokens, state
+        pos = close + 2
+        tokens.extend((BLOCK_COMMENT, 0, pos))
+
+    # A star comment has to start the command, not continue the previous line
+    star_allowed = not tokens and not state & CONTINUED
+    continued = False
+    state = 0
+    match = _TOKEN_RE.match
+
+    while pos < limit:
+        m = match(line, pos, limit)
+        if m is None:
+            # Only whitespace left
+            break
+        kind = m.lastgroup
+        start, end = m.span(kind)
+
+        if star_allowed and line[start] == "*":
+            tokens.extend((STAR_COMMENT, start, limit))
+            break
+        star_allowed = False
+
+        simple = _SIMPLE_KINDS.get(kind)
+        if simple is not None:
+            tokens.extend((simple, start, end))
+        elif kind == "block":
+            close = line.find("*/", end, limit)
+            if close < 0:
+                tokens.extend((BLOCK_COMMENT, start, limit))
+                state |= IN_BLOCK_COMMENT
+                break
+            end = close + 2
+            tokens.extend((BLOCK_COMMENT, start, end))
+        elif kind == "cont" or kind == "line":
+            if start and not line[start - 1].isspace():
+                # Not a comment unless preceded by a blank, e.g. http://
+                tokens.extend((OPERATOR, start, start + 1))
+                pos = start + 1
+                continue
+            if kind == "cont":
+                tokens.extend((CONTINUATION, start, limit))
+                continued = True
+            else:
+                tokens.extend((LINE_COMMENT, start, limit))
+            break
+        elif kind == "cstring":
+            end = _scan_compound_string(line, end, limit)
+            tokens.extend((COMPOUND_STRING, start, end))
+        else:  # local macro
+            macro_end = _scan_local_macro(line, end, limit)
+            if macro_end is None:
+                tokens.extend((PUNCT, start, end))
+            else:
+                end = macro_end
+                tokens.extend((LOCAL_MACRO, start, end))
+        pos = end
+
+    if continued:
+        state |= CONTINUED
+    return tokens, state
+
+
+def iter_tokens(tokens: array) -> Iterator[Token]:
+    """Iterate over the ``(kind, start, end)`` triples of a line."""
+    it = iter(tokens)
+    return zip(it, it, it)
+
+
+def tokenize(lines: Iterable[str], state: int = 0) -> Iterator[Tuple[array, int]]:
+    """Tokenize consecutive lines, yielding each line's tokens and end state."""
+    for line in lines:
+        tokens, state = tokenize_line(line, state)
+        yield tokens, state
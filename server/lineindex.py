@@ -0,0 +1,94 @@
+"""Per-line values of a document that are recomputed only for edited lines.
+
+Subclasses compute one value per line from its tokens and the lexer state
+carried into it (e.g. ``CONTINUED`` after a ``///`` line).  The lexer state
+before each line is kept as a checkpoint: a new document version is
+re-indexed from the first changed line (taken from the document change
+log) until the state carried into the untouched tail matches the old
+checkpoint again, and the old values are reused after that.  Values must
+not depend on their line number since unchanged lines may shift.
+
+Indexes of the same document can share one tokenization: pass ``update``
+a ``LineIndex`` of the line tokens (``analysis.TokenStream``) that is
+current for the document, and its tokens and states are read instead of
+lexing the lines again.
+"""
+from itertools import islice
+from typing import Generic, List, Optional, TypeVar
+
+from .document import LineStore, StataDocument
+from .lexer import tokenize_line
+
+T = TypeVar("T")
+
+
+class LineIndex(Generic[T]):
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.states: List[int] = [0]  # lexer state before each line
+        self.values: List[T] = []
+        self.extracted = 0  # lines indexed by the last update
+        self._current = False
+
+    def index_line(self, line: str, tokens, state: int) -> T:
+        raise NotImplementedError
+
+    def invalidate(self) -> None:
+        """Drop whatever was derived from ``values``."""
+
+    def is_current(self, document) -> bool:
+        """Whether the index already reflects this version of ``document``."""
+        version = getattr(document, "version", None)
+        return self._current and version is not None and version == self.version
+
+    def update(self, document, tokens: Optional["LineIndex"] = None):
+        """Bring the index up to date with ``document``; return self.
+
+        ``tokens``, if given, holds the tokens of the current version of
+        ``document`` as its values.
+        """
+        if self.is_current(document):
+            return self
+        version = getattr(document, "version", None)
+
+        change = None
+        if self._current and isinstance(document, StataDocument):
+            change = document.changes_since(self.version)
+        lines = document.lines
+        if change is None:
+            self.states = [0]
+            self.values = []
+            start, old_end, new_end = 0, 0, len(lines)
+        else:
+            start, old_end, new_end = change
+
+        old_states = self.states
+        shift = old_end - new_end
+        states = old_states[: start + 1]
+        values: List[T] = []
+        state = states[start]
+        lineno = start
+        if isinstance(lines, LineStore):
+            following = lines.iter_from(start)
+        else:
+            following = islice(lines, start, None)
+        for line in following:
+            if lineno >= new_end and state == old_states[lineno + shift]:
+                break
+            if tokens is None:
+                line_tokens, next_state = tokenize_line(line, state)
+            else:
+                line_tokens, next_state = tokens.values[lineno], tokens.states[lineno + 1]
+            values.append(self.index_line(line, line_tokens, state))
+            state = next_state
+            states.append(state)
+            lineno += 1
+
+        self.extracted = lineno - start
+        resume = lineno + shift
+        self.states = states + old_states[resume + 1 :]
+        self.values[start:resume] = values
+        self.version = version
+        self._current = True
+        self.invalidate()
+        return self
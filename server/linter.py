@@ -0,0 +1,440 @@
+"""Line based codestyle checking on the token stream, with per-line state checkpoints."""
+from array import array
+from functools import lru_cache
+from itertools import islice
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import server.constants as constants
+
+from .lexer import (
+    BLOCK_COMMENT,
+    COMMA,
+    COMMENTS,
+    CONTINUATION,
+    CONTINUED,
+    IN_BLOCK_COMMENT,
+    LBRACE,
+    LINE_COMMENT,
+    OPERATOR,
+    RBRACE,
+    STAR_COMMENT,
+    Token,
+    iter_tokens,
+    tokenize_line,
+)
+
+
+class LineDiagnostic(NamedTuple):
+    """A finding on a single line; messages are shared between findings."""
+
+    start: int
+    end: int
+    message: str
+    severity: int
+
+
+NO_DIAGNOSTICS: Tuple[LineDiagnostic, ...] = ()
+
+
+class LineState(NamedTuple):
+    """Cross line state carried from one line to the next."""
+
+    isInComm: bool = False
+    loopLevel: int = 0
+    prevComm: int = 0
+
+
+INITIAL_STATE = LineState()
+
+
+def _lex_state(state: LineState) -> int:
+    """The lexer state a line is tokenized from."""
+    return (IN_BLOCK_COMMENT if state.isInComm else 0) | (CONTINUED if state.prevComm else 0)
+
+
+@lru_cache(maxsize=None)
+def indent_message(expected_space: int) -> str:
+    """The indentation message, one string per expected width."""
+    return f"{constants.INAP_INDENT_MESSAGE} (expected {expected_space} spaces)"
+
+
+def _comment_line(tokens: List[Token], starts_in_comment: bool) -> bool:
+    """Whether a line is a ``*`` or ``//`` comment, or only opens a ``/*`` comment."""
+    if not tokens or starts_in_comment:
+        return False
+    first_kind = tokens[0][0]
+    if first_kind == BLOCK_COMMENT:
+        return all(kind in COMMENTS for kind, _, _ in tokens)
+    return first_kind in COMMENTS
+
+
+def lint_line(
+    line: str,
+    state: LineState,
+    max_line_length: int,
+    indent_space: int,
+    lexed: Optional[Tuple[array, int]] = None,
+) -> Tuple[LineState, Tuple[LineDiagnostic, ...]]:
+    """Check a single line and return the state for the next line with the findings.
+
+    ``lexed`` optionally gives the tokens and end state of the line,
+    tokenized from ``_lex_state(state)``.
+
+    The maximum line length applies to the code before a trailing ``//``
+    or ``///`` comment, on every line except ``*`` and ``//`` comment lines
+    and lines opening a ``/*`` comment with no code after it: lines inside a
+    block comment and code after a closing ``*/`` are checked.  ``*``
+    comment lines are only checked for indentation, and not at all at the
+    start of the line, where code is commented out.
+    """
+    isInComm, loopLevel, prevComm = state
+    tokens, lex_state = lexed or tokenize_line(line, _lex_state(state))
+    tokens = list(iter_tokens(tokens))
+    diagnostics: List[LineDiagnostic] = []
+
+    # Max line length, not counting a trailing // comment
+    code_end = len(line.rstrip("\r\n"))
+    for kind, start, _ in tokens:
+        if kind == LINE_COMMENT or kind == CONTINUATION:
+            code_end = start
+            break
+    if code_end > max_line_length and not _comment_line(tokens, isInComm):
+        diagnostics.append(
+            LineDiagnostic(
+                max_line_length,
+                max_line_length,
+                constants.MAX_LINE_LENGTH_MESSAGE,
+                constants.MAX_LINE_LENGTH_SEVERITY,
+            )
+        )
+
+    # Still inside a comment block
+    if isInComm and lex_state & IN_BLOCK_COMMENT:
+        return state, tuple(diagnostics)
+    starts_in_comment = isInComm
+    isInComm = bool(lex_state & IN_BLOCK_COMMENT)
+
+    if not tokens:
+        return LineState(isInComm, loopLevel, max(prevComm - 1, 0)), tuple(diagnostics)
+
+    first_kind, first_start, _ = tokens[0]
+
+    # Star Comments, indented like the code around them
+    if first_kind == STAR_COMMENT:
+        expected_space = (loopLevel + prevComm) * indent_space
+        if first_start and first_start != expected_space:
+            diagnostics.append(
+                LineDiagnostic(
+                    first_start,
+                    first_start,
+                    indent_message(expected_space),
+                    constants.INAP_INDENT_SEVERITY,
+                )
+            )
+        return LineState(isInComm, loopLevel, prevComm), tuple(diagnostics)
+
+    code = [token for token in tokens if token[0] not in COMMENTS]
+    for index, (kind, start, end) in enumerate(code):
+        # Operator Checker
+        if kind == OPERATOR and line[start:end] in constants.SPACED_OPERATORS:
+            if index > 0 and code[index - 1][0] != COMMA:
+                if start - code[index - 1][2] != 1:
+                    diagnostics.append(
+                        LineDiagnostic(
+                            start,
+                            start,
+                            constants.OP_WHITESPACE_MESSAGE,
+                            constants.OP_WHITESPACE_SEVERITY,
+                        )
+                    )
+            if index + 1 < len(code):
+                next_start = code[index + 1][1]
+                if next_start - end != 1:
+                    diagnostics.append(
+                        LineDiagnostic(
+                            next_start,
+                            next_start,
+                            constants.OP_WHITESPACE_MESSAGE,
+                            constants.OP_WHITESPACE_SEVERITY,
+                        )
+                    )
+
+        # Comma Checker
+        elif kind == COMMA and index + 1 < len(code):
+            next_start = code[index + 1][1]
+            if next_start - end != 1:
+                diagnostics.append(
+                    LineDiagnostic(
+                        next_start,
+                        next_start,
+                        constants.COMMA_WHITESPACE_MESSAGE,
+                        constants.COMMA_WHITESPACE_SEVERITY,
+                    )
+                )
+
+    # Combined Indent Checker for both Comments and Loops
+    # First, adjust indentation levels based on closing structures
+    if code and code[0][0] == RBRACE and code[0][1] == first_start and loopLevel > 0:
+        loopLevel -= 1
+
+    # Check indentation against the combined requirements
+    if not starts_in_comment:
+        expected_space = (loopLevel + prevComm) * indent_space
+        if first_start != expected_space:
+            diagnostics.append(
+                LineDiagnostic(
+                    first_start,
+                    first_start,
+                    indent_message(expected_space),
+                    constants.INAP_INDENT_SEVERITY,
+                )
+            )
+
+    # Adjust indentation levels based on opening structures
+    for kind, _, _ in reversed(code):
+        if kind == LBRACE:
+            loopLevel += 1
+        if kind == LBRACE or kind == RBRACE:
+            break
+
+    # Handle comment indentation state - check current line before adjusting for next line
+    has_long_comment = tokens[-1][0] == CONTINUATION
+
+    if prevComm > 0 and not has_long_comment:
+        prevComm -= 1
+
+    if has_long_comment:
+        prevComm = 1
+
+    return LineState(isInComm, loopLevel, prevComm), tuple(diagnostics)
+
+
+class LintResult:
+    """Lint output of one document version, kept to re-lint the next one incrementally.
+
+    ``states[i]`` is the state before line ``i`` (``states`` has one more entry
+    than ``lines``) and ``line_diagnostics[i]`` holds the findings on line ``i``.
+    """
+
+    __slots__ = ("version", "config", "lines", "states", "line_diagnostics", "relinted")
+
+    def __init__(
+        self,
+        version: Optional[int],
+        config: Tuple[int, int],
+        lines: Sequence[str],
+        states: List[LineState],
+        line_diagnostics: List[Tuple[LineDiagnostic, ...]],
+        relinted: int,
+    ):
+        self.version = version
+        self.config = config
+        self.lines = lines
+        self.states = states
+        self.line_diagnostics = line_diagnostics
+        self.relinted = relinted  # number of lines actually checked
+
+    def logical_range(
+        self, first: int, last: int, close_blocks: bool = True
+    ) -> Tuple[int, int]:
+        """Widen lines ``first..last`` to whole statements and brace blocks.
+
+        The range is grown until it neither starts nor ends inside a ``///``
+        continuation or a block comment, and every brace it closes is opened
+        inside it.  With ``close_blocks`` every brace it opens is closed
+        inside it too.
+        """
+        states = self.states
+        n_lines = len(self.lines)
+        first = max(0, min(first, n_lines - 1))
+        last = max(first, min(last, n_lines - 1))
+        while True:
+            previous = (first, last)
+            while first > 0 and (states[first].prevComm or states[first].isInComm):
+                first -= 1
+            while last + 1 < n_lines and (
+                states[last + 1].prevComm or states[last + 1].isInComm
+            ):
+                last += 1
+            lowest = min(state.loopLevel for state in states[first : last + 2])
+            while first > 0 and states[first].loopLevel > lowest:
+                first -= 1
+            while (
+                close_blocks
+                and last + 1 < n_lines
+                and states[last + 1].loopLevel > states[first].loopLevel
+            ):
+                last += 1
+            if (first, last) == previous:
+                return first, last
+
+
+def lint_config() -> Tuple[int, int]:
+    """Return the settings the lint results depend on."""
+    return (constants.MAX_LINE_LENGTH, constants.INDENT_SPACE)
+
+
+def diagnostics_result_id(digest: str, config: Optional[Tuple[int, int]] = None) -> str:
+    """Id of the diagnostics of content hashing to ``digest`` under ``config``.
+
+    ``config`` defaults to the current ``lint_config``.
+    """
+    return "-".join([digest, *map(str, lint_config() if config is None else config)])
+
+
+def _iter_lines(lines: Sequence[str], start: int):
+    """The lines from ``start`` on, without walking or copying those before."""
+    iter_from = getattr(lines, "iter_from", None)
+    return iter_from(start) if iter_from is not None else islice(lines, start, None)
+
+
+def _shared_lines(old_lines: Sequence[str], lines: Sequence[str]) -> Tuple[int, int]:
+    """Leading and trailing lines known equal without comparing them.
+
+    Two snapshots of a document's ``LineStore`` share the chunks an edit
+    did not touch; plain lists share nothing.
+    """
+    if hasattr(lines, "shared_prefix") and type(old_lines) is type(lines):
+        return lines.shared_prefix(old_lines), lines.shared_suffix(old_lines)
+    return 0, 0
+
+
+def _shared_tokens(tokens, lineno: int, state: LineState) -> Optional[Tuple[array, int]]:
+    """The tokens of line ``lineno`` from ``tokens``, if lexed from the same state."""
+    if tokens is None or tokens.states[lineno] != _lex_state(state):
+        return None
+    return tokens.values[lineno], tokens.states[lineno + 1]
+
+
+class LintRun:
+    """A lint pass over ``lines`` that can be advanced a chunk of lines at a time.
+
+    Lines are re-checked from the first changed line until the carried state
+    matches the checkpoint stored for the same (shifted) line of the
+    ``previous`` version, after which the cached findings are reused.
+    ``first_changed`` is an optional hint that saves the scan for the common
+    prefix.  ``tokens`` is an optional ``LineIndex`` of the line tokens,
+    current for ``lines``.  ``config`` defaults to ``lint_config()``.
+    ``lines`` is kept, not copied, so it must not change afterwards (a
+    list no one edits, or a ``LineStore`` snapshot).
+    """
+
+    def __init__(
+        self,
+        lines: Sequence[str],
+        version: Optional[int] = None,
+        previous: Optional[LintResult] = None,
+        first_changed: Optional[int] = None,
+        tokens=None,
+        config: Optional[Tuple[int, int]] = None,
+    ):
+        self.config = lint_config() if config is None else config
+        self.version = version
+        if not hasattr(lines, "snapshot"):
+            lines = list(lines)
+        self.lines = lines
+        self.tokens = tokens
+        n_new = len(lines)
+        self.relinted = 0
+
+        if previous is None or previous.config != self.config:
+            self.states = [INITIAL_STATE]
+            self.line_diagnostics: List[Tuple[LineDiagnostic, ...]] = []
+            self.old_states: List[LineState] = []
+            self.old_diagnostics: List[Tuple[LineDiagnostic, ...]] = []
+            self.suffix_start = self.shift = n_new
+            self.lineno = 0
+            return
+
+        old_lines = previous.lines
+        n_old = len(old_lines)
+        limit = min(n_old, n_new)
+
+        shared_prefix, shared_suffix = _shared_lines(old_lines, lines)
+
+        # Common prefix
+        prefix = 0 if first_changed is None else max(0, min(first_changed, limit))
+        prefix = max(prefix, min(shared_prefix, limit))
+        while prefix < limit and old_lines[prefix] == lines[prefix]:
+            prefix += 1
+
+        # Common suffix, not overlapping the prefix
+        suffix = min(shared_suffix, limit - prefix)
+        while (
+            suffix < limit - prefix
+            and old_lines[n_old - 1 - suffix] == lines[n_new - 1 - suffix]
+        ):
+            suffix += 1
+
+        self.old_states = previous.states
+        self.old_diagnostics = previous.line_diagnostics
+        self.states = self.old_states[: prefix + 1]
+        self.line_diagnostics = self.old_diagnostics[:prefix]
+        self.suffix_start = n_new - suffix
+        self.shift = n_old - n_new
+        self.lineno = prefix
+
+    @property
+    def done(self) -> bool:
+        return len(self.line_diagnostics) == len(self.lines)
+
+    def advance(self, stop: Optional[int] = None) -> bool:
+        """Lint up to line ``stop`` (the end by default); return whether done."""
+        lines = self.lines
+        n_new = len(lines)
+        stop = n_new if stop is None else min(stop, n_new)
+        max_line_length, indent_space = self.config
+        states = self.states
+        line_diagnostics = self.line_diagnostics
+        old_states = self.old_states
+        shift = self.shift
+        state = states[-1]
+        lineno = self.lineno
+        remaining = _iter_lines(lines, lineno)
+        while lineno < stop:
+            if lineno >= self.suffix_start and state == old_states[lineno + shift]:
+                line_diagnostics.extend(self.old_diagnostics[lineno + shift :])
+                states.extend(old_states[lineno + shift + 1 :])
+                lineno = n_new
+                break
+            state, diags = lint_line(
+                next(remaining),
+                state,
+                max_line_length,
+                indent_space,
+                _shared_tokens(self.tokens, lineno, state),
+            )
+            states.append(state)
+            line_diagnostics.append(diags)
+            self.relinted += 1
+            lineno += 1
+        self.lineno = lineno
+        return self.done
+
+    def result(self) -> LintResult:
+        """The result of the whole pass, which must be done."""
+        return LintResult(
+            self.version,
+            self.config,
+            self.lines,
+            self.states,
+            self.line_diagnostics,
+            self.relinted,
+        )
+
+
+def lint_lines(
+    lines: Sequence[str],
+    version: Optional[int] = None,
+    previous: Optional[LintResult] = None,
+    first_changed: Optional[int] = None,
+    tokens=None,
+    config: Optional[Tuple[int, int]] = None,
+) -> LintResult:
+    """Lint ``lines`` in one go, reusing ``previous`` for the unchanged head and tail.
+
+    See ``LintRun``.
+    """
+    run = LintRun(lines, version, previous, first_changed, tokens, config)
+    run.advance()
+    return run.result()
@@ -0,0 +1,157 @@
+"""Per-document occurrence index for references, highlights and rename.
+
+Every identifier outside comments and strings is recorded with its span,
+keyed by its namespace and name: local and global macros live apart from
+variable and program names, so renaming the local ``n`` leaves a variable
+``n`` alone, and command words live apart from both, so a variable ``gen``
+is not a ``gen`` command.  Prefixes and keywords are not recorded.  The
+index is a ``LineIndex`` and only re-reads the edited lines of a new
+document version.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .lexer import GLOBAL_MACRO, LOCAL_MACRO, WORD
+from .lineindex import LineIndex
+from .symbols import (
+    BY_COMMANDS,
+    DEFINE_WORDS,
+    GLOBAL,
+    GLOBAL_COMMANDS,
+    LOCAL,
+    LOCAL_COMMANDS,
+    LOOP_COMMANDS,
+    NAME,
+    PREFIX_COMMANDS,
+    PROGRAM_COMMANDS,
+    PROGRAM_SUBCOMMANDS,
+    TEMP_COMMANDS,
+    Key,
+    code_tokens,
+    command_index,
+)
+
+# Namespace of command words: Stata commands, or calls of a program
+COMMAND = "command"
+
+# Names Stata reserves, never a variable, program or macro
+RESERVED_NAMES = frozenset(
+    ["_all", "_b", "byte", "_coef", "_cons", "double", "float", "if", "in", "int",
+     "long", "_n", "_N", "_pi", "_pred", "_rc", "_se", "_skip", "strL", "using", "with"]
+)
+
+IDENTIFIER_RE = re.compile(r"[^\W\d]\w*$")
+
+
+class Occurrence(NamedTuple):
+    namespace: str
+    name: str
+    start: int
+    end: int
+
+
+class Span(NamedTuple):
+    line: int
+    start: int
+    end: int
+
+
+def _word_namespaces(line: str, code) -> Dict[int, Optional[str]]:
+    """Token index -> namespace of the words that are not plain names.
+
+    The command word is a ``COMMAND``, the names of macros being defined are
+    ``LOCAL`` or ``GLOBAL``, and prefixes and keywords (``quietly``, ``by``,
+    ``program define``, ``foreach ... of varlist``) are no identifier at all.
+    """
+    index = command_index(line, code)
+    found: Dict[int, Optional[str]] = {
+        offset: None
+        for offset, (kind, start, end) in enumerate(code[:index])
+        if kind == WORD and line[start:end] in PREFIX_COMMANDS | BY_COMMANDS
+    }
+    if index >= len(code) or code[index][0] != WORD:
+        return found
+    found[index] = COMMAND
+    words = [line[start:end] if kind == WORD else None for kind, start, end in code]
+    command = words[index]
+    names = code[index + 1 : index + 2]
+    if command in PROGRAM_COMMANDS:
+        if index + 1 < len(code) and words[index + 1] in DEFINE_WORDS | PROGRAM_SUBCOMMANDS:
+            found[index + 1] = None
+        return found
+    if command in LOCAL_COMMANDS or command in LOOP_COMMANDS:
+        namespace = LOCAL
+        if command in LOOP_COMMANDS and words[index + 2 : index + 3] == ["of"]:
+            # foreach v of varlist ...
+            found.update({index + 2: None, index + 3: None})
+    elif command in GLOBAL_COMMANDS:
+        namespace = GLOBAL
+    elif command in TEMP_COMMANDS:
+        namespace = LOCAL
+        names = code[index + 1 :]
+    else:
+        return found
+    for offset, (kind, _, _) in enumerate(names, index + 1):
+        if kind != WORD:
+            break
+        found[offset] = namespace
+    return found
+
+
+def line_occurrences(line: str, tokens) -> Tuple[Occurrence, ...]:
+    """The identifiers on one line, in order."""
+    code = code_tokens(tokens)
+    namespaces = _word_namespaces(line, code)
+    found = []
+    for index, (kind, start, end) in enumerate(code):
+        if kind == WORD:
+            namespace = namespaces.get(index, NAME)
+            if namespace is not None and line[start:end] not in RESERVED_NAMES:
+                found.append(Occurrence(namespace, line[start:end], start, end))
+        elif kind == LOCAL_MACRO:
+            # `name'
+            start, end = start + 1, end - 1
+            if IDENTIFIER_RE.match(line[start:end]):
+                found.append(Occurrence(LOCAL, line[start:end], start, end))
+        elif kind == GLOBAL_MACRO:
+            # $name or ${name}
+            start += 2 if line[start + 1] == "{" else 1
+            end -= 1 if line[end - 1] == "}" else 0
+            if IDENTIFIER_RE.match(line[start:end]):
+                found.append(Occurrence(GLOBAL, line[start:end], start, end))
+    return tuple(found)
+
+
+class OccurrenceIndex(LineIndex[Tuple[Occurrence, ...]]):
+    """Where each identifier occurs in one version of a document.
+
+    Lookups scan the lines for the one name asked about rather than keep a
+    map of every name, which each edit would have to rebuild.
+    """
+
+    def index_line(self, line: str, tokens, state: int) -> Tuple[Occurrence, ...]:
+        return line_occurrences(line, tokens)
+
+    def spans(self, key: Key) -> List[Span]:
+        """The spans of (namespace, name) in document order."""
+        namespace, name = key
+        return [
+            Span(lineno, start, end)
+            for lineno, found in enumerate(self.values)
+            for found_namespace, found_name, start, end in found
+            if found_name == name and found_namespace == namespace
+        ]
+
+    def at(self, line: int, character: int) -> Optional[Tuple[Key, Span]]:
+        """The identifier under (or just before) the cursor."""
+        if not 0 <= line < len(self.values):
+            return None
+        for namespace, name, start, end in self.values[line]:
+            if start <= character <= end:
+                return (namespace, name), Span(line, start, end)
+        return None
+
+    def occurrences(self, line: int, character: int) -> List[Span]:
+        """All spans of the identifier under the cursor."""
+        found = self.at(line, character)
+        return [] if found is None else self.spans(found[0])
@@ -0,0 +1,149 @@
+"""Debounced per-document scheduling of diagnostics runs."""
+import asyncio
+import inspect
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# lint(uri, version) -> diagnostics (or an awaitable of them)
+LintCallback = Callable[[str, Optional[int]], Union[Any, Awaitable[Any]]]
+# publish(uri, version, diagnostics)
+PublishCallback = Callable[[str, Optional[int], Any], None]
+
+
+class DiagnosticsScheduler:
+    """Run diagnostics once a document stopped changing for ``delay`` seconds.
+
+    A burst of changes to the same document is merged into a single run, a
+    run whose document version was superseded while it waited or ran is
+    dropped, and only results for the newest version are published.
+
+    ``schedule_in_order`` runs a batch of documents one after the other in
+    the background, e.g. after a settings change; an edit still starts its
+    own run at once.
+    """
+
+    def __init__(
+        self,
+        lint: LintCallback,
+        publish: PublishCallback,
+        delay: float = 0.3,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+        self.lint = lint
+        self.publish = publish
+        self.delay = delay
+        self._loop = loop
+        self._latest: Dict[str, Optional[int]] = {}
+        self._pending: Dict[str, asyncio.TimerHandle] = {}
+        self._running: Dict[str, "asyncio.Future[Any]"] = {}
+        self._in_order: Optional["asyncio.Future[Any]"] = None
+        self.scheduled = 0
+        self.merged = 0  # changes folded into a later run of the same document
+        self.dropped = 0  # runs whose version was superseded before publishing
+        self.published = 0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of documents waiting for, or in the middle of, a run."""
+        return len(self._pending) + len(self._running)
+
+    def schedule(self, uri: str, version: Optional[int], delay: Optional[float] = None) -> None:
+        """Request diagnostics for ``version`` of ``uri``, after ``delay`` if given."""
+        delay = self.delay if delay is None else delay
+        self.scheduled += 1
+        self._latest[uri] = version
+        handle = self._pending.pop(uri, None)
+        if handle is not None:
+            handle.cancel()
+            self.merged += 1
+        if delay > 0:
+            self._pending[uri] = self.loop.call_later(delay, self._start, uri)
+        else:
+            self._pending[uri] = self.loop.call_soon(self._start, uri)
+
+    def cancel(self, uri: str) -> None:
+        """Forget ``uri``, e.g. after the document was closed."""
+        self._latest.pop(uri, None)
+        handle = self._pending.pop(uri, None)
+        if handle is not None:
+            handle.cancel()
+        task = self._running.pop(uri, None)
+        if task is not None:
+            task.cancel()
+
+    def schedule_in_order(self, documents: Iterable[Tuple[str, Optional[int]]]) -> None:
+        """Run ``(uri, version)`` after ``(uri, version)`` in the background.
+
+        This replaces the documents of an earlier call not run yet.  A
+        document with a run of its own waiting or going on is skipped.
+        """
+        if self._in_order is not None:
+            self._in_order.cancel()
+        self._in_order = asyncio.ensure_future(self._run_in_order(list(documents)), loop=self.loop)
+
+    def close(self) -> None:
+        """Cancel every pending and running run, e.g. when the client went away."""
+        if self._in_order is not None:
+            self._in_order.cancel()
+        for uri in {*self._latest, *self._pending, *self._running}:
+            self.cancel(uri)
+
+    def is_current(self, uri: str, version: Optional[int]) -> bool:
+        return uri in self._latest and self._latest[uri] == version
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queueDepth": self.queue_depth,
+            "scheduled": self.scheduled,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "published": self.published,
+        }
+
+    def _start(self, uri: str) -> None:
+        self._pending.pop(uri, None)
+        if uri in self._running:
+            # The running lint is for an older version; start again once it is done.
+            self._pending[uri] = self.loop.call_later(
+                max(self.delay, 0.01), self._start, uri
+            )
+            return
+        version = self._latest.get(uri)
+        task = asyncio.ensure_future(self._run(uri, version), loop=self.loop)
+        self._running[uri] = task
+
+    async def _run_in_order(self, documents) -> None:
+        for uri, version in documents:
+            if uri in self._pending or uri in self._running:
+                continue
+            self.scheduled += 1
+            self._latest[uri] = version
+            task = self._running[uri] = asyncio.ensure_future(self._run(uri, version))
+            # A cancelled batch leaves the current run alone
+            await asyncio.wait([task])
+
+    async def _run(self, uri: str, version: Optional[int]) -> None:
+        try:
+            diagnostics = self.lint(uri, version)
+            if inspect.isawaitable(diagnostics):
+                diagnostics = await diagnostics
+            if self.is_current(uri, version):
+                self.publish(uri, version, diagnostics)
+                self.published += 1
+            else:
+                self.dropped += 1
+        except asyncio.CancelledError:
+            self.dropped += 1
+        except Exception:
+            logger.exception("Diagnostics run for %s failed", uri)
+        finally:
+            if self._running.get(uri) is asyncio.current_task():
+                del self._running[uri]
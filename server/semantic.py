@@ -0,0 +1,238 @@
+"""Semantic tokens of a document, kept per line and sent as full arrays or deltas.
+
+Each line is classified from its lexer tokens into an ``array`` holding the
+LSP five int encoding ``(delta line, delta start, length, type, modifiers)``
+of its tokens, with a delta line of 0 for the first one.  The whole
+document is then a concatenation of the line arrays, patching the delta
+line of each line's first token, and a ``LineIndex`` only re-classifies
+edited lines.  Deltas against the last array sent are found by trimming
+the common head and tail, comparing slices of ``SLICE_STEP`` ints at a
+time.
+"""
+from array import array
+from typing import List, NamedTuple, Optional, Tuple
+
+import server.constants as constants
+
+from .lexer import (
+    COMMENTS,
+    COMPOUND_STRING,
+    CONTINUED,
+    GLOBAL_MACRO,
+    LOCAL_MACRO,
+    NUMBER,
+    OPERATOR,
+    STRING,
+    WORD,
+    iter_tokens,
+)
+from .lineindex import LineIndex
+from .symbols import (
+    BY_COMMANDS,
+    GLOBAL,
+    GLOBAL_COMMANDS,
+    LOCAL,
+    LOCAL_COMMANDS,
+    LOOP_COMMANDS,
+    PREFIX_COMMANDS,
+    PROGRAM,
+    PROGRAM_COMMANDS,
+    RENAME_COMMANDS,
+    TEMP_COMMANDS,
+    code_tokens,
+    command_index,
+    line_symbols,
+)
+
+# The legend, in the order of the encoded type and modifier numbers
+TOKEN_TYPES = ["keyword", "function", "variable", "macro", "string", "number", "operator", "comment"]
+TOKEN_MODIFIERS = ["declaration"]
+
+KEYWORD, FUNCTION, VARIABLE, MACRO, STRING_TYPE, NUMBER_TYPE, OPERATOR_TYPE, COMMENT = range(
+    len(TOKEN_TYPES)
+)
+DECLARATION = 1
+
+# Types of the lexer kinds that do not depend on their context
+KIND_TYPES = {
+    STRING: STRING_TYPE,
+    COMPOUND_STRING: STRING_TYPE,
+    LOCAL_MACRO: MACRO,
+    GLOBAL_MACRO: MACRO,
+    NUMBER: NUMBER_TYPE,
+    OPERATOR: OPERATOR_TYPE,
+}
+SYMBOL_TYPES = {PROGRAM: FUNCTION, LOCAL: MACRO, GLOBAL: MACRO}
+PREFIX_WORDS = PREFIX_COMMANDS | BY_COMMANDS
+# Commands whose arguments may define a name, see ``line_symbols``
+DEFINING_COMMANDS = (
+    constants.GENERATE_COMMANDS
+    | PROGRAM_COMMANDS
+    | LOOP_COMMANDS
+    | LOCAL_COMMANDS
+    | GLOBAL_COMMANDS
+    | TEMP_COMMANDS
+    | RENAME_COMMANDS
+)
+
+# Ints compared at once while looking for the changed part of two arrays
+SLICE_STEP = 1024
+
+EMPTY_LINE = array("I")
+
+
+class TokensEdit(NamedTuple):
+    """Replace ``delete_count`` ints at ``start`` by ``data``."""
+
+    start: int
+    delete_count: int
+    data: array
+
+
+def _unit_columns(line: str, encoding: str):
+    """Map python indices of ``line`` to columns in the client's encoding."""
+    if line.isascii() or encoding == "utf-32":
+        return None
+    if encoding == "utf-8":
+        widths = [len(char.encode("utf-8")) for char in line]
+    else:
+        widths = [2 if ord(char) > 0xFFFF else 1 for char in line]
+    columns = [0]
+    for width in widths:
+        columns.append(columns[-1] + width)
+    return columns
+
+
+def line_tokens(line: str, tokens, state: int = 0, encoding: str = "utf-16") -> array:
+    """The encoded semantic tokens of one line, with a delta line of 0."""
+    if not tokens:
+        return EMPTY_LINE
+    code = code_tokens(tokens)
+    # Commands start lines, not the continuation of a /// line
+    command = -1 if state & CONTINUED else command_index(line, code)
+    declared = {}
+    if 0 <= command < len(code) and line[code[command][1] : code[command][2]] in DEFINING_COMMANDS:
+        for symbol in line_symbols(line, tokens, 0)[0]:
+            declared[symbol.start] = SYMBOL_TYPES.get(symbol.kind, VARIABLE)
+
+    encoded = []
+    previous = 0
+    index = -1  # of the token in ``code``
+    for kind, start, end in iter_tokens(tokens):
+        modifiers = 0
+        if kind in COMMENTS:
+            token_type = COMMENT
+        else:
+            index += 1
+            if kind != WORD:
+                token_type = KIND_TYPES.get(kind)
+                if token_type is None:
+                    continue
+            elif start in declared:
+                token_type, modifiers = declared[start], DECLARATION
+            elif index == command or (index < command and line[start:end] in PREFIX_WORDS):
+                token_type = KEYWORD
+            elif line[end : end + 1] == "(":
+                token_type = FUNCTION
+            else:
+                token_type = VARIABLE
+        encoded += (0, start - previous, end - start, token_type, modifiers)
+        previous = start
+    if not encoded:
+        return EMPTY_LINE
+    columns = _unit_columns(line, encoding)
+    if columns is not None:
+        _to_units(encoded, columns)
+    return array("I", encoded)
+
+
+def _to_units(encoded: List[int], columns: List[int]) -> None:
+    """Convert the starts and lengths of ``encoded`` from python indices to columns."""
+    start = previous = 0
+    for offset in range(0, len(encoded), 5):
+        start += encoded[offset + 1]
+        end = start + encoded[offset + 2]
+        encoded[offset + 1] = columns[start] - previous
+        encoded[offset + 2] = columns[end] - columns[start]
+        previous = columns[start]
+
+
+def diff_tokens(old: array, new: array) -> List[TokensEdit]:
+    """The edits turning ``old`` into ``new``, cut at token boundaries."""
+    limit = min(len(old), len(new))
+    head = 0
+    while head + SLICE_STEP <= limit and (
+        old[head : head + SLICE_STEP] == new[head : head + SLICE_STEP]
+    ):
+        head += SLICE_STEP
+    while head < limit and old[head] == new[head]:
+        head += 1
+    head -= head % 5
+
+    tail = 0
+    limit -= head
+    while tail + SLICE_STEP <= limit and (
+        old[len(old) - tail - SLICE_STEP : len(old) - tail]
+        == new[len(new) - tail - SLICE_STEP : len(new) - tail]
+    ):
+        tail += SLICE_STEP
+    while tail < limit and old[len(old) - tail - 1] == new[len(new) - tail - 1]:
+        tail += 1
+    tail -= tail % 5
+
+    if head == len(old) == len(new):
+        return []
+    return [TokensEdit(head, len(old) - tail - head, new[head : len(new) - tail])]
+
+
+class SemanticTokensIndex(LineIndex[array]):
+    """The semantic tokens of one version of a document."""
+
+    def __init__(self, encoding: Optional[str] = None):
+        super().__init__()
+        self.encoding = encoding or "utf-16"
+        self._data: Optional[array] = None
+        # The last array sent to the client and its id, for deltas
+        self.result_id: Optional[str] = None
+        self.sent: Optional[array] = None
+        self._next_id = 0
+
+    def index_line(self, line: str, tokens, state: int) -> array:
+        return line_tokens(line, tokens, state, self.encoding)
+
+    def invalidate(self) -> None:
+        self._data = None
+
+    @property
+    def data(self) -> array:
+        """The encoded tokens of the whole document."""
+        if self._data is None:
+            data = array("I")
+            last_line = 0
+            for lineno, encoded in enumerate(self.values):
+                if encoded:
+                    first = len(data)
+                    data.extend(encoded)
+                    data[first] = lineno - last_line
+                    last_line = lineno
+            self._data = data
+        return self._data
+
+    def full(self) -> Tuple[str, array]:
+        """A new result id and the whole array, remembered for the next delta."""
+        self._next_id += 1
+        self.result_id = str(self._next_id)
+        self.sent = self.data
+        return self.result_id, self.sent
+
+    def delta(self, previous_result_id: str) -> Optional[Tuple[str, List[TokensEdit]]]:
+        """A new result id and the edits since ``previous_result_id``, if still known.
+
+        Clients only ask for deltas against their latest result, so older
+        arrays are not kept.
+        """
+        if self.sent is None or previous_result_id != self.result_id:
+            return None
+        previous = self.sent
+        result_id, data = self.full()
+        return result_id, diff_tokens(previous, data)
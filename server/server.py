@@ -1,33 +1,108 @@
-import re
-from typing import List, Optional
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
 
 from lsprotocol.types import (
+    CompletionItem,
     CompletionList,
+    CompletionOptions,
     CompletionParams,
     ConfigurationItem,
     ConfigurationParams,
     DefinitionParams,
     Diagnostic,
+    DiagnosticOptions,
     DiagnosticSeverity,
     DidChangeConfigurationParams,
     DidChangeTextDocumentParams,
+    DidChangeWatchedFilesParams,
+    DidChangeWatchedFilesRegistrationOptions,
+    DidChangeWorkspaceFoldersParams,
     DidCloseTextDocumentParams,
     DidOpenTextDocumentParams,
+    DocumentDiagnosticParams,
     DocumentFormattingParams,
+    DocumentHighlight,
+    DocumentHighlightKind,
+    DocumentHighlightParams,
+    DocumentOnTypeFormattingOptions,
+    DocumentOnTypeFormattingParams,
+    DocumentRangeFormattingParams,
+    FileSystemWatcher,
     Hover,
     HoverParams,
+    InitializedParams,
     Location,
     MessageType,
+    PROGRESS,
     Position,
+    PrepareRenameParams,
+    ProgressParams,
     Range,
+    ReferenceParams,
+    Registration,
+    RegistrationParams,
+    RelatedFullDocumentDiagnosticReport,
+    RelatedUnchangedDocumentDiagnosticReport,
+    RenameOptions,
+    RenameParams,
+    SemanticTokens,
+    SemanticTokensDelta,
+    SemanticTokensDeltaParams,
+    SemanticTokensEdit,
+    SemanticTokensLegend,
+    SemanticTokensParams,
+    SymbolInformation,
+    SymbolKind,
+    TEXT_DOCUMENT_PUBLISH_DIAGNOSTICS,
+    TextDocumentContentChangeEvent_Type1,
+    TextDocumentSyncKind,
     TextEdit,
+    WORKSPACE_DIAGNOSTIC,
+    WORKSPACE_DIAGNOSTIC_REFRESH,
+    WORKSPACE_DID_CHANGE_WATCHED_FILES,
+    WorkspaceDiagnosticParams,
+    WorkspaceDiagnosticReport,
+    WorkspaceDiagnosticReportPartialResult,
+    WorkspaceDocumentDiagnosticReport,
+    WorkspaceEdit,
+    WorkspaceFullDocumentDiagnosticReport,
+    WorkspaceSymbolParams,
+    WorkspaceUnchangedDocumentDiagnosticReport,
 )
+from pygls.exceptions import JsonRpcContentModified
+from pygls.protocol import default_converter
 from pygls.server import LanguageServer
+from pygls.uris import from_fs_path, to_fs_path
 
 import server.constants as constants
 import server.utils as utils
 
-from .formatter import format_stata_code
+from .analysis import AnalysisCache, DocumentAnalysis
+from .batch import FileReport, Finding, run_checks
+from .completion import (
+    CommandFrequencies,
+    command_index,
+    documentation_cache_info,
+    resolve_item,
+)
+from .definitions import DefinitionIndex, find_in_included_files
+from .diagnostics import cap_findings, diagnostics_json, line_findings
+from .document import StataLanguageServerProtocol
+from .formatter import StataFormatter, format_stata_code
+from .indexer import INDEX_SUFFIXES, ProcessPool, WorkspaceIndex, index_file
+from .linter import LintResult, LintRun, diagnostics_result_id
+from .occurrences import COMMAND, IDENTIFIER_RE, OccurrenceIndex, Span
+from .scheduler import DiagnosticsScheduler
+from .semantic import TOKEN_MODIFIERS, TOKEN_TYPES, SemanticTokensIndex
+from .settings import FolderSettings, Settings
+from .stats import summary_line
+from .symbols import GLOBAL, LOCAL, NAME, PROGRAM, VARIABLE, FileSymbols, Symbol
+from .textdiff import text_edits
+from .workers import Cancelled, Job, WorkerPool
 
 # from server.constants import (MAX_LINE_LENGTH_MESSAGE, OPERATOR_REGEX, STRING, STAR_COMMENTS,
 #                              WHITESPACE_AFTER_COMMA_REGEX, BLOCK_COMMENTS_BG,
@@ -39,27 +114,282 @@ from .formatter import format_stata_code
 
 
 class StataLanguageServer(LanguageServer):
+    """The server of one client.
+
+    ``host`` is the ``sessions.SessionHost`` when this is one of many
+    sessions sharing a process, whose event loop, worker pool and workspace
+    indexes it uses.
+    """
+
     CONFIGURATION_SECTION = "stata"
 
-    def __init__(self):
-        super().__init__("stata-language-server", "v0.1.0")
+    def __init__(self, loop=None, host=None, converter_factory=default_converter):
+        self.host = host
+        super().__init__(
+            "stata-language-server",
+            "v0.1.0",
+            loop=loop,
+            protocol_cls=StataLanguageServerProtocol,
+            converter_factory=converter_factory,
+            text_document_sync_kind=TextDocumentSyncKind.Incremental,
+        )
+        # (method, arguments, function) of each registered feature and command
+        self.handlers: List[Tuple[str, tuple, Callable]] = []
+        self.client_settings: Optional[FolderSettings] = None
+        self.diagnostics_scheduler = DiagnosticsScheduler(
+            lint=lambda uri, version: lint_in_chunks(self, uri, version),
+            publish=lambda uri, version, diagnostics: self.publish_diagnostics(
+                uri=uri, diagnostics=diagnostics, version=version
+            ),
+            delay=constants.DIAGNOSTICS_DELAY / 1000,
+            loop=self.loop,
+        )
+        # Processes are spawned, not forked from this multi-threaded process
+        self.processes = (
+            ProcessPool(constants.PROCESS_WORKERS) if host is None else host.processes
+        )
+        self.workspace_index = WorkspaceIndex(pool=self.processes)
+        self.stats = self.lsp.stats
+        self.analyses = AnalysisCache(
+            self.stats, lint_config=lambda uri: self.settings_for(uri).lint_config()
+        )
+        self.workers = WorkerPool(constants.WORKER_THREADS) if host is None else host.workers
+        self.command_frequencies = CommandFrequencies()
+
+    @property
+    def settings(self) -> Settings:
+        """The client's workspace settings, the defaults in ``constants`` until it sends some."""
+        return self.settings_for(None)
+
+    def settings_for(self, uri: Optional[str]) -> Settings:
+        """The settings of the workspace folder of ``uri``."""
+        if self.client_settings is None:
+            return Settings.from_constants()
+        return self.client_settings.for_uri(uri)
+
+    def feature(self, feature_name: str, options=None):
+        register = super().feature(feature_name, options)
+
+        def decorator(f):
+            self.handlers.append(("feature", (feature_name, options), f))
+            return register(f)
+
+        return decorator
+
+    def command(self, command_name: str):
+        register = super().command(command_name)
+
+        def decorator(f):
+            self.handlers.append(("command", (command_name,), f))
+            return register(f)
+
+        return decorator
+
+    def publish_diagnostics(self, uri: str, diagnostics: List[Finding], version=None, **kwargs):
+        """Publish compact findings, written straight to JSON (see ``server.diagnostics``)."""
+        params = {"uri": uri, "diagnostics": diagnostics_json(diagnostics)}
+        if version is not None:
+            params["version"] = version
+        self.lsp.notify_json(TEXT_DOCUMENT_PUBLISH_DIAGNOSTICS, params)
+
+    def timed(self, name: str, function, *args):
+        """Call ``function`` and record how long it took under ``name``."""
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.stats.record(name, time.perf_counter() - start)
+
+    def workspace_roots(self) -> List[str]:
+        """File system paths of the workspace folders (or the root)."""
+        roots = [to_fs_path(uri) for uri in self.workspace.folders]
+        if not roots and self.workspace.root_path:
+            roots = [self.workspace.root_path]
+        return [root for root in roots if root]
+
+    def shutdown(self):
+        if self.host is None:
+            self.workspace_index.close()
+            self.workers.close()
+            self.processes.close()
+        super().shutdown()
+
+
+SYMBOL_KINDS = {
+    PROGRAM: SymbolKind.Function,
+    VARIABLE: SymbolKind.Variable,
+    LOCAL: SymbolKind.String,
+    GLOBAL: SymbolKind.Constant,
+}
+
+logger = logging.getLogger(__name__)
 
+STATS_COMMAND = "stata.serverStats"
 
 stata_server = StataLanguageServer()
-comlist = utils.getComList()
+
+
+async def index_workspace(ls: StataLanguageServer):
+    """Build the workspace index in a background thread."""
+    roots = ls.workspace_roots()
+    if not roots:
+        return
+    if ls.host is not None:
+        # Sessions with the same folders share one index
+        ls.workspace_index = ls.host.workspace_index(roots, ls.workspace_index)
+    try:
+        await ls.loop.run_in_executor(None, ls.workspace_index.refresh, roots)
+        ls.show_message_log(f"Indexed {len(ls.workspace_index.files)} Stata files")
+    except Exception as e:
+        ls.show_message_log(f"Error indexing workspace: {e}")
+
+
+def warm_up():
+    """Load what the first completion and hover need, ahead of them."""
+    command_index()
+    utils.getDocPack()
+
+
+@stata_server.feature("initialized")
+async def initialized(ls: StataLanguageServer, params: InitializedParams):
+    """Start indexing the workspace and watch its files for changes."""
+    capabilities = ls.client_capabilities.workspace
+    watched_files = capabilities and capabilities.did_change_watched_files
+    if watched_files and watched_files.dynamic_registration:
+        watchers = [
+            FileSystemWatcher(glob_pattern=f"**/*{suffix}") for suffix in INDEX_SUFFIXES
+        ]
+        try:
+            await ls.register_capability_async(
+                RegistrationParams(
+                    registrations=[
+                        Registration(
+                            id="stata-watched-files",
+                            method=WORKSPACE_DID_CHANGE_WATCHED_FILES,
+                            register_options=DidChangeWatchedFilesRegistrationOptions(
+                                watchers=watchers
+                            ),
+                        )
+                    ]
+                )
+            )
+        except Exception as e:
+            ls.show_message_log(f"Error registering file watchers: {e}")
+    if constants.STATS_LOG_INTERVAL > 0 and ls.host is None:
+        # Sessions are summed up by their host instead
+        asyncio.ensure_future(log_stats(ls, constants.STATS_LOG_INTERVAL))
+    # Nothing is loaded before the handshake; warm up off the event loop
+    ls.loop.run_in_executor(None, ls.timed, "stata/warmUp", warm_up)
+    await index_workspace(ls)
+
+
+def server_stats(ls: StataLanguageServer) -> dict:
+    """Latencies, cache hit rates, open documents and background work."""
+    snapshot = ls.stats.snapshot()
+    documents = list(ls.workspace.text_documents.values())
+    sizes = [len(document.lines) for document in documents]
+    snapshot["documents"] = {
+        "open": len(documents),
+        "lines": sum(sizes),
+        "maxLines": max(sizes, default=0),
+        "characters": sum(len(document.source) for document in documents),
+    }
+    info = documentation_cache_info()
+    snapshot["caches"]["completionDocs"] = {
+        "hits": info.hits,
+        "misses": info.misses,
+        "hitRate": round(info.hits / (info.hits + info.misses), 4)
+        if info.hits + info.misses
+        else None,
+    }
+    snapshot["diagnostics"] = ls.diagnostics_scheduler.stats()
+    snapshot["analysis"] = ls.analyses.stats()
+    snapshot["workers"] = ls.workers.stats()
+    snapshot["workspaceIndex"] = {
+        "files": len(ls.workspace_index.files),
+        "parsed": ls.workspace_index.parsed,
+    }
+    if ls.host is not None:
+        snapshot["sessions"] = ls.host.stats()
+    return snapshot
+
+
+@stata_server.command(STATS_COMMAND)
+def server_stats_command(ls: StataLanguageServer, *args) -> dict:
+    """Report ``server_stats`` to the client, e.g. for a status view."""
+    return server_stats(ls)
+
+
+async def log_stats(ls: StataLanguageServer, interval: float):
+    """Log a one line summary of ``server_stats`` every ``interval`` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("stats: %s", summary_line(server_stats(ls)))
+
+
+@stata_server.feature("workspace/didChangeWorkspaceFolders")
+async def did_change_workspace_folders(
+    ls: StataLanguageServer, params: DidChangeWorkspaceFoldersParams
+):
+    """Re-index when folders are added to or removed from the workspace.
+
+    The settings are fetched again, added folders may have their own.
+    """
+    if ls.client_settings is not None:
+        ls.loop.create_task(refresh_config(ls, None))
+    await index_workspace(ls)
+
+
+@stata_server.feature("workspace/didChangeWatchedFiles")
+async def did_change_watched_files(
+    ls: StataLanguageServer, params: DidChangeWatchedFilesParams
+):
+    """Update the index for files created, changed or deleted on disk."""
+    paths = [to_fs_path(change.uri) for change in params.changes]
+    paths = [path for path in paths if path]
+    try:
+        await ls.loop.run_in_executor(None, ls.workspace_index.update, paths)
+    except Exception as e:
+        ls.show_message_log(f"Error updating workspace index: {e}")
+
+
+@stata_server.feature("workspace/symbol")
+def workspace_symbol(
+    ls: StataLanguageServer, params: WorkspaceSymbolParams
+) -> List[SymbolInformation]:
+    """Programs, variables and macros defined anywhere in the workspace."""
+    return [
+        SymbolInformation(
+            name=symbol.name,
+            kind=SYMBOL_KINDS[symbol.kind],
+            location=symbol_location(from_fs_path(path), symbol),
+            container_name=os.path.basename(path),
+        )
+        for path, symbol in ls.workspace_index.search(
+            params.query, constants.WORKSPACE_SYMBOL_LIMIT
+        )
+    ]
 
 
 @stata_server.feature("textDocument/didChange")
 def did_change(ls, params: DidChangeTextDocumentParams):
     """Text document did change notification."""
-    if constants.ENABLESTYLECHECKING:
-        refresh_diagnostics(ls, params)
+    change = params.content_changes[-1] if params.content_changes else None
+    if isinstance(change, TextDocumentContentChangeEvent_Type1):
+        analysis(ls, params.text_document.uri).focus_line = change.range.start.line
+    settings = ls.settings_for(params.text_document.uri)
+    if settings.enable_style_checking and not pulls_diagnostics(ls):
+        ls.diagnostics_scheduler.schedule(
+            params.text_document.uri, params.text_document.version
+        )
 
 
 @stata_server.feature("textDocument/didClose")
 def did_close(ls: StataLanguageServer, params: DidCloseTextDocumentParams):
     """Text document did close notification."""
     ls.show_message_log("Stata File Did Close")
+    ls.command_frequencies.remove(params.text_document.uri)
+    ls.analyses.pop(params.text_document.uri)
     clear_diagnostics(ls, params)
 
 
@@ -67,25 +397,53 @@ def did_close(ls: StataLanguageServer, params: DidCloseTextDocumentParams):
 async def did_open(ls, params: DidOpenTextDocumentParams):
     """Text document did open notification."""
     ls.show_message_log("Stata File Did Open")
-    if constants.ENABLESTYLECHECKING:
-        refresh_diagnostics(ls, params)
+    settings = ls.settings_for(params.text_document.uri)
+    if settings.enable_style_checking and not pulls_diagnostics(ls):
+        ls.diagnostics_scheduler.schedule(
+            params.text_document.uri, params.text_document.version, delay=0
+        )
 
 
-@stata_server.feature("textDocument/completion")
+@stata_server.feature(
+    "textDocument/completion", CompletionOptions(resolve_provider=True)
+)
 def completions(
     ls: StataLanguageServer, params: CompletionParams
 ) -> CompletionList | None:
-    """Return completion items."""
-    if not constants.ENABLECOMPLETION:
+    """Return the best ranked commands starting with the word before the cursor."""
+    uri = params.text_document.uri
+    if not ls.settings_for(uri).enable_completion:
         return None
-    return comlist
+    document = ls.workspace.get_text_document(uri)
+    lines = document.lines
+    prefix = ""
+    if params.position.line < len(lines):
+        position = document.position_codec.position_from_client_units(
+            lines, params.position
+        )
+        line = lines[position.line][: position.character]
+        prefix = constants.WORD_BEFORE_CURSOR.search(line).group()
+    frequencies = ls.command_frequencies.update(uri, document)
+    # The document tells ``completion_resolve`` which folder's settings apply
+    return command_index().complete(
+        prefix, constants.COMPLETION_LIMIT, frequencies, data={"uri": uri}
+    )
+
+
+@stata_server.feature("completionItem/resolve")
+def completion_resolve(ls: StataLanguageServer, item: CompletionItem) -> CompletionItem:
+    """Attach the synopsis and help page of the focused completion item."""
+    uri = item.data.get("uri") if isinstance(item.data, dict) else None
+    if not ls.settings_for(uri).enable_docstring:
+        return item
+    return resolve_item(item)
 
 
 @stata_server.feature("textDocument/hover")
 def hover(ls: StataLanguageServer, params: HoverParams) -> Optional[Hover]:
     """Display Markdown documentation for the element under the cursor."""
-    if constants.ENABLEDOCSTRING:
-        document = ls.workspace.get_document(params.text_document.uri)
+    if ls.settings_for(params.text_document.uri).enable_docstring:
+        document = ls.workspace.get_text_document(params.text_document.uri)
         word = document.word_at_position(
             params.position
         )  # return start and end positions
@@ -95,33 +453,201 @@ def hover(ls: StataLanguageServer, params: HoverParams) -> Optional[Hover]:
         return None
 
 
+def analysis(ls: StataLanguageServer, uri: str) -> DocumentAnalysis:
+    """The shared analysis of an open document, see ``server.analysis``."""
+    return ls.analyses.get(uri, ls.workspace.get_text_document(uri))
+
+
+def definition_index(ls: StataLanguageServer, uri: str) -> DefinitionIndex:
+    return analysis(ls, uri).definitions()
+
+
+def occurrence_index(ls: StataLanguageServer, uri: str) -> OccurrenceIndex:
+    return analysis(ls, uri).occurrences()
+
+
+def semantic_tokens_index(ls: StataLanguageServer, uri: str) -> SemanticTokensIndex:
+    return analysis(ls, uri).semantic_tokens(ls.workspace.position_encoding)
+
+
+def file_symbols(ls: StataLanguageServer, path: str) -> Optional[FileSymbols]:
+    """Symbols of a file: from the editor when open, else the workspace index or disk."""
+    uri = from_fs_path(path)
+    if uri in ls.workspace.text_documents:
+        return definition_index(ls, uri).file_symbols()
+    symbols = ls.workspace_index.get(path)
+    if symbols is None:
+        indexed = index_file(path)
+        symbols = indexed and indexed[4]
+    return symbols
+
+
+def symbol_location(uri: str, symbol: Symbol) -> Location:
+    return Location(
+        uri=uri,
+        range=Range(
+            start=Position(line=symbol.line, character=symbol.start),
+            end=Position(line=symbol.line, character=symbol.end),
+        ),
+    )
+
+
 @stata_server.feature("textDocument/definition")
-def goto_definition(ls, params: DefinitionParams):
+def goto_definition(ls: StataLanguageServer, params: DefinitionParams):
     """
-    Go to the last definition of a var: g(enerate) varname
+    Go to the nearest definition above the cursor of a variable, macro or program,
+    following do/include into other files when the document has none.
     """
     uri = params.text_document.uri
-    document = ls.workspace.get_document(uri)
+    document = ls.workspace.get_text_document(uri)
     origin_pos = params.position  # start from 1
     origin_line = origin_pos.line  # start from 0
-    origin_varname = document.word_at_position(origin_pos)
-    lenOrigin = len(origin_varname)
-    genPattern = "\\b(g(enerate|enerat|enera|ener|ene|en|e)?|egen)\\s+((byte|int|long|float|double|str[1-9]?[0-9]?[0-9]?[0-9]?|strL)\\s+)?([^=\\s]+)\\s*((==)|(=))"
-
-    if origin_line > 0:
-        searched_area = document.lines
-        for i in range(origin_pos.line - 1, -1, -1):
-            matchObj = re.match(genPattern, searched_area[i])
-            if matchObj and matchObj.group(5) == origin_varname:
-                targetLine = i
-                targetStChar = searched_area[i].find(origin_varname)
-                targetEndChar = targetStChar + lenOrigin
-                target_range = Range(
-                    start=Position(line=targetLine, character=targetStChar),
-                    end=Position(line=targetLine, character=targetEndChar),
-                )
-                return Location(uri=uri, range=target_range)
-    return None
+    # The token under the cursor tells a macro from a variable or program
+    occurrence = occurrence_index(ls, uri).at(origin_line, origin_pos.character)
+    if occurrence is None:
+        return None
+    namespace, name = occurrence[0]
+    # A command word may call a program
+    key = (NAME, name) if namespace == COMMAND else (namespace, name)
+
+    index = definition_index(ls, uri)
+    symbol = index.lookup(key, origin_line)
+    if symbol is not None:
+        return symbol_location(uri, symbol)
+
+    if not document.path:
+        return None
+    found = find_in_included_files(
+        key,
+        document.path,
+        index.edges(before=origin_line),
+        lambda path: file_symbols(ls, path),
+        ls.workspace_roots(),
+    )
+    if found is None:
+        return None
+    path, symbol = found
+    return symbol_location(from_fs_path(path), symbol)
+
+
+def span_range(span: Span) -> Range:
+    return Range(
+        start=Position(line=span.line, character=span.start),
+        end=Position(line=span.line, character=span.end),
+    )
+
+
+def identifier_spans(
+    ls: StataLanguageServer, uri: str, position: Position
+) -> Tuple[Optional[Span], List[Span]]:
+    """The identifier under the cursor and all of its spans in the document.
+
+    A command word is only an identifier when it calls a program the
+    document defines; the calls then are occurrences of the program.
+    """
+    index = occurrence_index(ls, uri)
+    found = index.at(position.line, position.character)
+    if found is None:
+        return None, []
+    (namespace, name), span = found
+    if namespace in (NAME, COMMAND) and definition_index(ls, uri).is_program(name):
+        return span, sorted(index.spans((NAME, name)) + index.spans((COMMAND, name)))
+    if namespace == COMMAND:
+        return None, []
+    return span, index.spans((namespace, name))
+
+
+@stata_server.feature("textDocument/references")
+def references(ls: StataLanguageServer, params: ReferenceParams) -> List[Location]:
+    """All uses of the variable, macro or program under the cursor."""
+    uri = params.text_document.uri
+    _, spans = identifier_spans(ls, uri, params.position)
+    if not params.context.include_declaration:
+        declared = {
+            (symbol.line, symbol.start)
+            for symbol in definition_index(ls, uri).file_symbols().symbols
+        }
+        spans = [span for span in spans if (span.line, span.start) not in declared]
+    return [Location(uri=uri, range=span_range(span)) for span in spans]
+
+
+@stata_server.feature("textDocument/documentHighlight")
+def document_highlight(
+    ls: StataLanguageServer, params: DocumentHighlightParams
+) -> List[DocumentHighlight]:
+    """Highlight the identifier under the cursor, marking where it is defined."""
+    uri = params.text_document.uri
+    # Sent as the cursor moves, it tells which diagnostics to keep when capped
+    analysis(ls, uri).focus_line = params.position.line
+    _, spans = identifier_spans(ls, uri, params.position)
+    if not spans:
+        return []
+    declared = {
+        (symbol.line, symbol.start)
+        for symbol in definition_index(ls, uri).file_symbols().symbols
+    }
+    return [
+        DocumentHighlight(
+            range=span_range(span),
+            kind=DocumentHighlightKind.Write
+            if (span.line, span.start) in declared
+            else DocumentHighlightKind.Read,
+        )
+        for span in spans
+    ]
+
+
+@stata_server.feature("textDocument/prepareRename")
+def prepare_rename(ls: StataLanguageServer, params: PrepareRenameParams):
+    """Only identifiers can be renamed, not commands, prefixes or keywords."""
+    span, _ = identifier_spans(ls, params.text_document.uri, params.position)
+    return None if span is None else span_range(span)
+
+
+@stata_server.feature("textDocument/rename", RenameOptions(prepare_provider=True))
+def rename(ls: StataLanguageServer, params: RenameParams) -> Optional[WorkspaceEdit]:
+    """Rename every occurrence of the identifier under the cursor in the document."""
+    if not IDENTIFIER_RE.match(params.new_name):
+        ls.show_message(f"'{params.new_name}' is not a valid Stata name", MessageType.Error)
+        return None
+    uri = params.text_document.uri
+    _, spans = identifier_spans(ls, uri, params.position)
+    if not spans:
+        return None
+    edits = [TextEdit(range=span_range(span), new_text=params.new_name) for span in spans]
+    return WorkspaceEdit(changes={uri: edits})
+
+
+SEMANTIC_TOKENS_LEGEND = SemanticTokensLegend(
+    token_types=TOKEN_TYPES, token_modifiers=TOKEN_MODIFIERS
+)
+
+
+@stata_server.feature("textDocument/semanticTokens/full", SEMANTIC_TOKENS_LEGEND)
+def semantic_tokens_full(ls: StataLanguageServer, params: SemanticTokensParams) -> SemanticTokens:
+    """Commands, macros, strings and comments classified by the lexer."""
+    result_id, data = semantic_tokens_index(ls, params.text_document.uri).full()
+    return SemanticTokens(data=data.tolist(), result_id=result_id)
+
+
+@stata_server.feature("textDocument/semanticTokens/full/delta", SEMANTIC_TOKENS_LEGEND)
+def semantic_tokens_delta(
+    ls: StataLanguageServer, params: SemanticTokensDeltaParams
+) -> SemanticTokens | SemanticTokensDelta:
+    """The changed token runs since the client's last result, else all tokens."""
+    index = semantic_tokens_index(ls, params.text_document.uri)
+    delta = index.delta(params.previous_result_id)
+    if delta is None:
+        result_id, data = index.full()
+        return SemanticTokens(data=data.tolist(), result_id=result_id)
+    result_id, edits = delta
+    return SemanticTokensDelta(
+        edits=[
+            SemanticTokensEdit(start=start, delete_count=count, data=data.tolist())
+            for start, count, data in edits
+        ],
+        result_id=result_id,
+    )
 
 
 def create_diagnostic(
@@ -129,242 +655,410 @@ def create_diagnostic(
     stIndex: int,
     enIndex: int,
     msg: str,
-    severity: DiagnosticSeverity,
+    severity: int,
 ) -> Diagnostic:
     """Create a Diagnostic"""
     range = Range(
         start=Position(line=line, character=stIndex),
         end=Position(line=line, character=enIndex),
     )
-    diag = Diagnostic(range=range, message=msg, severity=severity)
+    diag = Diagnostic(range=range, message=msg, severity=DiagnosticSeverity(severity))
     return diag
 
 
-def inSkipTokens(start: int, end: int, skip_tokens: List[List[int]]) -> bool:
-    """
-    Check if start and end index(python) is in one of skip tokens
+def lint_result(ls: StataLanguageServer, uri: str) -> LintResult:
+    """Lint result of the current version of a document."""
+    return analysis(ls, uri).lint()
+
+
+def finish_lint_run(
+    job: Job, run: LintRun, focus: int, limit: int, publish_focus
+) -> List[Finding]:
+    """Complete ``run`` in a worker and return the findings to publish.
+
+    Once the pass went ``DIAGNOSTICS_FOCUS_LINES`` past the focus line while
+    lines remain, ``publish_focus`` is given the findings so far.
     """
-    for token in skip_tokens:
-        if start >= token[0] and end <= token[1]:
-            return True
-    return False
+    focus_end = focus + constants.DIAGNOSTICS_FOCUS_LINES
+    while not run.advance(run.lineno + constants.WORKER_CHUNK_LINES):
+        if publish_focus is not None and run.lineno >= focus_end:
+            publish_focus(line_findings(run.line_diagnostics, focus, run.lineno, limit))
+            publish_focus = None
+        job.checkpoint()
+    return line_findings(run.line_diagnostics, focus, limit=limit)
+
 
+async def lint_in_chunks(
+    ls: StataLanguageServer, uri: str, version: Optional[int]
+) -> Optional[List[Finding]]:
+    """Lint a document for the scheduler in a worker, the focus region first.
 
-def refresh_diagnostics(ls: StataLanguageServer, params):
+    A pass whose version is superseded stops; the newer run takes over.
     """
-    Codestyle checking and publish diagnostics.
+    start = time.perf_counter()
+    document_analysis = analysis(ls, uri)
+    settings = ls.settings_for(uri)
+    focus, limit = document_analysis.focus_line, settings.diagnostics_rule_limit
+    run = document_analysis.lint_run()
+    if run is None:
+        findings = line_findings(
+            document_analysis.lint_result.line_diagnostics, focus, limit=limit
+        )
+    else:
+
+        def publish_focus(findings: List[Finding]):
+            def publish():
+                if ls.diagnostics_scheduler.is_current(uri, version):
+                    ls.publish_diagnostics(uri, findings, version)
+
+            ls.loop.call_soon_threadsafe(publish)
+
+        try:
+            findings = await ls.workers.run(
+                finish_lint_run,
+                run,
+                focus,
+                limit,
+                publish_focus,
+                stale=lambda: not ls.diagnostics_scheduler.is_current(uri, version),
+            )
+        except Cancelled:
+            return None
+        document_analysis.finish_lint(run)
+    document_analysis.published_config = settings.diagnostics_config()
+    ls.stats.record("stata/lint", time.perf_counter() - start)
+    return findings
+
+
+def pulls_diagnostics(ls: StataLanguageServer) -> bool:
+    """Whether the client pulls diagnostics, so they are not pushed to it."""
+    capabilities = ls.client_capabilities.text_document
+    return bool(capabilities and capabilities.diagnostic)
+
+
+@stata_server.feature(
+    "textDocument/diagnostic",
+    DiagnosticOptions(
+        identifier="stata", inter_file_dependencies=False, workspace_diagnostics=True
+    ),
+)
+async def document_diagnostic(ls: StataLanguageServer, params: DocumentDiagnosticParams):
+    """Pulled diagnostics of a document, or that they did not change.
+
+    The result id hashes the content and the lint settings, so a client
+    asking again about an unchanged document gets an ``unchanged`` report
+    without the document being linted or its diagnostics sent again.
+    Linting runs in a worker and stops if the document changes meanwhile.
     """
-    uri = ls.workspace.get_document(params.text_document.uri).uri
-    doc = ls.workspace.get_document(uri)
-    diagnostics = []
-
-    LINE_STATE = {
-        "isInComm": False,
-        "loopLevel": 0,
-        "prevComm": 0,
-    }  # cross line state
-    for lineno, line in enumerate(doc.lines):
-        # Max line length
-        remaining = line.split("//")[0]
-        if (
-            len(remaining) > constants.MAX_LINE_LENGTH
-            and not re.findall(r"^\s*\*\s", remaining)
-            and not remaining.startswith("// ")
-            and not remaining.startswith("/* ")
-            and not remaining.startswith("*/ ")
-        ):
-            diagnostics.append(
-                create_diagnostic(
-                    lineno,
-                    constants.MAX_LINE_LENGTH,
-                    constants.MAX_LINE_LENGTH,
-                    constants.MAX_LINE_LENGTH_MESSAGE,
-                    constants.MAX_LINE_LENGTH_SEVERITY,
-                )
+    uri = params.text_document.uri
+    if not ls.settings_for(uri).enable_style_checking:
+        return RelatedFullDocumentDiagnosticReport(items=[])
+    document_analysis = analysis(ls, uri)
+    result_id = document_analysis.result_id()
+    unchanged = params.previous_result_id == result_id
+    ls.stats.cache("DiagnosticReport", unchanged)
+    if unchanged:
+        return RelatedUnchangedDocumentDiagnosticReport(result_id=result_id)
+
+    focus, limit = document_analysis.focus_line, ls.settings_for(uri).diagnostics_rule_limit
+    run = document_analysis.lint_run()
+    if run is None:
+        findings = line_findings(
+            document_analysis.lint_result.line_diagnostics, focus, limit=limit
+        )
+    else:
+        document, version = document_analysis.document, document_analysis.document.version
+        try:
+            findings = await ls.workers.run(
+                finish_lint_run,
+                run,
+                focus,
+                limit,
+                None,
+                stale=lambda: document.version != version,
             )
-        skip_tokens = []
-
-        # Comment block
-        if LINE_STATE["isInComm"] is False:
-            match = re.match(constants.BLOCK_COMMENTS_BG, line)
-            if match is None:
-                pass
-            elif match.group(1) == "":
-                LINE_STATE["isInComm"] = True
-                continue
-            else:
-                LINE_STATE["isInComm"] = True
-                start, end = match.start(1), match.end(1)  # python index
-                skip_tokens.append([start, end])
-        else:
-            match = re.match(constants.BLOCK_COMMENTS_END, line)
-            if match is None:
-                continue
-            elif match.group(1) == "":
-                LINE_STATE["isInComm"] = False
-                continue
-            else:
-                LINE_STATE["isInComm"] = False
-                start, end = match.start(1), match.end(1)
-                skip_tokens.append([start, end])
-
-        # Star Comments
-        if re.match(constants.STAR_COMMENTS, line):
-            continue
+        except Cancelled:
+            raise JsonRpcContentModified(f"{uri} changed while it was linted")
+        document_analysis.finish_lint(run)
+    return RelatedFullDocumentDiagnosticReport(
+        items=[create_diagnostic(*finding) for finding in findings], result_id=result_id
+    )
 
-        # Inline Comment
-        match = re.match(constants.INLINE_COMM_RE, line)
-        if match and match.group(1) != "":
-            start, end = match.start(1), match.end(1)
-            skip_tokens.append([start, end])
-
-        # STRING
-        for match in constants.STRING.finditer(line):
-            start, end = match.span()
-            if not inSkipTokens(start, end, skip_tokens):
-                skip_tokens.append([start, end])
-
-        # Operator Checker
-        for match in constants.OPERATOR_REGEX.finditer(line):
-            for sindex in range(1, 3):
-                start, end = match.start(sindex), match.end(sindex)
-                if not inSkipTokens(start, end, skip_tokens):
-                    if end - start != 1:
-                        diagnostics.append(
-                            create_diagnostic(
-                                lineno,
-                                end,
-                                end,
-                                constants.OP_WHITESPACE_MESSAGE,
-                                constants.OP_WHITESPACE_SEVERITY,
-                            )
-                        )
 
-        # Comma Checker
-        for match in constants.WHITESPACE_AFTER_COMMA_REGEX.finditer(line):
-            start, end = match.start(1), match.end(1)
-            if not inSkipTokens(start, end, skip_tokens):
-                if end - start != 1:
-                    diagnostics.append(
-                        create_diagnostic(
-                            lineno,
-                            end,
-                            end,
-                            constants.COMMA_WHITESPACE_MESSAGE,
-                            constants.COMMA_WHITESPACE_SEVERITY,
-                        )
-                    )
-
-        # Combined Indent Checker for both Comments and Loops
-        # First, adjust indentation levels based on closing structures
-        if re.match(constants.LOOP_END, line) and LINE_STATE["loopLevel"] > 0:
-            LINE_STATE["loopLevel"] -= 1
-
-        # Check indentation against the combined requirements
-        match = re.match(constants.INDENT_REGEX, line)
-        if match:
-            start, end = match.start(1), match.end(1)
-            actual_space = end - start
-            expected_space = (
-                LINE_STATE["loopLevel"] + LINE_STATE["prevComm"]
-            ) * constants.INDENT_SPACE
-
-            if actual_space != expected_space:
-                diagnostics.append(
-                    create_diagnostic(
-                        lineno,
-                        end,
-                        end,
-                        f"{constants.INAP_INDENT_MESSAGE} (expected {expected_space} spaces)",
-                        constants.INAP_INDENT_SEVERITY,
-                    )
-                )
+def workspace_report(
+    uri: str, report: FileReport, previous_result_id: Optional[str], settings: Settings
+) -> WorkspaceDocumentDiagnosticReport:
+    """The report of a closed file checked by ``batch.run_checks``."""
+    result_id = diagnostics_result_id(report.digest, settings.lint_config())
+    if result_id == previous_result_id:
+        return WorkspaceUnchangedDocumentDiagnosticReport(
+            uri=uri, result_id=result_id, version=None
+        )
+    return WorkspaceFullDocumentDiagnosticReport(
+        uri=uri,
+        items=[
+            create_diagnostic(*finding)
+            for finding in cap_findings(
+                list(report.findings), limit=settings.diagnostics_rule_limit
+            )
+        ],
+        version=None,
+        result_id=result_id,
+    )
 
-        # Adjust indentation levels based on opening structures
-        if re.match(constants.LOOP_START, line):
-            LINE_STATE["loopLevel"] += 1
 
-        # Handle comment indentation state - check current line before adjusting for next line
-        has_long_comment = re.search(constants.INLINE_COMM_LONG, line) is not None
+@stata_server.feature(WORKSPACE_DIAGNOSTIC)
+async def workspace_diagnostic(
+    ls: StataLanguageServer, params: WorkspaceDiagnosticParams
+) -> WorkspaceDiagnosticReport:
+    """Diagnostics of the closed Stata files of the workspace.
 
-        if LINE_STATE["prevComm"] > 0 and not has_long_comment:
-            LINE_STATE["prevComm"] -= 1
+    Open documents are left to ``textDocument/diagnostic``.  Files are
+    checked in a background thread with the batch checker and its result
+    cache.  Each folder is checked with its own settings, a file in a nested
+    folder with the settings of that folder.  With a partial result token,
+    reports are streamed in ``$/progress`` batches as files are checked, the
+    first one right away, and the response itself is empty.
+    """
+    roots = [
+        (root, ls.settings_for(from_fs_path(os.path.join(root, ""))))
+        for root in ls.workspace_roots()
+    ]
+    roots = [(root, settings) for root, settings in roots if settings.enable_style_checking]
+    if not roots:
+        return WorkspaceDiagnosticReport(items=[])
+    previous = {entry.uri: entry.value for entry in params.previous_result_ids}
+    open_uris = set(ls.workspace.text_documents)
+    token = params.partial_result_token
+    stop = threading.Event()
+
+    def send(items: List[WorkspaceDocumentDiagnosticReport]):
+        ls.send_notification(
+            PROGRESS,
+            ProgressParams(
+                token=token, value=WorkspaceDiagnosticReportPartialResult(items=items)
+            ),
+        )
 
-        if has_long_comment:
-            LINE_STATE["prevComm"] = 1
+    def scan() -> List[WorkspaceDocumentDiagnosticReport]:
+        items = []
+        interval = constants.WORKSPACE_DIAGNOSTICS_BATCH_MS / 1000
+        sent = 0.0
+        seen = set()
+        for root, settings in roots:
+            reports = run_checks([root], config=settings.lint_config(), pool=ls.processes)
+            for report in reports:
+                if stop.is_set():
+                    return items
+                uri = from_fs_path(report.path)
+                if uri in open_uris or uri in seen or ls.settings_for(uri) != settings:
+                    continue
+                seen.add(uri)
+                items.append(workspace_report(uri, report, previous.get(uri), settings))
+                now = time.perf_counter()
+                if token is not None and now - sent >= interval:
+                    ls.loop.call_soon_threadsafe(send, items)
+                    items, sent = [], now
+        return items
 
-    ls.publish_diagnostics(uri=uri, diagnostics=diagnostics)
+    try:
+        items = await ls.loop.run_in_executor(None, scan)
+    except asyncio.CancelledError:
+        stop.set()
+        raise
+    if token is None:
+        return WorkspaceDiagnosticReport(items=items)
+    if items:
+        send(items)
+    return WorkspaceDiagnosticReport(items=[])
 
 
 def clear_diagnostics(ls: StataLanguageServer, params):
     """Clear diagnostics."""
-    uri = ls.workspace.get_document(params.text_document.uri).uri
+    uri = ls.workspace.get_text_document(params.text_document.uri).uri
+    ls.diagnostics_scheduler.cancel(uri)
     ls.publish_diagnostics(uri=uri, diagnostics=[])
 
 
+def relint_affected(ls: StataLanguageServer) -> int:
+    """Push diagnostics again for the open documents the settings change affects.
+
+    A document is affected when the settings its diagnostics were computed
+    with (``DocumentAnalysis.published_config``) differ from the settings of
+    its folder now.  They are linted in the background one after the other,
+    the most recently used first; documents whose style checking was turned
+    off have their diagnostics cleared.  Returns how many are re-linted.
+    """
+    open_uris = ls.workspace.text_documents
+    recent = [uri for uri in ls.analyses.recent() if uri in open_uris]
+    uris = recent + [uri for uri in open_uris if uri not in ls.analyses.analyses]
+    relint = []
+    for uri in uris:
+        document_analysis = ls.analyses.analyses.get(uri)
+        published = None if document_analysis is None else document_analysis.published_config
+        config = ls.settings_for(uri).diagnostics_config()
+        if config == published:
+            continue
+        if config is None:
+            ls.diagnostics_scheduler.cancel(uri)
+            ls.publish_diagnostics(uri=uri, diagnostics=[])
+            document_analysis.published_config = None
+        else:
+            relint.append((uri, ls.workspace.get_text_document(uri).version))
+    ls.diagnostics_scheduler.schedule_in_order(relint)
+    return len(relint)
+
+
 @stata_server.feature("workspace/didChangeConfiguration")
 async def refresh_config(ls: StataLanguageServer, params: DidChangeConfigurationParams):
-    """Handle configuration changes from the client."""
+    """Fetch the ``stata`` settings of the workspace and of each of its folders.
+
+    They replace this session's snapshot (other sessions keep theirs), then
+    only the open documents whose diagnostics depend on what changed are
+    linted again.
+    """
     try:
-        config_item = ConfigurationItem(section="stata")
-        config = await ls.get_configuration_async(
-            ConfigurationParams(items=[config_item])
-        )
+        folders = list(ls.workspace.folders)
+        items = [ConfigurationItem(section="stata")] + [
+            ConfigurationItem(section="stata", scope_uri=folder) for folder in folders
+        ]
+        config = await ls.get_configuration_async(ConfigurationParams(items=items))
         if config:
-            settings = config[0]
-            global \
-                MAX_LINE_LENGTH, \
-                INDENT_SPACE, \
-                ENABLECOMPLETION, \
-                ENABLEDOCSTRING, \
-                ENABLESTYLECHECKING
-            constants.MAX_LINE_LENGTH = int(settings.get("setMaxLineLength", 80))
-            constants.INDENT_SPACE = int(settings.get("setIndentSpace", 4))
-            constants.ENABLECOMPLETION = bool(settings.get("enableCompletion", False))
-            constants.ENABLEDOCSTRING = bool(settings.get("enableDocstring", True))
-            constants.ENABLEFORMATTING = bool(settings.get("enableFormatting", True))
-            constants.ENABLESTYLECHECKING = bool(
-                settings.get("enableStyleChecking", True)
+            default = Settings.from_client(config[0] or {})
+            ls.client_settings = FolderSettings(
+                default,
+                {
+                    folder: Settings.from_client(settings) if settings else default
+                    for folder, settings in zip(folders, config[1:])
+                },
             )
-            ls.show_message_log(f"Configuration applied: {settings}")
+            ls.diagnostics_scheduler.delay = default.diagnostics_delay / 1000
+            ls.show_message_log(f"Configuration applied: {config[0]}")
+            if not pulls_diagnostics(ls):
+                relint_affected(ls)
+                return
+            workspace = ls.client_capabilities.workspace
+            diagnostics = workspace and workspace.diagnostics
+            if diagnostics and diagnostics.refresh_support:
+                # The result ids include the settings; have the client pull again
+                ls.lsp.send_request(WORKSPACE_DIAGNOSTIC_REFRESH)
     except Exception as e:
         ls.show_message_log(f"Error applying configuration: {e}")
 
 
+def format_document(
+    job: Job, lines: List[str], text: str, max_line_length: int, indent_size: int
+) -> List[TextEdit]:
+    """Format a snapshot of a document in a worker; return the edits to its lines."""
+    formatter = StataFormatter(max_line_length=max_line_length, indent_size=indent_size)
+    formatted = []
+    for line in formatter.format_lines(text.split("\n")):
+        formatted.append(line)
+        if len(formatted) % constants.WORKER_CHUNK_LINES == 0:
+            job.checkpoint()
+    job.checkpoint()
+    # Only send the lines that changed
+    return text_edits(lines, "\n".join(formatted).splitlines(keepends=True))
+
+
 @stata_server.feature("textDocument/formatting")
-def formatting(
+async def formatting(
     ls: StataLanguageServer, params: DocumentFormattingParams
 ) -> List[TextEdit]:
-    """Format the entire document."""
-    if not constants.ENABLEFORMATTING:
+    """Format the entire document in a worker, stopping if it changes meanwhile."""
+    settings = ls.settings_for(params.text_document.uri)
+    if not settings.enable_formatting:
+        return []
+    ls.show_message_log("Formatting Stata file")
+    document = ls.workspace.get_text_document(params.text_document.uri)
+    version = document.version
+    try:
+        return await ls.workers.run(
+            format_document,
+            document.lines,
+            document.source,
+            settings.max_line_length,
+            settings.indent_space,
+            stale=lambda: document.version != version,
+        )
+    except Cancelled:
+        raise JsonRpcContentModified(f"{document.uri} changed while it was formatted")
+    except Exception as e:
+        ls.show_message(f"Error formatting document: {str(e)}", MessageType.Error)
         return []
-    else:
-        ls.show_message_log("Formatting Stata file")
 
-        # Get the document
-        document = ls.workspace.get_document(params.text_document.uri)
-        text = document.source
 
-        try:
-            # Call your formatter on the document text
-            formatted_text = format_stata_code(
-                text,
-                max_line_length=constants.MAX_LINE_LENGTH,
-                indent_size=constants.INDENT_SPACE,
-            )
+def format_lines(
+    ls: StataLanguageServer, uri: str, first: int, last: int, close_blocks: bool = True
+) -> List[TextEdit]:
+    """
+    Format lines ``first..last`` widened to whole statements and brace blocks,
+    indented at the brace depth they start at.
+    """
+    document = ls.workspace.get_text_document(uri)
+    lines = document.lines
+    if not lines:
+        return []
+    result = lint_result(ls, uri)
+    first, last = result.logical_range(first, last, close_blocks)
+    settings = ls.settings_for(uri)
 
-            # Create a TextEdit that replaces the entire document
-            start_pos = Position(line=0, character=0)
-            # Get the position at the end of the last line
-            lines = document.lines
-            end_line = len(lines) - 1
-            end_character = len(lines[end_line]) if lines else 0
-            end_pos = Position(line=end_line, character=end_character)
+    text = "".join(lines[first : last + 1])
+    newline = text.endswith("\n")
+    formatted = format_stata_code(
+        text[:-1] if newline else text,
+        max_line_length=settings.max_line_length,
+        indent_size=settings.indent_space,
+        depth=result.states[first].loopLevel,
+    )
+    if newline:
+        formatted += "\n"
+    return text_edits(lines[first : last + 1], formatted.splitlines(keepends=True), first)
 
-            text_range = Range(start=start_pos, end=end_pos)
-            edit = TextEdit(range=text_range, new_text=formatted_text)
 
-            return [edit]
-        except Exception as e:
-            ls.show_message(f"Error formatting document: {str(e)}", MessageType.Error)
+@stata_server.feature("textDocument/rangeFormatting")
+def range_formatting(
+    ls: StataLanguageServer, params: DocumentRangeFormattingParams
+) -> List[TextEdit]:
+    """Format the statements touched by a range."""
+    if not ls.settings_for(params.text_document.uri).enable_formatting:
+        return []
+    last = params.range.end.line
+    if params.range.end.character == 0 and last > params.range.start.line:
+        last -= 1
+    try:
+        return format_lines(ls, params.text_document.uri, params.range.start.line, last)
+    except Exception as e:
+        ls.show_message(f"Error formatting range: {str(e)}", MessageType.Error)
+        return []
+
+
+@stata_server.feature(
+    "textDocument/onTypeFormatting",
+    DocumentOnTypeFormattingOptions(
+        first_trigger_character="}", more_trigger_character=["\n"]
+    ),
+)
+def on_type_formatting(
+    ls: StataLanguageServer, params: DocumentOnTypeFormattingParams
+) -> List[TextEdit]:
+    """Format the block closed by a typed ``}``, or the statement ended by a newline."""
+    if not ls.settings_for(params.text_document.uri).enable_formatting:
+        return []
+    line = params.position.line
+    if params.ch == "\n":
+        line -= 1
+        if line < 0:
             return []
+        result = lint_result(ls, params.text_document.uri)
+        if line + 1 < len(result.states) and result.states[line + 1].prevComm:
+            # Still typing a /// continued statement
+            return []
+    try:
+        # A block opened on the line is still being typed
+        return format_lines(
+            ls, params.text_document.uri, line, line, close_blocks=params.ch != "\n"
+        )
+    except Exception as e:
+        ls.show_message(f"Error formatting document: {str(e)}", MessageType.Error)
+        return []
@@ -0,0 +1,165 @@
+"""Many clients served by one process, each in its own session.
+
+``python -m server --tcp --sessions`` (or ``--ws``) gives every connection
+its own ``StataLanguageServer``, with its protocol, workspace, open
+documents, analyses, diagnostics scheduler and client settings, all on one
+event loop.  What does not depend on the client is loaded once per process
+and shared:
+
+- the completion index and the documentation pack (``command_index`` and
+  ``utils.getDocPack``, module level caches), loaded before the first
+  connection is accepted
+- the JSON converter of the protocol types, the thread pool formatting
+  and linting documents, and the processes indexing and checking
+  workspace files
+- the workspace index of a set of folders, used by every session that has
+  those folders open and closed with the last of them
+
+A client's ``exit``, or its connection dropping, closes only its session.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import Counter
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from pygls.server import WebSocketTransportAdapter
+
+import server.constants as constants
+
+from .indexer import ProcessPool, WorkspaceIndex
+from .server import StataLanguageServer, warm_up
+from .workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class _WebSocketTransport(WebSocketTransportAdapter):
+    def close(self) -> None:
+        # ``close`` of a websocket is a coroutine
+        asyncio.ensure_future(self._ws.close())
+
+
+class SessionHost:
+    """Serves each connection in a session with the features of ``template``."""
+
+    def __init__(self, template: StataLanguageServer):
+        self.template = template
+        self.loop = template.loop
+        self.workers = WorkerPool(constants.WORKER_THREADS)
+        self.processes = ProcessPool(constants.PROCESS_WORKERS)
+        self.sessions: Set[StataLanguageServer] = set()
+        self.opened = 0
+        self.indexes: Dict[Tuple[str, ...], WorkspaceIndex] = {}
+        self._index_users: Dict[Tuple[str, ...], int] = Counter()
+        self._server = None
+
+    def open_session(self) -> StataLanguageServer:
+        # The JSON converter, costly to build, is stateless once configured
+        session = StataLanguageServer(
+            loop=self.loop, host=self, converter_factory=lambda: self.template.lsp._converter
+        )
+        for method, args, function in self.template.handlers:
+            getattr(session, method)(*args)(function)
+        self.sessions.add(session)
+        self.opened += 1
+        return session
+
+    def close_session(self, session: StataLanguageServer) -> None:
+        """Drop a session whose client went away, releasing what it shared."""
+        if session not in self.sessions:
+            return
+        self.sessions.discard(session)
+        session.diagnostics_scheduler.close()
+        self._release_index(session.workspace_index)
+        session.shutdown()
+
+    def workspace_index(
+        self, roots: Iterable[str], previous: Optional[WorkspaceIndex] = None
+    ) -> WorkspaceIndex:
+        """The shared index of ``roots``, for a session leaving ``previous``."""
+        key = tuple(sorted(os.path.abspath(root) for root in roots))
+        index = self.indexes.get(key)
+        if index is previous and index is not None:
+            return index
+        if index is None:
+            index = self.indexes[key] = WorkspaceIndex(pool=self.processes)
+        self._index_users[key] += 1
+        if previous is not None:
+            self._release_index(previous)
+        return index
+
+    def _release_index(self, index: WorkspaceIndex) -> None:
+        for key, shared in self.indexes.items():
+            if shared is index:
+                self._index_users[key] -= 1
+                if not self._index_users[key]:
+                    del self.indexes[key], self._index_users[key]
+                    index.close()
+                return
+
+    def stats(self) -> dict:
+        return {
+            "open": len(self.sessions),
+            "opened": self.opened,
+            "sharedIndexes": len(self.indexes),
+        }
+
+    # Serving
+
+    async def listen_tcp(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Accept TCP connections, each with a new session's protocol."""
+        self._server = await self.loop.create_server(
+            lambda: self.open_session().lsp, host, port
+        )
+        return self._server
+
+    async def listen_ws(self, host: str, port: int):
+        """Accept WebSocket connections, one session each."""
+        from websockets.server import serve
+
+        async def connection_made(websocket, _=None):
+            session = self.open_session()
+            protocol = session.lsp
+            protocol._send_only_body = True  # Don't send headers within the payload
+            protocol.transport = _WebSocketTransport(websocket, self.loop)
+            try:
+                async for message in websocket:
+                    protocol._procedure_handler(
+                        json.loads(message, object_hook=protocol._deserialize_message)
+                    )
+            finally:
+                self.close_session(session)
+
+        self._server = await serve(connection_made, host, port)
+        return self._server
+
+    async def log_stats(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info("sessions: %s, workers: %s", self.stats(), self.workers.stats())
+
+    def serve(self, listen, host: str, port: int) -> None:
+        """Load the shared data, then serve ``listen(host, port)`` until interrupted."""
+        self.template.timed("stata/warmUp", warm_up)
+        self.loop.run_until_complete(listen(host, port))
+        logger.info("Serving sessions on %s:%s", host, port)
+        if constants.STATS_LOG_INTERVAL > 0:
+            self.loop.create_task(self.log_stats(constants.STATS_LOG_INTERVAL))
+        try:
+            self.loop.run_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for session in list(self.sessions):
+            self.close_session(session)
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        self.workers.close()
+        self.processes.close()
+        self.template.shutdown()
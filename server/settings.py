@@ -0,0 +1,80 @@
+"""The client settings of one server session, the ``stata`` configuration section.
+
+Until a client sends its configuration, a session uses the defaults in
+``constants`` (which the command line may have changed).  Settings are an
+immutable snapshot: a configuration change replaces them, so sessions
+sharing a process never see each other's settings, and results computed
+under a snapshot can record the values they depend on (``lint_config``,
+``diagnostics_config``) to tell whether a change affects them.
+
+``FolderSettings`` holds a snapshot for each workspace folder, the client
+being asked for the ``stata`` section scoped to each of them.
+"""
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import server.constants as constants
+
+
+class Settings(NamedTuple):
+    max_line_length: int
+    indent_space: int
+    enable_completion: bool
+    enable_docstring: bool
+    enable_style_checking: bool
+    enable_formatting: bool
+    diagnostics_delay: int  # milliseconds
+    diagnostics_rule_limit: int
+
+    @classmethod
+    def from_constants(cls) -> "Settings":
+        return cls(
+            constants.MAX_LINE_LENGTH,
+            constants.INDENT_SPACE,
+            constants.ENABLECOMPLETION,
+            constants.ENABLEDOCSTRING,
+            constants.ENABLESTYLECHECKING,
+            constants.ENABLEFORMATTING,
+            constants.DIAGNOSTICS_DELAY,
+            constants.DIAGNOSTICS_RULE_LIMIT,
+        )
+
+    @classmethod
+    def from_client(cls, settings: dict) -> "Settings":
+        """Parse the ``stata`` section sent by the client."""
+        return cls(
+            int(settings.get("setMaxLineLength", 80)),
+            int(settings.get("setIndentSpace", 4)),
+            bool(settings.get("enableCompletion", False)),
+            bool(settings.get("enableDocstring", True)),
+            bool(settings.get("enableStyleChecking", True)),
+            bool(settings.get("enableFormatting", True)),
+            int(settings.get("setDiagnosticsDelay", 300)),
+            int(settings.get("setDiagnosticsRuleLimit", 1000)),
+        )
+
+    def lint_config(self) -> Tuple[int, int]:
+        """The settings lint results depend on, see ``linter.lint_config``."""
+        return (self.max_line_length, self.indent_space)
+
+    def diagnostics_config(self) -> Optional[Tuple[int, int, int]]:
+        """The settings published diagnostics depend on, None when there are none."""
+        if not self.enable_style_checking:
+            return None
+        return (self.max_line_length, self.indent_space, self.diagnostics_rule_limit)
+
+
+class FolderSettings(NamedTuple):
+    """The settings of the workspace and of each of its folders, by folder URI."""
+
+    default: Settings
+    folders: Dict[str, Settings]
+
+    def for_uri(self, uri: Optional[str]) -> Settings:
+        """The settings of the innermost folder containing ``uri``."""
+        found, length = self.default, 0
+        if uri:
+            for folder, settings in self.folders.items():
+                prefix = folder.rstrip("/") + "/"
+                if len(prefix) > length and uri.startswith(prefix):
+                    found, length = settings, len(prefix)
+        return found
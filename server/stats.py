@@ -0,0 +1,114 @@
+"""Request latencies, cache hit rates and counters of a running server.
+
+Latencies go into fixed log-scale histograms, so recording is O(1) and the
+memory used does not grow with uptime; percentiles are read back as the
+upper bound of the bucket they fall in (within ``BUCKET_GROWTH``).
+"""
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+# Bucket upper bounds in seconds: 10 µs growing by 20% up to about 2 minutes
+BUCKET_GROWTH = 1.2
+BUCKET_BOUNDS: List[float] = []
+_bound = 1e-5
+while _bound < 120:
+    BUCKET_BOUNDS.append(_bound)
+    _bound *= BUCKET_GROWTH
+del _bound
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "errors", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q``th percentile, in seconds."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                break
+        if index < len(BUCKET_BOUNDS):
+            return min(BUCKET_BOUNDS[index], self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Count, errors and latencies in milliseconds."""
+        result = {"count": self.count, "errors": self.errors}
+        for q in PERCENTILES:
+            result[f"p{q}Ms"] = round(self.percentile(q) * 1e3, 3)
+        result["meanMs"] = round(self.total / self.count * 1e3, 3) if self.count else 0.0
+        result["maxMs"] = round(self.max * 1e3, 3)
+        return result
+
+
+class ServerStats:
+    """Everything ``stata.serverStats`` reports that is collected as it happens."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.methods: Dict[str, LatencyHistogram] = {}
+        self.caches: Dict[str, List[int]] = {}  # name -> [hits, misses]
+
+    def record(self, method: str, seconds: float, error: bool = False) -> None:
+        histogram = self.methods.get(method)
+        if histogram is None:
+            histogram = self.methods[method] = LatencyHistogram()
+        histogram.record(seconds, error)
+
+    def cache(self, name: str, hit: bool) -> None:
+        counts = self.caches.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+    def snapshot(self) -> dict:
+        caches = {}
+        for name, (hits, misses) in sorted(self.caches.items()):
+            total = hits + misses
+            caches[name] = {
+                "hits": hits,
+                "misses": misses,
+                "hitRate": round(hits / total, 4) if total else None,
+            }
+        return {
+            "uptimeSeconds": round(time.monotonic() - self.started, 1),
+            "methods": {
+                method: histogram.summary()
+                for method, histogram in sorted(self.methods.items())
+            },
+            "caches": caches,
+        }
+
+
+def summary_line(snapshot: dict, slowest: int = 3) -> str:
+    """One log line: request totals and the methods with the highest p95."""
+    methods = snapshot.get("methods", {})
+    count = sum(method["count"] for method in methods.values())
+    ranked = sorted(methods.items(), key=lambda item: item[1]["p95Ms"], reverse=True)
+    parts = [f"{count} messages in {snapshot.get('uptimeSeconds', 0)} s"]
+    parts += [
+        f"{name} p50={method['p50Ms']}ms p95={method['p95Ms']}ms n={method['count']}"
+        for name, method in ranked[:slowest]
+    ]
+    documents: Optional[dict] = snapshot.get("documents")
+    if documents:
+        parts.append(f"{documents['open']} open documents, {documents['lines']} lines")
+    return "; ".join(parts)
@@ -0,0 +1,220 @@
+"""Symbols a Stata file defines and the files it runs.
+
+Extraction works line by line on the lexer tokens and only looks at the
+command a line starts with (after ``quietly``/``capture``/``by ...:``
+prefixes).  Loop variables of ``foreach``/``forvalues`` count as locals.
+The results are plain tuples so they can be sent back from
+worker processes and stored in the on-disk index.
+"""
+import itertools
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import server.constants as constants
+
+from .lexer import (
+    COMMA,
+    COMMENTS,
+    OPERATOR,
+    PUNCT,
+    STRING,
+    WORD,
+    iter_tokens,
+    tokenize,
+)
+
+# Symbol kinds
+PROGRAM = "program"
+VARIABLE = "variable"
+LOCAL = "local"
+GLOBAL = "global"
+
+# Namespace of variable, program and command names; macros have one each
+NAME = "name"
+
+Key = Tuple[str, str]  # (namespace, name)
+
+
+def namespace_of(kind: str) -> str:
+    """The namespace a symbol of ``kind`` is looked up in."""
+    return kind if kind in (LOCAL, GLOBAL) else NAME
+
+
+class Symbol(NamedTuple):
+    name: str
+    kind: str
+    line: int
+    start: int
+    end: int
+
+
+class Edge(NamedTuple):
+    """A ``do``/``run``/``include`` of another file."""
+
+    command: str
+    target: str
+    line: int
+
+
+class FileSymbols(NamedTuple):
+    symbols: Tuple[Symbol, ...]
+    edges: Tuple[Edge, ...]
+
+
+EMPTY_FILE_SYMBOLS = FileSymbols((), ())
+
+PREFIX_COMMANDS = frozenset(
+    ["qui", "quie", "quiet", "quietl", "quietly", "cap", "capt", "captu", "captur",
+     "capture", "n", "noi", "nois", "noisi", "noisil", "noisily"]
+)
+BY_COMMANDS = frozenset(["by", "bys", "byso", "bysor", "bysort"])
+PROGRAM_COMMANDS = frozenset(["pr", "pro", "prog", "progr", "progra", "program"])
+DEFINE_WORDS = frozenset(["de", "def", "defi", "defin", "define"])
+PROGRAM_SUBCOMMANDS = frozenset(["di", "dir", "drop", "l", "li", "lis", "list"])
+LOCAL_COMMANDS = frozenset(["loc", "loca", "local"])
+GLOBAL_COMMANDS = frozenset(["gl", "glo", "glob", "globa", "global"])
+TEMP_COMMANDS = frozenset(["tempvar", "tempname", "tempfile"])
+RENAME_COMMANDS = frozenset(["ren", "rena", "renam", "rename"])
+RUN_COMMANDS = frozenset(["do", "ru", "run", "include"])
+LOOP_COMMANDS = frozenset(
+    ["foreach", "forv", "forva", "forval", "forvalu", "forvalue", "forvalues"]
+)
+
+Span = Tuple[int, int, int]
+
+
+def code_tokens(tokens) -> List[Span]:
+    return [token for token in iter_tokens(tokens) if token[0] not in COMMENTS]
+
+
+def command_index(line: str, code: Sequence[Span]) -> int:
+    """Index of the command token, past any ``quietly:``/``by varlist:`` prefixes."""
+    index = 0
+    while index < len(code):
+        kind, start, end = code[index]
+        if kind != WORD:
+            return index
+        word = line[start:end]
+        if word in PREFIX_COMMANDS:
+            index += 1
+            if index < len(code) and line[code[index][1] : code[index][2]] == ":":
+                index += 1
+        elif word in BY_COMMANDS:
+            colon = next(
+                (
+                    i
+                    for i in range(index + 1, len(code))
+                    if code[i][0] == PUNCT and line[code[i][1] : code[i][2]] == ":"
+                ),
+                None,
+            )
+            if colon is None:
+                return index
+            index = colon + 1
+        else:
+            return index
+    return index
+
+
+def generated_variable(line: str, tokens) -> Optional[Tuple[int, int]]:
+    """
+    Return the span of the variable created on a line: g(enerate)/egen [type] varname =
+    """
+    words = list(
+        itertools.islice(
+            (token for token in iter_tokens(tokens) if token[0] not in COMMENTS), 4
+        )
+    )
+    return _generated_variable(line, words)
+
+
+def _generated_variable(line: str, words: Sequence[Span]) -> Optional[Tuple[int, int]]:
+    if len(words) < 3 or words[0][0] != WORD:
+        return None
+    if line[words[0][1] : words[0][2]] not in constants.GENERATE_COMMANDS:
+        return None
+
+    index = 1
+    if (
+        len(words) >= 4
+        and constants.STORAGE_TYPE_REGEX.match(line[words[1][1] : words[1][2]])
+        and words[2][0] == WORD
+    ):
+        index = 2
+    (name_kind, name_start, name_end), (op_kind, op_start, op_end) = words[index : index + 2]
+    if name_kind != WORD or op_kind != OPERATOR or line[op_start:op_end] not in ("=", "=="):
+        return None
+    return name_start, name_end
+
+
+def _run_target(line: str, args: Sequence[Span]) -> Optional[str]:
+    """The file name given to do/run/include, without quotes."""
+    if not args:
+        return None
+    kind, start, end = args[0]
+    if kind == STRING:
+        return line[start + 1 : end].rstrip('"') or None
+    stop = next((s for k, s, _ in args if k == COMMA), args[-1][2])
+    return line[start:stop].strip() or None
+
+
+def line_symbols(
+    line: str, tokens, lineno: int
+) -> Tuple[List[Symbol], Optional[Edge]]:
+    """The symbols defined by one line and the file it runs, if any."""
+    code = code_tokens(tokens)
+    index = command_index(line, code)
+    if index >= len(code) or code[index][0] != WORD:
+        return [], None
+    code = code[index:]
+    command = line[code[0][1] : code[0][2]]
+    symbols: List[Symbol] = []
+
+    def add(kind: str, span: Span) -> None:
+        symbols.append(Symbol(line[span[1] : span[2]], kind, lineno, span[1], span[2]))
+
+    if command in constants.GENERATE_COMMANDS:
+        span = _generated_variable(line, code[:4])
+        if span is not None:
+            symbols.append(Symbol(line[span[0] : span[1]], VARIABLE, lineno, *span))
+    elif command in PROGRAM_COMMANDS:
+        name = 1
+        if len(code) > 2 and line[code[1][1] : code[1][2]] in DEFINE_WORDS:
+            name = 2
+        if (
+            len(code) > name
+            and code[name][0] == WORD
+            and (name == 2 or line[code[1][1] : code[1][2]] not in PROGRAM_SUBCOMMANDS)
+        ):
+            add(PROGRAM, code[name])
+    elif command in LOOP_COMMANDS:
+        if len(code) > 1 and code[1][0] == WORD:
+            add(LOCAL, code[1])
+    elif command in LOCAL_COMMANDS or command in GLOBAL_COMMANDS:
+        if len(code) > 1 and code[1][0] == WORD:
+            add(LOCAL if command in LOCAL_COMMANDS else GLOBAL, code[1])
+    elif command in TEMP_COMMANDS:
+        for span in code[1:]:
+            if span[0] != WORD:
+                break
+            add(LOCAL, span)
+    elif command in RENAME_COMMANDS:
+        if len(code) > 2 and code[1][0] == WORD and code[2][0] == WORD:
+            add(VARIABLE, code[2])
+    elif command in RUN_COMMANDS:
+        target = _run_target(line, code[1:])
+        if target is not None:
+            return symbols, Edge(command, target, lineno)
+    return symbols, None
+
+
+def extract_symbols(lines: Iterable[str]) -> FileSymbols:
+    """Collect the symbols and run edges of a whole file."""
+    lines = list(lines)
+    symbols: List[Symbol] = []
+    edges: List[Edge] = []
+    for lineno, (line, (tokens, _)) in enumerate(zip(lines, tokenize(lines))):
+        found, edge = line_symbols(line, tokens, lineno)
+        symbols.extend(found)
+        if edge is not None:
+            edges.append(edge)
+    return FileSymbols(tuple(symbols), tuple(edges))
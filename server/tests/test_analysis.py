@@ -0,0 +1,97 @@
+import random
+
+from lsprotocol.types import Position, Range, TextDocumentContentChangeEvent_Type1
+
+import server.lineindex as lineindex
+import server.linter as linter
+from server.analysis import AnalysisCache, DocumentAnalysis
+from server.definitions import DefinitionIndex
+from server.document import StataDocument
+from server.linter import lint_lines
+from server.semantic import SemanticTokensIndex
+
+SOURCE = """\
+local n = 10
+forvalues i = 1/`n' {
+    gen x`i'=`i' // spaced badly
+}
+/* a
+   block */ regress y x1 ///
+    x2, robust
+"""
+
+
+def _edit(document, version, line, text):
+    position = Position(line=line, character=0)
+    document.apply_change(
+        TextDocumentContentChangeEvent_Type1(range=Range(start=position, end=position), text=text)
+    )
+    document.set_version(version)
+
+
+def test_one_lexer_pass_per_edit(monkeypatch):
+    document = StataDocument("file:///a.do", SOURCE * 50, version=0)
+    analysis = DocumentAnalysis(document)
+
+    def parts():
+        return (
+            analysis.lint(),
+            analysis.definitions(),
+            analysis.occurrences(),
+            analysis.semantic_tokens(),
+        )
+
+    parts()
+
+    calls = []
+    for module in (lineindex, linter):
+        tokenize_line = module.tokenize_line
+        monkeypatch.setattr(
+            module,
+            "tokenize_line",
+            lambda line, state=0, tokenize_line=tokenize_line: calls.append(line)
+            or tokenize_line(line, state),
+        )
+    _edit(document, 1, 100, "sort x\n")
+    lint, definitions, _, semantic = parts()
+    # The edit split line 100 in two; each new line is lexed once for all parts
+    assert calls == document.lines[100:102]
+
+    fresh = StataDocument("file:///a.do", document.source, version=1)
+    assert lint.line_diagnostics == lint_lines(fresh.lines, 1).line_diagnostics
+    assert definitions.names == DefinitionIndex().update(fresh).names
+    assert semantic.data == SemanticTokensIndex().update(fresh).data
+
+
+def test_shared_tokens_lint_like_their_own():
+    rng = random.Random(7)
+    pieces = ["/* ", "*/ ", "///", "{", "}", "gen a=1", '"x"', "\n"]
+    document = StataDocument("file:///a.do", SOURCE, version=0)
+    analysis = DocumentAnalysis(document)
+    for version in range(1, 150):
+        line = rng.randrange(len(document.lines))
+        _edit(document, version, line, rng.choice(pieces))
+        result = analysis.lint()
+        expected = lint_lines(document.lines, version)
+        assert result.line_diagnostics == expected.line_diagnostics
+        assert result.states == expected.states
+
+
+def test_cache_evicts_least_recently_used():
+    cache = AnalysisCache(max_mb=0.001)
+    documents = {
+        uri: StataDocument(uri, SOURCE * 10, version=0)
+        for uri in ("file:///a.do", "file:///b.do", "file:///c.do")
+    }
+    cache.get("file:///a.do", documents["file:///a.do"]).lint()
+    cache.get("file:///b.do", documents["file:///b.do"]).lint()
+    assert list(cache.analyses) == ["file:///b.do"]
+    assert cache.evictions == 1
+
+    # The most recent analysis is kept even when it alone exceeds the budget
+    cache.max_mb = 1000
+    analysis = cache.get("file:///c.do", documents["file:///c.do"])
+    assert cache.get("file:///c.do", documents["file:///c.do"]) is analysis
+    assert list(cache.analyses) == ["file:///b.do", "file:///c.do"]
+    cache.pop("file:///b.do")
+    assert cache.stats()["documents"] == 1
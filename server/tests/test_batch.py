@@ -0,0 +1,65 @@
+import io
+import json
+import os
+
+import server.batch as batch
+from server.batch import run_checks, write_jsonl, write_sarif
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_lint_format_check_and_cache(tmp_path, monkeypatch):
+    root = str(tmp_path / "project")
+    cache = str(tmp_path / "cache")
+    _write(os.path.join(root, "clean.do"), "gen x = 1\n")
+    _write(os.path.join(root, "sub", "messy.do"), "gen x=1\n")
+    _write(os.path.join(root, ".git", "hidden.do"), "gen x=1\n")
+
+    linted = []
+    lint_lines = batch.lint_lines
+    monkeypatch.setattr(
+        batch, "lint_lines", lambda lines, **kwargs: linted.append(1) or lint_lines(lines, **kwargs)
+    )
+
+    def records(**kwargs):
+        out = io.StringIO()
+        write_jsonl(run_checks([root], workers=0, cache_dir=cache, **kwargs), out)
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    first = records()
+    assert [(r["path"].endswith("messy.do"), r["line"], r["rule"]) for r in first] == [
+        (True, 1, "operator-whitespace"),
+        (True, 1, "operator-whitespace"),
+    ]
+    assert len(linted) == 2
+
+    # Unchanged and merely touched files are not checked again
+    os.utime(os.path.join(root, "clean.do"), ns=(0, 0))
+    assert records() == first
+    assert len(linted) == 2
+
+    _write(os.path.join(root, "clean.do"), "gen y=2\n")
+    assert len(records()) == 4
+    assert len(linted) == 3
+
+    unformatted = records(lint=False, check_format=True)
+    assert sorted(os.path.basename(r["path"]) for r in unformatted) == ["clean.do", "messy.do"]
+    assert {r["rule"] for r in unformatted} == {"unformatted"}
+
+
+def test_process_pool_and_sarif(tmp_path):
+    root = str(tmp_path)
+    for i in range(12):
+        _write(os.path.join(root, f"f{i}.do"), f"gen var{i}={i}\n")
+    out = io.StringIO()
+    count = write_sarif(run_checks([root], workers=2, use_cache=False), out)
+    log = json.loads(out.getvalue())
+    results = log["runs"][0]["results"]
+    assert count == len(results) == 24
+    location = results[0]["locations"][0]["physicalLocation"]
+    assert location["region"]["startLine"] == 1
+    assert location["artifactLocation"]["uri"].endswith(".do")
@@ -0,0 +1,107 @@
+from collections import Counter
+
+from lsprotocol.types import CompletionItem
+
+from server.completion import (
+    CommandFrequencies,
+    CompletionIndex,
+    command_of_line,
+    resolve_item,
+    synopsis,
+)
+from server.document import StataDocument
+
+COMMANDS = ["reg3", "regress", "replace", "reshape", "rename", "return", "generate"]
+
+
+def _labels(completion_list):
+    return [item.label for item in completion_list.items]
+
+
+def test_prefix_matches():
+    index = CompletionIndex(COMMANDS, abbreviations={})
+    assert index.matches("re") == sorted(c for c in COMMANDS if c.startswith("re"))
+    assert index.matches("x") == []
+    assert len(index.matches("")) == len(COMMANDS)
+
+
+def test_ranking():
+    index = CompletionIndex(COMMANDS, abbreviations={"regress": "reg"})
+    # A valid abbreviation wins over shorter names
+    assert _labels(index.complete("reg", 10))[:2] == ["regress", "reg3"]
+    # Exact matches come first
+    assert _labels(index.complete("reg3", 10)) == ["reg3"]
+    # Workspace usage breaks ties
+    frequencies = Counter({"reshape": 3, "rename": 1})
+    assert _labels(index.complete("re", 3, frequencies)) == ["reshape", "rename", "reg3"]
+
+
+def test_abbreviations_count_for_the_full_command():
+    index = CompletionIndex(COMMANDS, abbreviations={"regress": "reg"})
+    assert [index.canonical(word) for word in ("reg", "regr", "regress", "reg3")] == [
+        "regress",
+        "regress",
+        "regress",
+        "reg3",
+    ]
+    # A unique prefix, and words that are not one
+    assert index.canonical("resh") == "reshape"
+    assert index.canonical("re") == "re"
+    assert index.canonical("myprog") == "myprog"
+
+    # Usage written abbreviated ranks the full command
+    document = StataDocument("file:///a.do", "reg y x\nreg y z\nreshape long\n", version=1)
+    frequencies = CommandFrequencies(index).update(document.uri, document)
+    assert _labels(index.complete("re", 2, frequencies)) == ["regress", "reshape"]
+
+
+def test_incomplete_when_truncated():
+    index = CompletionIndex(COMMANDS, abbreviations={})
+    truncated = index.complete("re", 2)
+    assert truncated.is_incomplete and len(truncated.items) == 2
+    assert not index.complete("reg", 5).is_incomplete
+
+
+def test_frequencies_follow_edits():
+    document = StataDocument("file:///a.do", "reg y x\ngen z = 1\nreg z x\n", version=1)
+    index = CompletionIndex(COMMANDS, abbreviations={"regress": "reg", "generate": "g"})
+    frequencies = CommandFrequencies(index)
+    assert frequencies.update(document.uri, document)["regress"] == 2
+
+    document.apply_change(_change(2, "gen w = 2"))
+    document.set_version(2)
+    counts = frequencies.update(document.uri, document)
+    assert counts["regress"] == 1 and counts["generate"] == 2
+
+    frequencies.remove(document.uri)
+    assert +frequencies.counts == Counter()
+    assert command_of_line("  * comment") is None
+
+
+def test_synopsis():
+    markdown = (
+        "## Syntax\n\nCreate new variable\n\n`generate` _\\[`type`\\]_\n"
+        "[newvar](http://www.stata.com/help.cgi?newvar) `=exp`\n\nmore\n"
+    )
+    assert synopsis(markdown) == "generate [type] newvar =exp"
+    assert synopsis("## Description\n\ntext\n") is None
+
+
+def test_resolve_item():
+    item = resolve_item(CompletionItem(label="regress"))
+    assert item.detail.startswith("regress depvar")
+    assert item.documentation.value.startswith("## Syntax")
+    assert resolve_item(CompletionItem(label="no_such_command")).documentation is None
+
+
+def _change(line, text):
+    from lsprotocol.types import (
+        Position,
+        Range,
+        TextDocumentContentChangeEvent_Type1,
+    )
+
+    return TextDocumentContentChangeEvent_Type1(
+        range=Range(start=Position(line=line, character=0), end=Position(line=line, character=7)),
+        text=text,
+    )
@@ -0,0 +1,96 @@
+import os
+import random
+
+from lsprotocol.types import Position, Range, TextDocumentContentChangeEvent_Type1
+
+from server.definitions import DefinitionIndex, find_in_included_files
+from server.document import StataDocument
+from server.symbols import LOCAL, NAME, extract_symbols
+
+SOURCE = """\
+gen x = 1
+local n = 10
+/* gen x = 2
+*/
+replace x = `n'
+rename x y
+gen x = y
+program define helper
+end
+"""
+
+
+def _document(text, version=0):
+    return StataDocument("file:///a.do", text, version=version)
+
+
+def test_lookup_nearest_preceding():
+    index = DefinitionIndex().update(_document(SOURCE))
+    assert index.names[NAME, "x"] == [0, 6]
+    assert index.lookup((NAME, "x"), 5).line == 0  # the commented definition is skipped
+    assert index.lookup((NAME, "x"), 8).line == 6
+    assert index.lookup((LOCAL, "n"), 4).start == 6
+    assert index.lookup((NAME, "n"), 4) is None
+    assert index.lookup((NAME, "y"), 6).line == 5
+    # Programs may be defined below their use, variables may not
+    assert index.lookup((NAME, "helper"), 0).line == 7
+    assert index.lookup((NAME, "y"), 2) is None
+    assert index.lookup((NAME, "missing"), 3) is None
+
+
+def test_lookup_keeps_macros_apart():
+    index = DefinitionIndex().update(_document("local n 3\ngen n = 2\ndi `n'\n"))
+    assert index.lookup((LOCAL, "n"), 2).line == 0
+    assert index.lookup((NAME, "n"), 2).line == 1
+
+
+def test_incremental_update_matches_full():
+    rng = random.Random(3)
+    pieces = ["gen a = 1\n", "/* ", "*/\n", "local b 2\n", "tempvar c d\n", "x\n", "\n"]
+    document = _document(SOURCE)
+    index = DefinitionIndex().update(document)
+    for version in range(1, 200):
+        lines = document.lines
+        line = rng.randrange(len(lines) + 1)
+        if line == len(lines):
+            start = end = Position(line=line, character=0)
+        else:
+            start = Position(line=line, character=0)
+            end = Position(line=line, character=rng.randrange(len(lines[line]) + 1))
+        document.apply_change(
+            TextDocumentContentChangeEvent_Type1(
+                range=Range(start=start, end=end), text=rng.choice(pieces)
+            )
+        )
+        document.set_version(version)
+        index.update(document)
+        full = DefinitionIndex().update(_document(document.source))
+        assert index.names == full.names
+        assert index.file_symbols() == full.file_symbols()
+        assert index.file_symbols() == extract_symbols(document.lines)
+    assert index.extracted < len(document.lines)
+
+
+def test_follow_includes(tmp_path):
+    files = {
+        "main.do": "do prep\ninclude sub/more.do\n",
+        "prep.do": "gen a = 1\n",
+        os.path.join("sub", "more.do"): "do deeper.do\n",
+        os.path.join("sub", "deeper.do"): "program define clean\nend\n",
+    }
+    for name, text in files.items():
+        os.makedirs(os.path.dirname(str(tmp_path / name)), exist_ok=True)
+        (tmp_path / name).write_text(text)
+
+    def symbols_of(path):
+        with open(path) as f:
+            return extract_symbols(f.readlines())
+
+    main = str(tmp_path / "main.do")
+    edges = symbols_of(main).edges
+    path, symbol = find_in_included_files((NAME, "clean"), main, edges, symbols_of)
+    assert path == str(tmp_path / "sub" / "deeper.do") and symbol.line == 0
+    found = find_in_included_files((NAME, "a"), main, edges, symbols_of)
+    assert found[0] == str(tmp_path / "prep.do")
+    assert find_in_included_files((LOCAL, "a"), main, edges, symbols_of) is None
+    assert find_in_included_files((NAME, "nope"), main, edges, symbols_of) is None
@@ -0,0 +1,35 @@
+from server.batch import Finding
+from server.constants import SEVERITY_INFORMATION
+from server.diagnostics import cap_findings, line_findings
+from server.linter import lint_lines
+
+# Two operator findings and one comma finding per line
+GENERATED = [f"replace v{i}=v{i}*2,missing\n" for i in range(100)]
+
+
+def test_cap_keeps_findings_around_the_focus():
+    line_diagnostics = lint_lines(GENERATED).line_diagnostics
+    findings = line_findings(line_diagnostics, focus=50, limit=20)
+
+    notes = [finding for finding in findings if finding.severity == SEVERITY_INFORMATION]
+    assert [note.message.split(" ")[:3] for note in notes] == [
+        ["180", "more", "operator-whitespace"],
+        ["80", "more", "comma-whitespace"],
+    ]
+    kept = findings[len(notes) :]
+    assert len(kept) == 40
+    assert {finding.line for finding in kept} == set(range(45, 55)) | set(range(40, 60))
+    assert kept == sorted(kept)
+    # The same selection from findings already built, e.g. for closed files
+    assert cap_findings(line_findings(line_diagnostics, limit=0), focus=50, limit=20) == findings
+
+
+def test_uncapped_findings():
+    line_diagnostics = lint_lines(GENERATED).line_diagnostics
+    findings = line_findings(line_diagnostics, stop=10, limit=1000)
+    assert len(findings) == 30
+    assert findings[0] == Finding(0, *line_diagnostics[0][0])
+    # Messages are shared, not one string per finding
+    assert len({id(finding.message) for finding in findings}) == 2
+    indented = lint_lines(["  gen a = 1\n"] * 3).line_diagnostics
+    assert len({id(diagnostic.message) for (diagnostic,) in indented}) == 1
@@ -0,0 +1,28 @@
+import os
+
+from server.docpack import DocPack, build_pack, build_pack_from_dir
+
+MD_SYNTAX = os.path.join(os.path.dirname(__file__), "..", "md_syntax")
+
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / "docs.pack")
+    entries = [("sort", b"## Syntax\n\n`sort`"), ("r\xe9gress", "\xe9".encode() * 100)]
+    for compress in (True, False):
+        assert build_pack(entries, path, compress=compress) == 2
+        pack = DocPack(path)
+        assert pack.get("sort") == "## Syntax\n\n`sort`"
+        assert pack.get("r\xe9gress") == "\xe9" * 100
+        assert pack.get("x") is None
+        assert "x" not in pack and "sort" in pack
+        pack.close()
+
+
+def test_pack_matches_md_files(tmp_path):
+    path = str(tmp_path / "md_syntax.pack")
+    count = build_pack_from_dir(MD_SYNTAX, path)
+    pack = DocPack(path)
+    assert count == len(pack) == len(os.listdir(MD_SYNTAX))
+    for name in ("sort", "generate", "regress"):
+        with open(os.path.join(MD_SYNTAX, name + ".md")) as f:
+            assert pack.get(name) == f.read()
@@ -0,0 +1,124 @@
+import random
+
+from lsprotocol.types import (
+    Position,
+    Range,
+    TextDocumentContentChangeEvent_Type1,
+    TextDocumentContentChangeEvent_Type2,
+)
+from pygls.workspace import TextDocument
+
+from server.document import LineStore, StataDocument
+
+URI = "file:///fake_dofile.do"
+
+
+def _random_change(rng, lines):
+    start_line = rng.randrange(len(lines) + 1) if lines else 0
+    end_line = min(start_line + rng.randrange(3), max(len(lines) - 1, 0))
+    start_char = rng.randrange(len(lines[start_line]) + 1) if start_line < len(lines) else 0
+    end_char = rng.randrange(len(lines[end_line]) + 1) if end_line < len(lines) else 0
+    if end_line == start_line:
+        end_char = max(end_char, start_char)
+    text = rng.choice(["", "x", "gen y = 1\n", "\n", "a\nb\nc", "}\n{\n"])
+    return TextDocumentContentChangeEvent_Type1(
+        range=Range(
+            start=Position(line=start_line, character=start_char),
+            end=Position(line=end_line, character=end_char),
+        ),
+        text=text,
+    )
+
+
+def test_incremental_edits_match_pygls_document():
+    rng = random.Random(3)
+    text = "".join(f"gen v{i} = {i}\n" for i in range(2000))
+    LineStore.CHUNK_SIZE, chunk_size = 8, LineStore.CHUNK_SIZE
+    try:
+        expected = TextDocument(URI, text)
+        document = StataDocument(URI, text, version=0)
+        for version in range(1, 500):
+            change = _random_change(rng, expected.lines)
+            expected.apply_change(change)
+            document.apply_change(change)
+            document.set_version(version)
+            assert document.lines == expected.lines
+        assert document.source == expected.source
+    finally:
+        LineStore.CHUNK_SIZE = chunk_size
+
+
+def test_changes_since_covers_edited_lines():
+    rng = random.Random(5)
+    text = "".join(f"gen v{i} = {i}\n" for i in range(300))
+    document = StataDocument(URI, text, version=0)
+    snapshots = {0: document.lines}
+    for version in range(1, 40):
+        for _ in range(rng.randrange(1, 3)):
+            document.apply_change(_random_change(rng, document.lines))
+        document.set_version(version)
+        snapshots[version] = document.lines
+
+    for old_version in range(0, 40, 7):
+        change = document.changes_since(old_version)
+        old, new = snapshots[old_version], document.lines
+        assert new[: change.start] == old[: change.start]
+        assert new[change.new_end :] == old[change.old_end :]
+
+
+def test_full_change_resets_lines():
+    document = StataDocument(URI, "gen x = 1\n", version=1)
+    document.apply_change(TextDocumentContentChangeEvent_Type2(text="a\nb\n"))
+    document.set_version(2)
+    assert document.lines == ["a\n", "b\n"]
+    assert document.changes_since(1) == (0, 1, 2)
+    assert document.changes_since(0) is None
+
+
+def test_lines_are_a_view_sharing_untouched_chunks():
+    text = "".join(f"gen v{i} = {i}\n" for i in range(2000))
+    document = StataDocument(URI, text, version=1)
+    old = document.lines
+    document.apply_change(
+        TextDocumentContentChangeEvent_Type1(
+            range=Range(start=Position(1000, 0), end=Position(1000, 3)), text="replace"
+        )
+    )
+    document.set_version(2)
+    new = document.lines
+
+    assert old[1000] == "gen v1000 = 1000\n"
+    assert new[1000] == "replace v1000 = 1000\n"
+    assert new[998:1001] == ["gen v998 = 998\n", "gen v999 = 999\n", "replace v1000 = 1000\n"]
+    assert list(new.iter_from(1999)) == ["gen v1999 = 1999\n"]
+    chunk = LineStore.CHUNK_SIZE
+    assert new.shared_prefix(old) == chunk
+    assert new.shared_suffix(old) == 2000 - 2 * chunk
+
+
+def test_lone_carriage_return_merges_with_line_feed_at_edit_boundary():
+    edits = [
+        # "x" removed between a lone \r and a \n
+        ("a\rx\nb\n", (1, 0), (1, 1), ""),
+        # \n inserted at the start of the line after a lone \r
+        ("a\rb\n", (1, 0), (1, 0), "\n"),
+        # \r inserted before a line that is just \n
+        ("a\n\nb\n", (0, 1), (1, 0), "\r"),
+        # The edit ends in \r and the next line starts with \n
+        ("a\rx\nb\n", (0, 0), (1, 1), "c\r"),
+    ]
+    for text, start, end, new_text in edits:
+        change = TextDocumentContentChangeEvent_Type1(
+            range=Range(
+                start=Position(line=start[0], character=start[1]),
+                end=Position(line=end[0], character=end[1]),
+            ),
+            text=new_text,
+        )
+        expected = TextDocument(URI, text)
+        document = StataDocument(URI, text, version=0)
+        expected.apply_change(change)
+        document.apply_change(change)
+        document.set_version(1)
+        assert document.lines == document.source.splitlines(True)
+        assert document.lines == expected.lines
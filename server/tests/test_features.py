@@ -1,62 +1,85 @@
-from abc import get_cache_token
-from typing import Optional
-from pygls.lsp.types.basic_structures import Location, Position, TextDocumentIdentifier, TextDocumentItem
-from pygls.lsp.types.language_features import HoverParams, DefinitionParams
-from pygls.lsp.types.workspace import DidOpenTextDocumentParams
-import pytest
-from mock import Mock
-from pygls.lsp.types import TextDocumentIdentifier
-from pygls.workspace import Document, Workspace
-
-from server.server import (completions, get_configuration_callback, hover, goto_definition,
-                           refresh_diagnostics)
-
-
-class FakeServer():
-    """Create fake server to unit test features."""
-    publish_diagnostics = None
-    show_message = None
-    show_message_log = None
-    get_configuration = None
+import asyncio
 
-    def __init__(self):
-        self.workspace = Workspace('', None)
+import pytest
+from lsprotocol.types import (
+    ClientCapabilities,
+    CompletionParams,
+    DefinitionParams,
+    DidOpenTextDocumentParams,
+    DocumentDiagnosticParams,
+    DocumentDiagnosticReportKind,
+    DocumentFormattingParams,
+    FormattingOptions,
+    HoverParams,
+    InitializeParams,
+    Location,
+    Position,
+    PrepareRenameParams,
+    PreviousResultId,
+    RenameParams,
+    TextDocumentIdentifier,
+    TextDocumentItem,
+    WorkspaceDiagnosticParams,
+    WorkspaceFolder,
+)
+from pygls.exceptions import JsonRpcContentModified
+from pygls.uris import from_fs_path
 
+import server.constants as constants
+import server.server as server_module
+from server.server import (
+    completion_resolve,
+    completions,
+    did_open,
+    document_diagnostic,
+    formatting,
+    goto_definition,
+    hover,
+    prepare_rename,
+    rename,
+    server_stats,
+    stata_server,
+    workspace_diagnostic,
+)
+from server.settings import FolderSettings, Settings
 
-fake_document_uri = 'file://fake_dofile.do'
-fake_document_content = 'gen x = 3\nreplace x =10\nsort x'
+fake_document_uri = 'file:///fake_dofile.do'
+fake_document_content = 'gen x = 3\nreplace x =10\nsort x\nn'
 fake_doc_identifier = TextDocumentIdentifier(uri=fake_document_uri)
-fake_document = Document(fake_document_uri, fake_document_content)
 fake_hoverParams = HoverParams(text_document=fake_doc_identifier,
                                position=Position(line=2, character=1))
 fake_defParams = DefinitionParams(text_document=fake_doc_identifier,
-
                                   position=Position(line=1, character=9))
+fake_completionParams = CompletionParams(text_document=fake_doc_identifier,
+                                         position=Position(line=3, character=1))
 fake_diagParams = DidOpenTextDocumentParams(
                   text_document=TextDocumentItem(
                         uri=fake_document_uri,
                         language_id='stata',
-                        version='13',
+                        version=13,
                         text=fake_document_content
                   ))
 
 
-server = FakeServer()
-server.publish_diagnostics = Mock()
-server.show_message = Mock()
-server.show_message_log = Mock()
-server.get_configuration = Mock()
-server.workspace.get_document = Mock(return_value=fake_document)
-
+@pytest.fixture
+def server(monkeypatch):
+    """The server with a fresh workspace holding the fake document."""
+    stata_server.lsp.lsp_initialize(
+        InitializeParams(capabilities=ClientCapabilities(), root_uri='file:///')
+    )
+    stata_server.workspace.put_text_document(fake_diagParams.text_document)
+    published = []
+    monkeypatch.setattr(
+        stata_server, 'publish_diagnostics',
+        lambda uri, diagnostics, version=None: published.append(diagnostics)
+    )
+    stata_server.published = published
+    yield stata_server
+    del stata_server.published
 
-def _reset_mocks():
-    server.publish_diagnostics.reset_mock()
-    server.show_message.reset_mock()
-    server.show_message_log.reset_mock()
 
-
-def test_completions():
-    completion_list = completions()
+def test_completions(server):
+    completion_list = completions(server, fake_completionParams)
     labels = [i.label for i in completion_list.items]
 
     assert 'nlist' in labels
@@ -64,24 +87,267 @@ def test_completions():
     assert 'notes' in labels
 
 
-def test_hover(server=server, fake_hoverParams=fake_hoverParams):
+def test_resolve_follows_the_folder_of_the_document(server, monkeypatch):
+    settings = Settings.from_constants()._replace(enable_completion=True)
+    monkeypatch.setattr(
+        server,
+        "client_settings",
+        FolderSettings(settings, {"file:///quiet": settings._replace(enable_docstring=False)}),
+    )
+    quiet = "file:///quiet/a.do"
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=quiet, language_id="stata", version=1, text="reg")
+    )
+    position = Position(line=0, character=3)
+
+    def resolved(uri):
+        params = CompletionParams(text_document=TextDocumentIdentifier(uri=uri), position=position)
+        item = completions(server, params).items[0]
+        assert item.data == {"uri": uri}
+        return completion_resolve(server, item)
+
+    assert resolved(fake_document_uri).documentation is not None
+    assert resolved(quiet).documentation is None
+
+
+def test_hover(server):
     result = hover(server, fake_hoverParams)
     docstring = result.contents.value
     assert '## Syntax\n\n`sort`' in docstring
 
 
-def test_goto_definition(server=server, fake_defParams=fake_defParams):
+def test_goto_definition(server):
     result = goto_definition(server, fake_defParams)
     assert isinstance(result, Location)
     assert 0 == result.range.start.line
     assert 4 == result.range.start.character
 
 
-def test_refresh_diagnostics(server=server, fake_diagParams=fake_diagParams):
-    _reset_mocks()
+def test_goto_definition_of_a_macro(server):
+    uri = 'file:///macros.do'
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id='stata', version=1,
+                         text="local n 3\ngen n = 2\ndi `n'\n")
+    )
+    params = DefinitionParams(text_document=TextDocumentIdentifier(uri=uri),
+                              position=Position(line=2, character=5))
+    result = goto_definition(server, params)
+    assert (result.range.start.line, result.range.start.character) == (0, 6)
+
+
+def test_goto_definition_follows_includes_before_later_lines(server, tmp_path):
+    (tmp_path / 'helper.do').write_text('gen x = 0\n')
+    main = tmp_path / 'main.do'
+    main.write_text('do helper.do\nsummarize x\ngen x = 1\n')
+    uri = from_fs_path(str(main))
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id='stata', version=1, text=main.read_text())
+    )
+    params = DefinitionParams(text_document=TextDocumentIdentifier(uri=uri),
+                              position=Position(line=1, character=10))
+    result = goto_definition(server, params)
+    assert result.uri == from_fs_path(str(tmp_path / 'helper.do'))
+    assert result.range.start.line == 0
+
+
+def test_rename_leaves_commands_alone(server):
+    uri = 'file:///rename.do'
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id='stata', version=1,
+                         text='program define helper\nend\nquietly: gen gen = 1\nhelper gen\n')
+    )
+    identifier = TextDocumentIdentifier(uri=uri)
+
+    def prepared(line, character):
+        position = Position(line=line, character=character)
+        return prepare_rename(server, PrepareRenameParams(text_document=identifier,
+                                                          position=position))
+
+    def renamed(line, character, new_name):
+        position = Position(line=line, character=character)
+        edits = rename(server, RenameParams(text_document=identifier, position=position,
+                                            new_name=new_name)).changes[uri]
+        return [(edit.range.start.line, edit.range.start.character) for edit in edits]
+
+    assert prepared(2, 10) is None  # the gen command
+    assert prepared(2, 2) is None  # quietly
+    assert prepared(0, 9) is None  # define
+    assert prepared(2, 14).start == Position(line=2, character=13)
+    assert renamed(2, 14, 'g') == [(2, 13), (3, 7)]
+    # Calls of a program are renamed with it
+    assert renamed(3, 2, 'h') == [(0, 15), (3, 0)]
+
+
+def test_did_open_publishes_diagnostics(server):
     expected_msg = "whitespace around operator should be 1"
-    
-    refresh_diagnostics(server, fake_diagParams)
 
-    args = server.publish_diagnostics.call_args
-    assert args[1]['diagnostics'][0].message == expected_msg
+    async def open_document():
+        await did_open(server, fake_diagParams)
+        while server.diagnostics_scheduler.queue_depth:
+            await asyncio.sleep(0.01)
+
+    server.loop.run_until_complete(open_document())
+
+    assert server.published[0][0].message == expected_msg
+
+
+def test_server_stats(server):
+    hover(server, fake_hoverParams)
+    goto_definition(server, fake_defParams)
+    goto_definition(server, fake_defParams)
+
+    stats = server_stats(server)
+    assert stats['documents']['open'] == 1
+    assert stats['documents']['lines'] == 4
+    assert stats['caches']['DefinitionIndex']['hits'] >= 1
+    assert stats['diagnostics']['queueDepth'] == 0
+
+
+def test_document_diagnostic(server):
+    def pull(params):
+        return server.loop.run_until_complete(document_diagnostic(server, params))
+
+    params = DocumentDiagnosticParams(text_document=fake_doc_identifier)
+    report = pull(params)
+    assert report.items[0].message == "whitespace around operator should be 1"
+
+    params.previous_result_id = report.result_id
+    assert pull(params).kind == DocumentDiagnosticReportKind.Unchanged
+
+    # The settings are part of the result id
+    constants.INDENT_SPACE += 1
+    try:
+        assert pull(params).kind == DocumentDiagnosticReportKind.Full
+    finally:
+        constants.INDENT_SPACE -= 1
+    assert pull(params).kind == DocumentDiagnosticReportKind.Unchanged
+
+
+def test_workspace_diagnostic_streams_closed_files(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "INDEX_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(constants, "WORKSPACE_DIAGNOSTICS_BATCH_MS", 0)
+    root = tmp_path / "project"
+    root.mkdir()
+    for name in ("a.do", "b.do", "open.do"):
+        (root / name).write_text("gen x=1\n")
+    server.lsp.lsp_initialize(
+        InitializeParams(capabilities=ClientCapabilities(), root_uri=from_fs_path(str(root)))
+    )
+    server.workspace.put_text_document(
+        TextDocumentItem(
+            uri=from_fs_path(str(root / "open.do")), language_id="stata", version=1, text=""
+        )
+    )
+    sent = []
+    monkeypatch.setattr(
+        server, "send_notification", lambda method, params: sent.append(params.value.items)
+    )
+
+    def pull(**params):
+        return server.loop.run_until_complete(
+            workspace_diagnostic(server, WorkspaceDiagnosticParams(**params))
+        )
+
+    # One partial result per file, and an empty response
+    assert pull(previous_result_ids=[], partial_result_token="t").items == []
+    assert len(sent) == 2
+    reports = {items[0].uri: items[0] for items in sent}
+    assert set(reports) == {from_fs_path(str(root / name)) for name in ("a.do", "b.do")}
+    assert all(report.items for report in reports.values())
+
+    previous = [PreviousResultId(uri=uri, value=r.result_id) for uri, r in reports.items()]
+    (root / "b.do").write_text("gen x = 1\n")
+    items = pull(previous_result_ids=previous).items
+    kinds = {item.uri: item.kind for item in items}
+    assert kinds == {
+        from_fs_path(str(root / "a.do")): DocumentDiagnosticReportKind.Unchanged,
+        from_fs_path(str(root / "b.do")): DocumentDiagnosticReportKind.Full,
+    }
+
+
+def test_large_document_publishes_through_the_focus_first(server, monkeypatch):
+    monkeypatch.setattr(constants, "WORKER_CHUNK_LINES", 10)
+    monkeypatch.setattr(constants, "DIAGNOSTICS_FOCUS_LINES", 5)
+    uri = "file:///generated.do"
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id="stata", version=1, text="gen x=1\n" * 100)
+    )
+
+    async def lint():
+        server.diagnostics_scheduler.schedule(uri, 1, delay=0)
+        while server.diagnostics_scheduler.queue_depth:
+            await asyncio.sleep(0.01)
+
+    server.loop.run_until_complete(lint())
+    first, complete = server.published
+    assert {finding.line for finding in first} == set(range(10))
+    assert {finding.line for finding in complete} == set(range(100))
+
+
+def test_formatting_in_a_worker(server, monkeypatch):
+    params = DocumentFormattingParams(
+        text_document=fake_doc_identifier,
+        options=FormattingOptions(tab_size=4, insert_spaces=True),
+    )
+    edits = server.loop.run_until_complete(formatting(server, params))
+    assert [edit.new_text for edit in edits] == ["replace x = 10\n"]
+
+    # An edit arriving while the worker formats makes the result useless
+    document = server.workspace.get_text_document(fake_document_uri)
+    format_document = server_module.format_document
+
+    def edited_meanwhile(job, *args):
+        document.version += 1
+        return format_document(job, *args)
+
+    monkeypatch.setattr(server_module, "format_document", edited_meanwhile)
+    with pytest.raises(JsonRpcContentModified):
+        server.loop.run_until_complete(formatting(server, params))
+
+
+def test_settings_change_relints_affected_folders_only(server, monkeypatch):
+    monkeypatch.setattr(server, "client_settings", None)
+    server.lsp.lsp_initialize(
+        InitializeParams(
+            capabilities=ClientCapabilities(),
+            workspace_folders=[
+                WorkspaceFolder(uri="file:///a", name="a"),
+                WorkspaceFolder(uri="file:///b", name="b"),
+            ],
+        )
+    )
+    indented = "if x {\n  gen y = 1\n}\n"
+    for uri in ("file:///a/x.do", "file:///b/x.do"):
+        server.workspace.put_text_document(
+            TextDocumentItem(uri=uri, language_id="stata", version=1, text=indented)
+        )
+    config = [{}, None, None]
+
+    async def get_configuration_async(params):
+        return config
+
+    monkeypatch.setattr(server, "get_configuration_async", get_configuration_async)
+    linted = []
+    lint = server.diagnostics_scheduler.lint
+    scheduler = server.diagnostics_scheduler
+    monkeypatch.setattr(
+        scheduler, "lint", lambda uri, version: linted.append(uri) or lint(uri, version)
+    )
+
+    async def change():
+        await server_module.refresh_config(server, None)
+        while scheduler.queue_depth or not scheduler._in_order.done():
+            await asyncio.sleep(0.01)
+
+    server.loop.run_until_complete(change())
+    assert sorted(linted) == ["file:///a/x.do", "file:///b/x.do"]
+
+    # Only the folder whose settings changed; 2 spaces is now the right indent
+    config[2] = {"setIndentSpace": 2}
+    linted.clear()
+    server.published.clear()
+    server.loop.run_until_complete(change())
+    assert linted == ["file:///b/x.do"]
+    assert server.published == [[]]
+    assert server.settings_for("file:///a/x.do").indent_space == 4
+    assert server.settings_for("file:///b/sub/x.do").indent_space == 2
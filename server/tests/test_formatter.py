@@ -0,0 +1,99 @@
+import io
+
+from server.formatter import StataFormatter, format_stata_code, format_stream
+from server.linter import lint_lines
+
+SOURCE = """\
+gen x=1
+foreach v of varlist a b {
+    if `v'==1 {
+        replace x=2 , by(z)
+    }
+    reg y x ///
+        , robust
+}
+/* block
+comment */
+display 1
+"""
+
+
+def test_logical_range():
+    result = lint_lines(SOURCE.splitlines(keepends=True))
+    assert result.logical_range(0, 0) == (0, 0)
+    # The closing brace pulls in the block it closes
+    assert result.logical_range(4, 4) == (2, 4)
+    assert result.logical_range(7, 7) == (1, 7)
+    # Statements continued with /// and block comments are kept whole
+    assert result.logical_range(6, 6) == (5, 6)
+    assert result.logical_range(9, 9) == (8, 9)
+    # Opening a block extends to its end unless asked not to
+    assert result.logical_range(2, 2) == (2, 4)
+    assert result.logical_range(2, 2, close_blocks=False) == (2, 2)
+
+
+def test_slice_formats_like_whole_file():
+    whole = format_stata_code(SOURCE, max_line_length=80).split("\n")
+    lines = SOURCE.splitlines()
+    result = lint_lines(SOURCE.splitlines(keepends=True))
+    first, last = result.logical_range(3, 3)
+    depth = result.states[first].loopLevel
+    formatted = format_stata_code(
+        "\n".join(lines[first : last + 1]), max_line_length=80, depth=depth
+    )
+    assert formatted.split("\n") == whole[first : last + 1]
+
+
+BREAK_CASES = [
+    (
+        "reg y " + " ".join(f"x{i}" for i in range(30)) + ", robust cluster(id)",
+        "",
+        40,
+        [
+            "reg y x0 x1 x2 x3 x4 x5 x6 x7 x8 x9 ///",
+            "x10 x11 x12 x13 x14 x15 x16 x17 x18 ///",
+            "x19 x20 x21 x22 x23 x24 x25 x26 x27 ///",
+            "x28 x29, robust cluster(id)",
+        ],
+    ),
+    (
+        'keep if (a == 1 & b == 2) | (c == "x, y" & d == 4) | e == 5 & f == 6',
+        "note",
+        30,
+        [
+            "keep if (a == 1 & b == 2) | ///",
+            '(c == "x, y" & d == 4) | ///',
+            "e == 5 & f == 6 // note",
+        ],
+    ),
+    (
+        "gen s = `\"a, b\"' + \"c, d\" + `x' + substr(name, 1, 3) / 2 : 1",
+        "",
+        25,
+        ["gen s = `\"a, b\"' + ///", "\"c, d\" + `x' + ///", "substr(name, 1, 3) / 2 : 1"],
+    ),
+    (
+        "foreach v in a b c { display `v' }, " + "z " * 20,
+        "",
+        30,
+        [
+            "foreach v in a b c ///",
+            "{ display `v' }, ///",
+            "z z z z z z z z z z z z z ///",
+            "z z z z z z z",
+        ],
+    ),
+]
+
+
+def test_break_long_line():
+    for line, comment, max_line_length, expected in BREAK_CASES:
+        formatter = StataFormatter(max_line_length=max_line_length)
+        assert formatter._break_long_line(line, comment) == expected
+
+
+def test_stream_formats_like_whole_file():
+    for text in (SOURCE, SOURCE.rstrip("\n"), "", "\n", "reg y x ///\n    , robust"):
+        out = io.StringIO()
+        format_stream(io.StringIO(text), out, max_line_length=80)
+        assert out.getvalue() == format_stata_code(text, max_line_length=80)
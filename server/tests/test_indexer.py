@@ -0,0 +1,71 @@
+import os
+
+from server.indexer import ProcessPool, WorkspaceIndex
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_refresh_update_and_warm_restart(tmp_path):
+    root = str(tmp_path / "project")
+    cache = str(tmp_path / "cache")
+    _write(os.path.join(root, "main.do"), "do sub/clean.do\ngen total = 1\n")
+    _write(os.path.join(root, "sub", "clean.do"), "program define clean\nend\n")
+    _write(os.path.join(root, ".git", "hooks.do"), "gen hidden = 1\n")
+    _write(os.path.join(root, "notes.txt"), "gen ignored = 1\n")
+
+    index = WorkspaceIndex(cache_dir=cache, workers=0)
+    index.refresh([root])
+    assert index.parsed == 2
+    assert [symbol.name for _, symbol in index.search("", 10)] == ["clean", "total"]
+    assert index.get(os.path.join(root, "main.do")).edges[0].target == "sub/clean.do"
+
+    # A restart reuses the on-disk index
+    warm = WorkspaceIndex(cache_dir=cache, workers=0)
+    warm.refresh([root])
+    assert warm.parsed == 0
+    assert warm.files == index.files
+
+    # Touched but identical content is not parsed again
+    main = os.path.join(root, "main.do")
+    os.utime(main, ns=(0, 0))
+    warm.update([main])
+    assert warm.parsed == 0
+
+    _write(main, "gen total = 1\ngen share = 2\n")
+    os.remove(os.path.join(root, "sub", "clean.do"))
+    warm.update([main, os.path.join(root, "sub", "clean.do")])
+    assert warm.parsed == 1
+    assert [symbol.name for _, symbol in warm.search("", 10)] == ["share", "total"]
+
+
+def test_process_pool(tmp_path):
+    root = str(tmp_path)
+    for i in range(20):
+        _write(os.path.join(root, f"f{i}.do"), f"gen var{i} = {i}\n")
+    index = WorkspaceIndex(cache_dir=str(tmp_path / "cache"), workers=2)
+    try:
+        index.refresh([root])
+    finally:
+        index.close()
+    assert index.parsed == 20
+    assert [symbol.name for _, symbol in index.search("var1", 3)] == ["var1", "var10", "var11"]
+
+
+def test_shared_pool_spawns_its_processes(tmp_path):
+    root = str(tmp_path)
+    for i in range(10):
+        _write(os.path.join(root, f"f{i}.do"), f"gen var{i} = {i}\n")
+    pool = ProcessPool(1)
+    index = WorkspaceIndex(cache_dir=str(tmp_path / "cache"), pool=pool)
+    try:
+        index.refresh([root])
+        index.close()  # the pool is not the index's to close
+        assert pool._executor is not None
+        assert pool._executor._mp_context.get_start_method() == "spawn"
+        assert index.parsed == 10
+    finally:
+        pool.close()
@@ -0,0 +1,76 @@
+from server.formatter import format_stata_code
+from server.lexer import (
+    BLOCK_COMMENT,
+    COMMA,
+    COMPOUND_STRING,
+    CONTINUATION,
+    CONTINUED,
+    GLOBAL_MACRO,
+    IN_BLOCK_COMMENT,
+    LINE_COMMENT,
+    LOCAL_MACRO,
+    OPERATOR,
+    STAR_COMMENT,
+    STRING,
+    WORD,
+    iter_tokens,
+    tokenize,
+    tokenize_line,
+)
+
+
+def _kinds(line, state=0):
+    tokens, _ = tokenize_line(line, state)
+    return [(kind, line[start:end]) for kind, start, end in iter_tokens(tokens)]
+
+
+def test_tokenize_line():
+    assert _kinds('gen x=`y\'+$z, replace // note\n') == [
+        (WORD, "gen"),
+        (WORD, "x"),
+        (OPERATOR, "="),
+        (LOCAL_MACRO, "`y'"),
+        (OPERATOR, "+"),
+        (GLOBAL_MACRO, "$z"),
+        (COMMA, ","),
+        (WORD, "replace"),
+        (LINE_COMMENT, "// note"),
+    ]
+
+
+def test_strings_and_nested_macros():
+    line = 'di `"a "quoted" b"\' "x // y" `a`i\'\''
+    assert _kinds(line) == [
+        (WORD, "di"),
+        (COMPOUND_STRING, '`"a "quoted" b"\''),
+        (STRING, '"x // y"'),
+        (LOCAL_MACRO, "`a`i''"),
+    ]
+
+
+def test_comments_across_lines():
+    lines = [
+        "* star comment\n",
+        "reg y x /* open\n",
+        "still comment\n",
+        "close */ , robust ///\n",
+        "    * not a comment\n",
+    ]
+    result = list(tokenize(lines))
+    assert [kind for kind, _, _ in iter_tokens(result[0][0])] == [STAR_COMMENT]
+    assert result[1][1] == IN_BLOCK_COMMENT
+    assert list(iter_tokens(result[2][0])) == [(BLOCK_COMMENT, 0, 13)]
+    assert result[3][1] == CONTINUED
+    assert [kind for kind, _, _ in iter_tokens(result[3][0])][-1] == CONTINUATION
+    assert _kinds(lines[4], CONTINUED)[0] == (OPERATOR, "*")
+
+
+def test_comment_needs_leading_blank():
+    assert LINE_COMMENT not in [kind for kind, _ in _kinds("use http://example.com/auto")]
+
+
+def test_formatter_leaves_strings_and_comments():
+    code = 'gen x=1 // a=b\ndisplay "a,b"\nreplace y=x,by(z)'
+    formatted = format_stata_code(code).split("\n")
+    assert formatted[0].startswith("gen x = 1") and formatted[0].endswith("// a=b")
+    assert formatted[1:] == ['display "a,b"', "replace y = x, by(z)"]
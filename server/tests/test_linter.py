@@ -0,0 +1,114 @@
+import os
+import random
+
+import server.constants as constants
+from server.linter import (
+    INITIAL_STATE,
+    LineState,
+    LintRun,
+    indent_message,
+    lint_line,
+    lint_lines,
+)
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), "example.do")
+
+
+def _example_lines():
+    with open(EXAMPLE) as f:
+        return f.read().splitlines(True)
+
+
+def test_lint_line_state():
+    state, diags = lint_line("foreach x of varlist a b {\n", INITIAL_STATE, 80, 4)
+    assert state == LineState(False, 1, 0)
+    assert diags == ()
+
+    state, diags = lint_line("/* start of a block\n", INITIAL_STATE, 80, 4)
+    assert state.isInComm
+
+
+def test_incremental_matches_full_lint():
+    rng = random.Random(0)
+    snippets = [
+        "gen x = 3\n",
+        "replace x= 10\n",
+        "/* open\n",
+        "close */\n",
+        "foreach v of varlist a b {\n",
+        "}\n",
+        "reg y x ///\n",
+        "    , robust\n",
+        '    display "a+b" //1+1\n',
+    ]
+    lines = _example_lines() * 20
+    result = lint_lines(lines)
+
+    for _ in range(200):
+        lines = list(lines)
+        pos = rng.randrange(len(lines) + 1)
+        if rng.random() < 0.5 and lines:
+            del lines[min(pos, len(lines) - 1)]
+        else:
+            lines.insert(pos, rng.choice(snippets))
+
+        # In chunks, as the server lints large documents
+        run = LintRun(lines, previous=result)
+        while not run.advance(run.lineno + rng.randrange(1, 50)):
+            pass
+        result = run.result()
+        full = lint_lines(lines)
+        assert result.states == full.states
+        assert result.line_diagnostics == full.line_diagnostics
+
+
+def test_incremental_stops_at_matching_checkpoint():
+    lines = _example_lines() * 100
+    result = lint_lines(lines)
+    lines[5] = "gen  z = 1\n"
+    result = lint_lines(lines, previous=result)
+    assert result.relinted < 10
+
+
+def _messages(lines, max_line_length=80):
+    result = lint_lines(lines, config=(max_line_length, 4))
+    return [[diag.message for diag in diags] for diags in result.line_diagnostics]
+
+
+def test_indented_star_comments_are_checked_for_indentation():
+    messages = _messages(
+        [
+            "  * misplaced\n",
+            "* commented out code\n",
+            "foreach v in a {\n",
+            "    * in the loop\n",
+            "  * misplaced in the loop\n",
+            "* commented out in the loop\n",
+            "}\n",
+        ]
+    )
+    assert messages == [[indent_message(0)], [], [], [], [indent_message(4)], [], []]
+
+
+def test_line_length_inside_and_after_block_comments():
+    long = "x" * 30
+    messages = _messages(
+        [
+            f"/* {long}\n",  # opens a comment, nothing else
+            f"{long}\n",  # inside the comment
+            f"*/ gen {long} = 1\n",  # code after the comment
+            f"* {long}\n",
+            f"// {long}\n",
+        ],
+        max_line_length=20,
+    )
+    too_long = [constants.MAX_LINE_LENGTH_MESSAGE]
+    assert messages == [[], too_long, too_long, [], []]
+
+
+def test_percent_is_not_an_operator():
+    assert _messages(["gen y = 5%2\n", "format x %9.2f\n", "gen z=1\n"]) == [
+        [],
+        [],
+        [constants.OP_WHITESPACE_MESSAGE] * 2,
+    ]
@@ -0,0 +1,71 @@
+import random
+
+from lsprotocol.types import Position, Range, TextDocumentContentChangeEvent_Type1
+
+from server.document import StataDocument
+from server.occurrences import COMMAND, NAME, OccurrenceIndex
+from server.symbols import GLOBAL, LOCAL
+
+SOURCE = """\
+local n = 10
+gen n = `n' * 2 // n in a comment
+global root "n"
+forvalues i = 1/`n' {
+    display $root ${root} `i'
+}
+"""
+
+
+def _index(text, version=0):
+    return OccurrenceIndex().update(StataDocument("file:///a.do", text, version=version))
+
+
+def test_namespaces():
+    index = _index(SOURCE)
+    assert index.spans((LOCAL, "n")) == [(0, 6, 7), (1, 9, 10), (3, 17, 18)]
+    assert index.spans((NAME, "n")) == [(1, 4, 5)]
+    assert index.spans((GLOBAL, "root")) == [(2, 7, 11), (4, 13, 17), (4, 20, 24)]
+    assert index.spans((LOCAL, "i")) == [(3, 10, 11), (4, 27, 28)]
+
+
+def test_commands_prefixes_and_keywords():
+    index = _index(
+        "quietly: gen gen = 1\n"
+        "bysort id: replace gen = _n\n"
+        "program define helper\n"
+        "foreach v of varlist gen id {\n"
+    )
+    assert index.spans((COMMAND, "gen")) == [(0, 9, 12)]
+    assert index.spans((NAME, "gen")) == [(0, 13, 16), (1, 19, 22), (3, 21, 24)]
+    assert index.spans((NAME, "id")) == [(1, 7, 9), (3, 25, 27)]
+    assert index.spans((NAME, "helper")) == [(2, 15, 21)]
+    for word in ("quietly", "bysort", "_n", "define", "of", "varlist"):
+        assert index.spans((NAME, word)) == []
+
+
+def test_occurrences_at_cursor():
+    index = _index(SOURCE)
+    assert index.occurrences(1, 10) == index.spans((LOCAL, "n"))
+    assert index.occurrences(1, 5) == index.spans((NAME, "n"))
+    assert index.occurrences(1, 20) == []  # inside the comment
+    assert index.at(99, 0) is None
+
+
+def test_incremental_update_matches_full():
+    rng = random.Random(5)
+    pieces = ["gen a = `b'\n", "/* ", "*/\n", "local b 2\n", '"a b"', "$c ", "\n"]
+    document = StataDocument("file:///a.do", SOURCE, version=0)
+    index = OccurrenceIndex().update(document)
+    for version in range(1, 200):
+        lines = document.lines
+        line = rng.randrange(len(lines))
+        start = Position(line=line, character=rng.randrange(len(lines[line])))
+        end = Position(line=line, character=len(lines[line].rstrip("\n")))
+        document.apply_change(
+            TextDocumentContentChangeEvent_Type1(
+                range=Range(start=start, end=end), text=rng.choice(pieces)
+            )
+        )
+        document.set_version(version)
+        index.update(document)
+        assert index.values == _index(document.source).values
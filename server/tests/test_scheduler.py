@@ -0,0 +1,76 @@
+import asyncio
+
+from server.scheduler import DiagnosticsScheduler
+
+
+def test_burst_is_merged_into_one_run():
+    linted, published = [], []
+
+    async def scenario():
+        scheduler = DiagnosticsScheduler(
+            lint=lambda uri, version: linted.append((uri, version)) or [version],
+            publish=lambda uri, version, diags: published.append((uri, version, diags)),
+            delay=0.01,
+        )
+        for version in range(1, 6):
+            scheduler.schedule("file:///a.do", version)
+        assert scheduler.queue_depth == 1
+        await asyncio.sleep(0.05)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert linted == [("file:///a.do", 5)]
+    assert published == [("file:///a.do", 5, [5])]
+    assert scheduler.merged == 4
+    assert scheduler.queue_depth == 0
+
+
+def test_superseded_run_is_dropped():
+    published = []
+
+    async def scenario():
+        async def lint(uri, version):
+            await asyncio.sleep(0.02)
+            return [version]
+
+        scheduler = DiagnosticsScheduler(
+            lint=lint,
+            publish=lambda uri, version, diags: published.append(version),
+            delay=0,
+        )
+        scheduler.schedule("file:///a.do", 1)
+        await asyncio.sleep(0.005)  # run for version 1 is in flight
+        scheduler.schedule("file:///a.do", 2)
+        await asyncio.sleep(0.1)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert published == [2]
+    assert scheduler.dropped == 1
+
+
+def test_in_order_runs_one_after_the_other_skipping_edited_documents():
+    linted, published = [], []
+
+    async def scenario():
+        async def lint(uri, version):
+            linted.append(uri)
+            await asyncio.sleep(0.01)
+            return [version]
+
+        scheduler = DiagnosticsScheduler(
+            lint=lint,
+            publish=lambda uri, version, diags: published.append(uri),
+            delay=0.05,
+        )
+        scheduler.schedule("file:///edited.do", 2)
+        scheduler.schedule_in_order(
+            [("file:///a.do", 1), ("file:///edited.do", 1), ("file:///b.do", 1)]
+        )
+        await asyncio.sleep(0.005)
+        assert scheduler.queue_depth == 2  # a.do running, edited.do waiting
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert linted[:2] == ["file:///a.do", "file:///b.do"]
+    assert sorted(published) == ["file:///a.do", "file:///b.do", "file:///edited.do"]
@@ -0,0 +1,109 @@
+import random
+
+from lsprotocol.types import Position, Range, TextDocumentContentChangeEvent_Type1
+
+from server.document import StataDocument
+from server.lexer import tokenize_line
+from server.semantic import TOKEN_MODIFIERS, TOKEN_TYPES, SemanticTokensIndex, line_tokens
+
+SOURCE = """\
+local n = 10
+quietly gen double x = log(`n') // n in a comment
+regress y x ///
+    by, vce(robust)
+/* block
+   comment */ display `"compound "quoted""'
+"""
+
+
+def _index(text, version=0):
+    return SemanticTokensIndex().update(StataDocument("file:///a.do", text, version=version))
+
+
+def _decode(text, data):
+    """(line, text, type, modifiers) of the encoded tokens."""
+    lines = text.splitlines()
+    decoded = []
+    line = start = 0
+    for offset in range(0, len(data), 5):
+        delta_line, delta_start, length, token_type, modifiers = data[offset : offset + 5]
+        line += delta_line
+        start = delta_start if delta_line else start + delta_start
+        modifier_names = [m for i, m in enumerate(TOKEN_MODIFIERS) if modifiers & 1 << i]
+        decoded.append(
+            (line, lines[line][start : start + length], TOKEN_TYPES[token_type], modifier_names)
+        )
+    return decoded
+
+
+def test_classification():
+    tokens = _decode(SOURCE, _index(SOURCE).data)
+    assert tokens == [
+        (0, "local", "keyword", []),
+        (0, "n", "macro", ["declaration"]),
+        (0, "=", "operator", []),
+        (0, "10", "number", []),
+        (1, "quietly", "keyword", []),
+        (1, "gen", "keyword", []),
+        (1, "double", "variable", []),
+        (1, "x", "variable", ["declaration"]),
+        (1, "=", "operator", []),
+        (1, "log", "function", []),
+        (1, "`n'", "macro", []),
+        (1, "// n in a comment", "comment", []),
+        (2, "regress", "keyword", []),
+        (2, "y", "variable", []),
+        (2, "x", "variable", []),
+        (2, "///", "comment", []),
+        # Continued lines do not start a command
+        (3, "by", "variable", []),
+        (3, "vce", "function", []),
+        (3, "robust", "variable", []),
+        (4, "/* block", "comment", []),
+        (5, "   comment */", "comment", []),
+        (5, "display", "keyword", []),
+        (5, '`"compound "quoted""\'', "string", []),
+    ]
+
+
+def _spans(encoded):
+    spans, start = [], 0
+    for offset in range(0, len(encoded), 5):
+        start += encoded[offset + 1]
+        spans.append((start, encoded[offset + 2]))
+    return spans
+
+
+def test_columns_in_client_units():
+    line = 'gen s = "😋" + x'
+    tokens, _ = tokenize_line(line)
+    # The emoji is two UTF-16 code units
+    assert _spans(line_tokens(line, tokens)) == [(0, 3), (4, 1), (6, 1), (8, 4), (13, 1), (15, 1)]
+    assert _spans(line_tokens(line, tokens, encoding="utf-32"))[3:] == [(8, 3), (12, 1), (14, 1)]
+
+
+def test_deltas_rebuild_the_new_array():
+    rng = random.Random(3)
+    pieces = ["gen a = `b'\n", "/* ", "*/\n", "local b 2\n", '"a b"', "$c ", "///\n", "\n"]
+    document = StataDocument("file:///a.do", SOURCE, version=0)
+    index = SemanticTokensIndex().update(document)
+    result_id, client = index.full()
+    client = client.tolist()
+    for version in range(1, 200):
+        lines = document.lines
+        line = rng.randrange(len(lines))
+        start = Position(line=line, character=rng.randrange(len(lines[line])))
+        end = Position(line=line, character=len(lines[line].rstrip("\n")))
+        document.apply_change(
+            TextDocumentContentChangeEvent_Type1(
+                range=Range(start=start, end=end), text=rng.choice(pieces)
+            )
+        )
+        document.set_version(version)
+        result_id, edits = index.update(document).delta(result_id)
+        for start, delete_count, data in reversed(edits):
+            assert start % 5 == 0 and delete_count % 5 == 0
+            client[start : start + delete_count] = data.tolist()
+        assert client == _index(document.source).data.tolist()
+
+    assert index.delta("stale") is None
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+from lsprotocol.types import ClientCapabilities, InitializeParams, TextDocumentItem
+
+from server.server import stata_server
+from server.sessions import SessionHost
+from server.settings import FolderSettings, Settings
+
+URI = "file:///project/a.do"
+SOURCE = "if x {\n  gen y = 1\n}\n"
+
+
+def _open(session):
+    session.lsp.lsp_initialize(InitializeParams(capabilities=ClientCapabilities()))
+    session.workspace.put_text_document(TextDocumentItem(URI, "stata", 1, SOURCE))
+
+
+def _messages(session):
+    """The messages of the diagnostics published for ``URI``."""
+    published = []
+    session.publish_diagnostics = lambda uri, diagnostics, version=None: published.extend(
+        diagnostics
+    )
+
+    async def lint():
+        session.diagnostics_scheduler.schedule(URI, 1, delay=0)
+        while session.diagnostics_scheduler.queue_depth:
+            await asyncio.sleep(0.01)
+
+    session.loop.run_until_complete(lint())
+    return [finding.message for finding in published]
+
+
+def test_sessions_keep_their_own_documents_and_settings(tmp_path):
+    host = SessionHost(stata_server)
+    a, b = host.open_session(), host.open_session()
+    _open(a)
+    _open(b)
+    b.client_settings = FolderSettings(Settings.from_constants()._replace(indent_space=2), {})
+
+    assert a.workspace is not b.workspace
+    assert set(a.lsp.fm.features) == set(b.lsp.fm.features) == set(stata_server.lsp.fm.features)
+    assert a.workers is b.workers is host.workers
+    assert any(message.startswith("inappropriate indented") for message in _messages(a))
+    assert _messages(b) == []
+
+    # Sessions with the same folders share one workspace index
+    a.workspace_index = host.workspace_index([str(tmp_path)], a.workspace_index)
+    b.workspace_index = host.workspace_index([str(tmp_path)], b.workspace_index)
+    assert a.workspace_index is b.workspace_index
+    host.close_session(a)
+    assert host.stats() == {"open": 1, "opened": 2, "sharedIndexes": 1}
+    host.close_session(b)
+    assert host.stats() == {"open": 0, "opened": 2, "sharedIndexes": 0}
+
+
+async def _request(reader, writer, message_id, method, params=None):
+    message = {"jsonrpc": "2.0", "method": method, "params": params}
+    if message_id is not None:
+        message["id"] = message_id
+    body = json.dumps(message).encode("utf-8")
+    writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    if message_id is None:
+        return None
+    while True:
+        headers = await reader.readuntil(b"\r\n\r\n")
+        length = int(headers.split(b"Content-Length:")[1].split(b"\r\n")[0])
+        response = json.loads(await reader.readexactly(length))
+        if response.get("id") == message_id and "method" not in response:
+            return response
+
+
+def test_each_tcp_connection_gets_a_session():
+    host = SessionHost(stata_server)
+
+    async def scenario():
+        listener = await host.listen_tcp("127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        clients = [await asyncio.open_connection("127.0.0.1", port) for _ in range(2)]
+        for reader, writer in clients:
+            response = await _request(
+                reader, writer, 1, "initialize", {"processId": None, "capabilities": {}}
+            )
+            assert response["result"]["serverInfo"]["name"] == "stata-language-server"
+        assert len(host.sessions) == 2
+
+        # exit ends the client's session, not the process
+        reader, writer = clients[0]
+        await _request(reader, writer, 2, "shutdown")
+        await _request(reader, writer, None, "exit")
+        assert await reader.read() == b""
+        await asyncio.sleep(0)
+        assert len(host.sessions) == 1
+
+        reader, writer = clients[1]
+        assert (await _request(reader, writer, 2, "shutdown"))["result"] is None
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        await asyncio.sleep(0.01)
+
+    stata_server.loop.run_until_complete(scenario())
+    assert host.stats()["open"] == 0
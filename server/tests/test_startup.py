@@ -0,0 +1,53 @@
+"""Start up budgets, profiled with ``python -X importtime`` in a fresh interpreter."""
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Milliseconds, a few times what a laptop measures (about 100 ms for the
+# command line, 130 ms for the server's own modules on top of lsprotocol)
+CLI_IMPORT_BUDGET_MS = 500
+SERVER_MODULES_BUDGET_MS = 500
+
+
+def import_times(statement):
+    """Run ``statement``; return its stdout and {module: (self ms, cumulative ms)}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[0].strip().isdigit():
+            times[fields[2].strip()] = (int(fields[0]) / 1e3, int(fields[1]) / 1e3)
+    return result.stdout, times
+
+
+def slowest(times, count=5):
+    ranked = sorted(times.items(), key=lambda item: item[1][0], reverse=True)
+    return ", ".join(f"{name} {self_ms:.1f} ms" for name, (self_ms, _) in ranked[:count])
+
+
+def test_command_line_does_not_load_the_lsp_stack():
+    _, times = import_times("import server.__main__")
+
+    assert not [name for name in times if name.startswith(("lsprotocol", "pygls"))]
+    assert times["server.__main__"][1] < CLI_IMPORT_BUDGET_MS, slowest(times)
+
+
+def test_server_import_defers_completion_data():
+    statement = (
+        "import server.server\n"
+        "from server.completion import command_index\n"
+        "print(command_index.cache_info().currsize)"
+    )
+    output, times = import_times(statement)
+
+    assert output.strip() == "0"
+    own = {name: value for name, value in times.items() if name.split(".")[0] == "server"}
+    assert sum(self_ms for self_ms, _ in own.values()) < SERVER_MODULES_BUDGET_MS, slowest(own)
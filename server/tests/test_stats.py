@@ -0,0 +1,32 @@
+from server.stats import LatencyHistogram, ServerStats, summary_line
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.record(ms / 1000)
+    histogram.record(2.0, error=True)
+    summary = histogram.summary()
+    assert summary["count"] == 101 and summary["errors"] == 1
+    # Bucket bounds are within 20% above the exact value
+    assert 50 <= summary["p50Ms"] <= 60
+    assert 95 <= summary["p95Ms"] <= 115
+    assert summary["maxMs"] == 2000.0
+    assert LatencyHistogram().percentile(50) == 0.0
+
+
+def test_snapshot_and_summary_line():
+    stats = ServerStats()
+    stats.record("textDocument/hover", 0.002)
+    stats.record("textDocument/hover", 0.004)
+    stats.record("textDocument/definition", 0.030)
+    stats.cache("LintResult", True)
+    stats.cache("LintResult", False)
+    stats.cache("LintResult", True)
+
+    snapshot = stats.snapshot()
+    assert snapshot["methods"]["textDocument/hover"]["count"] == 2
+    assert snapshot["caches"]["LintResult"] == {"hits": 2, "misses": 1, "hitRate": 0.6667}
+    line = summary_line(snapshot, slowest=1)
+    assert line.startswith("3 messages in ")
+    assert "textDocument/definition p50=" in line and "hover" not in line
@@ -0,0 +1,43 @@
+from server.symbols import (
+    GLOBAL,
+    LOCAL,
+    PROGRAM,
+    VARIABLE,
+    Edge,
+    extract_symbols,
+)
+
+SOURCE = """\
+program define clean_data, rclass
+    quietly gen double price2 = price^2
+    by foreign: egen mean_price = mean(price)
+    tempvar a b
+    local n = _N
+end
+program list
+gl root "C:/project"
+rename price cost
+cap noisily do "analysis/run models.do", nostop
+include helpers.do
+* gen commented = 1
+"""
+
+
+def test_extract_symbols():
+    symbols, edges = extract_symbols(SOURCE.splitlines(keepends=True))
+    assert [(s.name, s.kind, s.line) for s in symbols] == [
+        ("clean_data", PROGRAM, 0),
+        ("price2", VARIABLE, 1),
+        ("mean_price", VARIABLE, 2),
+        ("a", LOCAL, 3),
+        ("b", LOCAL, 3),
+        ("n", LOCAL, 4),
+        ("root", GLOBAL, 7),
+        ("cost", VARIABLE, 8),
+    ]
+    lines = SOURCE.splitlines()
+    assert all(lines[s.line][s.start : s.end] == s.name for s in symbols)
+    assert edges == (
+        Edge("do", "analysis/run models.do", 9),
+        Edge("include", "helpers.do", 10),
+    )
@@ -0,0 +1,42 @@
+import random
+
+from lsprotocol.types import TextDocumentContentChangeEvent_Type1
+
+from server.document import StataDocument
+from server.textdiff import diff_lines, text_edits
+
+
+def _apply(text, new_text):
+    document = StataDocument("file:///a.do", text)
+    edits = text_edits(document.lines, new_text.splitlines(keepends=True))
+    for edit in reversed(edits):
+        document.apply_change(
+            TextDocumentContentChangeEvent_Type1(range=edit.range, text=edit.new_text)
+        )
+    return document.source, edits
+
+
+def test_only_changed_lines_are_sent():
+    old = ["gen x=1\n", "keep\n", "reg y x\n", "keep\n"]
+    new = ["gen x = 1\n", "keep\n", "keep\n", "list\n"]
+    assert diff_lines(old, new) == [
+        (0, 1, ["gen x = 1\n"]),
+        (2, 3, []),
+        (4, 4, ["list\n"]),
+    ]
+    assert diff_lines(old, old) == []
+
+
+def test_edits_apply_to_the_formatted_text():
+    rng = random.Random(2)
+    pieces = ["a\n", "b\n", "c\n", "d", ""]
+    for _ in range(500):
+        old = "".join(rng.choice(pieces) for _ in range(rng.randrange(8)))
+        new = "".join(rng.choice(pieces) for _ in range(rng.randrange(8)))
+        assert _apply(old, new)[0] == new
+
+
+def test_unterminated_last_line():
+    source, edits = _apply("a\nb", "a\nb\nc")
+    assert source == "a\nb\nc"
+    assert [edit.range.start.line for edit in edits] == [1]
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pytest
+
+from server.workers import Cancelled, WorkerPool
+
+
+def _spin(job, started, stopped):
+    started.set()
+    try:
+        while True:
+            job.checkpoint()
+    except Cancelled:
+        stopped.set()
+        raise
+
+
+def test_cancelling_the_request_stops_the_work():
+    pool = WorkerPool(1)
+    started, stopped = threading.Event(), threading.Event()
+
+    async def scenario():
+        task = asyncio.ensure_future(pool.run(_spin, started, stopped))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert stopped.wait(5)
+    assert pool.stats() == {"running": 0, "completed": 0, "cancelled": 1}
+    pool.close()
+
+
+def test_stale_work_stops():
+    pool = WorkerPool(1)
+    version = [1]
+    started, stopped = threading.Event(), threading.Event()
+
+    async def scenario():
+        task = asyncio.ensure_future(
+            pool.run(_spin, started, stopped, stale=lambda: version[0] != 1)
+        )
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        version[0] = 2
+        with pytest.raises(Cancelled):
+            await task
+        # The pool is free for the next job
+        assert await pool.run(lambda job, x: x + 1, 1) == 2
+
+    asyncio.run(scenario())
+    assert stopped.is_set()
+    assert pool.stats() == {"running": 0, "completed": 1, "cancelled": 1}
+    pool.close()
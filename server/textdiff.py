@@ -0,0 +1,136 @@
+"""Line diff turning a reformatted text into minimal ``TextEdit``s.
+
+Lines are interned to integers first so the diff compares ints, the common
+head and tail are trimmed, and the rest goes through Myers' O((N+M)D)
+shortest edit script.  Past ``MAX_EDIT_DISTANCE`` differing lines the
+middle is replaced as a single hunk instead.
+"""
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Sequence
+
+if TYPE_CHECKING:
+    from lsprotocol.types import TextEdit
+
+MAX_EDIT_DISTANCE = 1000
+SNAKE_STEP = 32
+
+
+class Hunk(NamedTuple):
+    """Old lines ``[start, end)`` are replaced by ``lines``."""
+
+    start: int
+    end: int
+    lines: List[str]
+
+
+def _intern(old: Sequence[str], new: Sequence[str]):
+    ids: Dict[str, int] = {}
+    return (
+        [ids.setdefault(line, len(ids)) for line in old],
+        [ids.setdefault(line, len(ids)) for line in new],
+    )
+
+
+def _myers(a: List[int], b: List[int]) -> List[tuple] | None:
+    """Matching runs of a shortest edit script, or None past the limit."""
+    n, m = len(a), len(b)
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    trace = []
+    for d in range(min(n + m, MAX_EDIT_DISTANCE) + 1):
+        trace.append(v[offset - d : offset + d + 1])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]  # down: insertion
+            else:
+                x = v[offset + k - 1] + 1  # right: deletion
+            y = x - k
+            # Follow the diagonal, comparing slices first as long runs match
+            while x + SNAKE_STEP <= n and y + SNAKE_STEP <= m and (
+                a[x : x + SNAKE_STEP] == b[y : y + SNAKE_STEP]
+            ):
+                x += SNAKE_STEP
+                y += SNAKE_STEP
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+
+def _backtrack(trace: List[List[int]], x: int, y: int) -> List[tuple]:
+    """Walk the trace back to the matching ``(old, new, length)`` runs."""
+    runs = []
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]  # v[d + k] is the furthest x on diagonal k before step d
+        k = x - y
+        if k == -d or (k != d and v[d + k - 1] < v[d + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[d + prev_k]
+        start_x = prev_x if prev_k == k + 1 else prev_x + 1
+        if x > start_x:
+            runs.append((start_x, start_x - k, x - start_x))
+        x, y = prev_x, prev_x - prev_k
+    if x > 0:
+        runs.append((0, 0, x))
+    runs.reverse()
+    return runs
+
+
+def diff_lines(old: Sequence[str], new: Sequence[str]) -> List[Hunk]:
+    """The hunks turning ``old`` into ``new``."""
+    a, b = _intern(old, new)
+    head = 0
+    limit = min(len(a), len(b))
+    while head < limit and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+    a_mid = a[head : len(a) - tail]
+    b_mid = b[head : len(b) - tail]
+    if not a_mid and not b_mid:
+        return []
+
+    runs = _myers(a_mid, b_mid)
+    if runs is None:
+        return [Hunk(head, len(a) - tail, list(new[head : len(b) - tail]))]
+
+    hunks = []
+    i = j = 0
+    for x, y, length in runs + [(len(a_mid), len(b_mid), 0)]:
+        if x > i or y > j:
+            hunks.append(Hunk(head + i, head + x, list(new[head + j : head + y])))
+        i, j = x + length, y + length
+    return hunks
+
+
+def text_edits(old: Sequence[str], new: Sequence[str], first_line: int = 0) -> List["TextEdit"]:
+    """Minimal edits turning lines ``old`` (at ``first_line``) into ``new``.
+
+    Lines keep their line endings, as ``TextDocument.lines`` does.
+    """
+    # Only the server needs the LSP types; ``diff_lines`` alone serves the CLI
+    from lsprotocol.types import Position, Range, TextEdit
+
+    hunks = diff_lines(old, new)
+    edits = []
+    for start, end, lines in hunks:
+        if end == len(old) and old and not old[-1].endswith("\n"):
+            # Hunks touching an unterminated last line end at its last character
+            if start == end:
+                start -= 1
+                lines = [old[start]] + lines
+            end_pos = Position(line=first_line + end - 1, character=len(old[-1]))
+        else:
+            end_pos = Position(line=first_line + end, character=0)
+        edits.append(
+            TextEdit(
+                range=Range(start=Position(line=first_line + start, character=0), end=end_pos),
+                new_text="".join(lines),
+            )
+        )
+    return edits
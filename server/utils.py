@@ -2,31 +2,61 @@ import os
 from lsprotocol.types import (CompletionItem, CompletionList,
                              CompletionItemKind, MarkupContent)
 from functools import lru_cache
+from typing import List, Optional
 import json
 
+from .docpack import DocPack
+
 # Get the absolute path to the directory containing this script
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-@lru_cache(maxsize=64)
+DOCS_PACK = os.path.join(BASE_DIR, 'md_syntax.pack')
+EMPTY_DOCSTRING = MarkupContent(kind='markdown', value='')
+
+
+@lru_cache(maxsize=None)
+def getDocPack() -> Optional[DocPack]:
+    """Return the packed hover docs, or None to read the loose md_syntax files."""
+    if not os.path.exists(DOCS_PACK):
+        return None
+    return DocPack(DOCS_PACK)
+
+
 def getDocstringFromWord(word: str, doc_path: str = 'md_syntax') -> MarkupContent:
-    doc_path = os.path.join(BASE_DIR, doc_path)  # Resolve to absolute path
+    pack = getDocPack() if doc_path == 'md_syntax' else None
+    if pack is not None and word not in pack:
+        # Most hovers are on variable names, answer those without a lookup
+        return EMPTY_DOCSTRING
+    return _loadDocstring(word, doc_path)
 
-    try:
-        with open(os.path.join(doc_path, word + ".md"), 'r') as f:
-            docstring = f.read()
-    except FileNotFoundError:
-        docstring = ""
+
+@lru_cache(maxsize=256)
+def _loadDocstring(word: str, doc_path: str) -> MarkupContent:
+    pack = getDocPack() if doc_path == 'md_syntax' else None
+    if pack is not None:
+        docstring = pack.get(word) or ""
+    else:
+        doc_path = os.path.join(BASE_DIR, doc_path)  # Resolve to absolute path
+        try:
+            with open(os.path.join(doc_path, word + ".md"), 'r') as f:
+                docstring = f.read()
+        except FileNotFoundError:
+            docstring = ""
     return MarkupContent(
             kind='markdown',
             value=docstring
     )
 
 
-def getComList(doc_path: str = 'commands.json') -> CompletionList:
+def getCommands(doc_path: str = 'commands.json') -> List[str]:
     doc_path = os.path.join(BASE_DIR, doc_path)  # Resolve to absolute path
     with open(doc_path, 'r') as jf:
         jstr = jf.read()
-    cmd_list = json.loads(jstr)["syntax"]
+    return json.loads(jstr)["syntax"]
+
+
+def getComList(doc_path: str = 'commands.json') -> CompletionList:
+    cmd_list = getCommands(doc_path)
     itemList = []
     for cmd in cmd_list:
         comItem = CompletionItem(label=str(cmd), kind=CompletionItemKind.Function)
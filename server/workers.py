@@ -0,0 +1,87 @@
+"""CPU heavy handler work run off the event loop, stopping once it is not wanted.
+
+Formatting and linting whole documents run in a small thread pool on
+snapshots of a document version (its text, line list and token stream
+lists, none of which an edit mutates), so hover and completion are
+answered while they run.  The work calls ``Job.checkpoint`` every few
+hundred lines: it raises ``Cancelled`` when the awaiting request was
+cancelled (``$/cancelRequest`` cancels the handler's task) or its document
+version moved on, and otherwise briefly releases the GIL so the event loop
+thread gets it without waiting for the interpreter's switch interval.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+class Cancelled(Exception):
+    """Raised at a checkpoint of work that is no longer wanted."""
+
+
+class Job:
+    """Cancellation state of one piece of work, passed to it as first argument."""
+
+    __slots__ = ("cancelled", "stale")
+
+    def __init__(self, stale: Optional[Callable[[], bool]] = None):
+        self.cancelled = False
+        self.stale = stale  # called from the worker; true once the result is useless
+
+    def checkpoint(self) -> None:
+        """Stop if cancelled or stale, else let other threads run."""
+        if self.cancelled or (self.stale is not None and self.stale()):
+            raise Cancelled
+        time.sleep(0)
+
+
+class WorkerPool:
+    """Threads running ``Job``s for the handlers of one event loop."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.running = 0
+        self.completed = 0
+        self.cancelled = 0  # by the client or because the document changed
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="stata-worker"
+            )
+        return self._executor
+
+    async def run(self, function, *args, stale: Optional[Callable[[], bool]] = None):
+        """Await ``function(job, *args)`` in the pool.
+
+        Cancelling the awaiting task cancels the job; ``Cancelled`` is raised
+        when the job stopped because it went stale.
+        """
+        job = Job(stale)
+        self.running += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, function, job, *args
+            )
+        except (Cancelled, asyncio.CancelledError):
+            job.cancelled = True
+            self.cancelled += 1
+            raise
+        finally:
+            self.running -= 1
+        self.completed += 1
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
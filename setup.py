@@ -1,4 +1,25 @@
+import importlib.util
+import os
+
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+
+
+class build_py_with_docpack(build_py):
+    """Pack server/md_syntax/*.md into server/md_syntax.pack for installation."""
+
+    def run(self):
+        super().run()
+        here = os.path.dirname(os.path.abspath(__file__))
+        spec = importlib.util.spec_from_file_location(
+            "docpack", os.path.join(here, "server", "docpack.py")
+        )
+        docpack = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(docpack)
+        out_path = os.path.join(self.build_lib, "server", "md_syntax.pack")
+        self.mkpath(os.path.dirname(out_path))
+        docpack.build_pack_from_dir(os.path.join(here, "server", "md_syntax"), out_path)
+
 
 setup(
     name="stata-language-server",
@@ -13,7 +34,11 @@ setup(
         ],
     },
     package_data={
-        'server': ['commands.json', 'md_syntax/*.md'],
+        'server': ['commands.json'],
+    },
+    exclude_package_data={
+        'server': ['md_syntax/*.md'],
     },
     include_package_data=True,
+    cmdclass={"build_py": build_py_with_docpack},
 )